@@ -0,0 +1,346 @@
+import os
+import re
+import time
+import threading
+from collections import namedtuple
+from datetime import date
+import streamlit as st
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from urllib3.util.retry import Retry
+from metricas import medir, contar, cronometrado
+
+
+# ========== CONFIGURACIÓN ==========
+
+ALEGRA_API_URL = os.getenv("ALEGRA_API_URL", "https://api.alegra.com/api/v1")
+ALEGRA_API_KEY = os.getenv(
+    "ALEGRA_API_KEY",
+    "bmFub3Ryb25pY3NhbHNvbmRlbGF0ZWNub2xvZ2lhQGdtYWlsLmNvbTphMmM4OTA3YjE1M2VmYTc0ODE5ZA=="
+)
+WAREHOUSE_ID = 1
+
+# Conexiones keep-alive por proceso: una por scanner concurrente con margen
+POOL_CONEXIONES = 20
+
+# Timeouts separados (segundos): conectar debe fallar rápido, leer puede tardar más
+TIMEOUT_CONEXION = 5
+TIMEOUT_LECTURA = 20
+
+# Reintentos ante 429/5xx con espera exponencial (0.5 s, 1 s, 2 s...)
+REINTENTOS = 3
+FACTOR_ESPERA = 0.5
+ESTADOS_REINTENTO = (429, 500, 502, 503, 504)
+
+# Items por documento de ajuste al enviar por lote
+TAMANO_LOTE_AJUSTES = 50
+
+# Máximo de items por página que acepta el listado /items
+LIMITE_PAGINA_ITEMS = 30
+
+# Respuestas de validación: el documento no se creó y puede reenviarse en partes
+ESTADOS_VALIDACION = (400, 422)
+
+# Circuit breaker: fallos de conexión seguidos (cada uno ya con sus reintentos)
+# que dan a Alegra por caída, y segundos entre sondeos mientras lo está
+UMBRAL_FALLOS = 3
+ESPERA_CIRCUITO = 30
+
+
+# ========== DISPONIBILIDAD ==========
+
+class AlegraNoDisponible(requests.exceptions.ConnectionError):
+    """El circuito está abierto: la petición no se hizo."""
+
+
+class Circuito:
+    """Circuit breaker de las peticiones a Alegra del proceso.
+
+    Tras UMBRAL_FALLOS fallos de conexión seguidos (o respuestas 5xx) se abre
+    y las peticiones fallan al instante con AlegraNoDisponible, sin esperar
+    timeouts. Mientras está abierto solo pasa un sondeo cada `espera`
+    segundos (lo hace el hilo de sincronización); la primera respuesta
+    de Alegra lo vuelve a cerrar.
+    """
+
+    def __init__(self, umbral=UMBRAL_FALLOS, espera=ESPERA_CIRCUITO):
+        self.umbral = umbral
+        self.espera = espera
+        self._lock = threading.Lock()
+        self.fallos = 0
+        self.abierto = False
+        self.abierto_desde = None
+        self.proximo_sondeo = 0.0
+
+    def permitir(self, sondeo=False):
+        """True si la petición puede hacerse; un sondeo pasa si ya le toca."""
+        with self._lock:
+            if not self.abierto:
+                return True
+            if sondeo and time.time() >= self.proximo_sondeo:
+                # El siguiente sondeo espera aunque este se quede colgado
+                self.proximo_sondeo = time.time() + self.espera
+                return True
+            return False
+
+    def exito(self):
+        with self._lock:
+            self.fallos = 0
+            if self.abierto:
+                self.abierto = False
+                self.abierto_desde = None
+                contar("alegra_circuito cerrado")
+
+    def fallo(self):
+        with self._lock:
+            self.fallos += 1
+            if not self.abierto and self.fallos >= self.umbral:
+                self.abierto = True
+                self.abierto_desde = time.time()
+                self.proximo_sondeo = time.time() + self.espera
+                contar("alegra_circuito abierto")
+
+
+# ========== CLIENTE HTTP ==========
+
+class ReintentoAlegra(Retry):
+    """Política de reintentos que no duplica ajustes.
+
+    Un POST solo se reintenta ante 429, cuando Alegra rechazó la petición sin
+    procesarla; ante un 5xx el ajuste pudo haberse creado.
+    """
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method.upper() == "POST":
+            return status_code == 429
+        return super().is_retry(method, status_code, has_retry_after)
+
+    def increment(self, method=None, url=None, *args, **kwargs):
+        contar(f"alegra_reintentos {method}")
+        return super().increment(method, url, *args, **kwargs)
+
+
+class ClienteAlegra:
+    """Cliente HTTP compartido con pool de conexiones keep-alive hacia Alegra."""
+
+    def __init__(self, api_url, api_key):
+        self.api_url = api_url.rstrip("/")
+        self.timeout = (TIMEOUT_CONEXION, TIMEOUT_LECTURA)
+        self.circuito = Circuito()
+
+        # read=0: un timeout de lectura no se reintenta. El servidor aceptó la conexión
+        # y no respondió; repetir multiplicaría la espera del escaneo (y la del circuito)
+        reintentos = ReintentoAlegra(
+            total=REINTENTOS,
+            read=0,
+            backoff_factor=FACTOR_ESPERA,
+            status_forcelist=ESTADOS_REINTENTO,
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adaptador = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=POOL_CONEXIONES,
+            max_retries=reintentos
+        )
+
+        self.sesion = requests.Session()
+        self.sesion.mount("https://", adaptador)
+        self.sesion.mount("http://", adaptador)
+        self.sesion.headers.update({
+            "accept": "application/json",
+            "authorization": f"Basic {api_key}"
+        })
+
+    def _pedir(self, metodo, ruta, sondeo=False, **kwargs):
+        """Hace la petición midiendo su latencia y contando el estado HTTP por ruta.
+
+        Con el circuito abierto lanza AlegraNoDisponible sin salir a la red,
+        salvo que sea un `sondeo` y ya toque uno.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        operacion = f"alegra {metodo} {re.sub(r'/[0-9]+', '/{id}', ruta)}"
+        if not self.circuito.permitir(sondeo):
+            contar(f"{operacion} -> sin conexión")
+            raise AlegraNoDisponible("Sin conexión con Alegra: se reintenta en segundo plano")
+        try:
+            with medir(operacion):
+                response = self.sesion.request(metodo, f"{self.api_url}{ruta}", **kwargs)
+        except requests.exceptions.RequestException as e:
+            contar(f"{operacion} -> {type(e).__name__}")
+            self.circuito.fallo()
+            raise
+        contar(f"{operacion} -> {response.status_code}")
+        if response.status_code >= 500:
+            self.circuito.fallo()
+        else:
+            self.circuito.exito()
+        return response
+
+    def get(self, ruta, **kwargs):
+        """GET a una ruta de la API, p. ej. "/items/10"."""
+        return self._pedir("GET", ruta, **kwargs)
+
+    def post(self, ruta, **kwargs):
+        """POST a una ruta de la API."""
+        return self._pedir("POST", ruta, **kwargs)
+
+
+@st.cache_resource
+def obtener_cliente_alegra(api_url=ALEGRA_API_URL, api_key=ALEGRA_API_KEY):
+    """Retorna el cliente de Alegra único del proceso."""
+    return ClienteAlegra(api_url, api_key)
+
+
+def alegra_disponible():
+    """False mientras el circuito hacia Alegra está abierto en este proceso."""
+    return not obtener_cliente_alegra().circuito.abierto
+
+
+def alegra_caida_desde():
+    """Hora (epoch) en que se abrió el circuito, o None si Alegra está disponible."""
+    return obtener_cliente_alegra().circuito.abierto_desde
+
+
+def sondear_alegra():
+    """Si le toca, prueba con una petición mínima si Alegra volvió. Retorna si está disponible."""
+    try:
+        obtener_cliente_alegra().get("/items", params={"start": 0, "limit": 1}, sondeo=True)
+    except requests.exceptions.RequestException:
+        pass
+    return alegra_disponible()
+
+
+# ========== ITEMS ==========
+
+def extraer_datos_item(item_data):
+    """Extrae los datos relevantes de la respuesta de la API de Alegra."""
+    if not item_data:
+        return None
+
+    nombre = item_data.get("name", "Sin nombre")
+    inventory = item_data.get("inventory", {})
+    cantidad_disponible = inventory.get("availableQuantity", 0)
+    costo_unitario = inventory.get("unitCost", 0)
+
+    price_list = item_data.get("price", [])
+    precio = 0
+    if price_list and len(price_list) > 0:
+        precio = price_list[0].get("price", 0)
+
+    return {
+        "nombre": nombre,
+        "cantidad_disponible": float(cantidad_disponible) if cantidad_disponible else 0,
+        "costo_unitario": float(costo_unitario) if costo_unitario else 0,
+        "precio": float(precio) if precio else 0
+    }
+
+
+def listar_items(inicio, limite=LIMITE_PAGINA_ITEMS, con_total=False, cliente=None):
+    """Retorna una página del listado de items.
+
+    Con `con_total` pide la metadata y retorna (items, total); si no,
+    retorna solo la lista. Lanza RequestException si falla.
+    """
+    cliente = cliente or obtener_cliente_alegra()
+    params = {"start": inicio, "limit": limite}
+    if con_total:
+        params["metadata"] = "true"
+    response = cliente.get("/items", params=params)
+    response.raise_for_status()
+    cuerpo = response.json()
+    if not con_total:
+        return cuerpo
+    if isinstance(cuerpo, dict):
+        return cuerpo.get("data", []), cuerpo.get("metadata", {}).get("total")
+    # Sin soporte de metadata: el total se desconoce
+    return cuerpo, None
+
+
+# ========== AJUSTES DE INVENTARIO ==========
+
+def item_ajuste(item_id, tipo, cantidad, costo):
+    """Arma una entrada de `items` para un ajuste de inventario."""
+    return {
+        "id": str(item_id),
+        "type": tipo,
+        "quantity": float(cantidad),
+        "unitCost": float(costo) if costo else 0
+    }
+
+
+@cronometrado("enviar_ajuste_inventario")
+def enviar_ajuste_inventario(items, fecha=None, bodega_id=WAREHOUSE_ID):
+    """Crea un documento de ajuste con uno o varios items y retorna la respuesta.
+
+    Lanza requests.exceptions.RequestException si Alegra no lo acepta.
+    """
+    payload = {
+        "date": (fecha or date.today()).isoformat(),
+        "warehouse": {"id": str(bodega_id)},
+        "items": items
+    }
+    response = obtener_cliente_alegra().post("/inventory-adjustments", json=payload)
+    response.raise_for_status()
+    return response.json()
+
+
+# Resultado por item de un envío por lote. `reintentable` indica que Alegra
+# con seguridad no creó el documento (no hubo conexión o respondió 429)
+ResultadoAjuste = namedtuple("ResultadoAjuste", ["ok", "detalle", "reintentable"])
+
+
+def _detalle_error(error):
+    response = getattr(error, "response", None)
+    if response is not None:
+        return f"HTTP {response.status_code}: {response.text[:200]}"
+    return str(error)
+
+
+def _sin_enviar(error):
+    """True si el error garantiza que la petición no llegó a procesarse."""
+    if isinstance(error, AlegraNoDisponible):
+        return True
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.HTTPError):
+        return error.response is not None and error.response.status_code == 429
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        # Conexión rechazada o DNS caído; una conexión cortada a mitad es ambigua
+        return isinstance(getattr(error.args[0], "reason", None), NewConnectionError)
+    return False
+
+
+def enviar_ajustes_en_lotes(items, fecha=None, bodega_id=WAREHOUSE_ID, tamano_lote=TAMANO_LOTE_AJUSTES):
+    """Envía los items en documentos de hasta `tamano_lote` entradas.
+
+    Retorna una lista paralela a `items` de ResultadoAjuste con el id del
+    documento o el detalle del error. Si Alegra rechaza un documento por validación
+    (nada se creó) se parte en mitades para aislar los items inválidos y
+    enviar el resto. Ante timeouts o 5xx el documento pudo haberse creado,
+    así que sus items quedan como fallidos sin reenviarse.
+    """
+    resultados = [None] * len(items)
+
+    def enviar(posiciones):
+        try:
+            respuesta = enviar_ajuste_inventario([items[p] for p in posiciones], fecha, bodega_id)
+            for p in posiciones:
+                resultados[p] = ResultadoAjuste(True, respuesta.get("id"), False)
+        except requests.exceptions.HTTPError as e:
+            estado = e.response.status_code if e.response is not None else None
+            if estado in ESTADOS_VALIDACION and len(posiciones) > 1:
+                mitad = len(posiciones) // 2
+                enviar(posiciones[:mitad])
+                enviar(posiciones[mitad:])
+            else:
+                for p in posiciones:
+                    resultados[p] = ResultadoAjuste(False, _detalle_error(e), _sin_enviar(e))
+        except requests.exceptions.RequestException as e:
+            for p in posiciones:
+                resultados[p] = ResultadoAjuste(False, _detalle_error(e), _sin_enviar(e))
+
+    for inicio in range(0, len(items), tamano_lote):
+        enviar(list(range(inicio, min(inicio + tamano_lote, len(items)))))
+    return resultados
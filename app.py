@@ -1,9 +1,34 @@
+import os
+import json
+import time
 import streamlit as st
 import pandas as pd
-import threading
-import os
 import requests
-from datetime import datetime, date
+from datetime import date, datetime
+from alegra import obtener_cliente_alegra, extraer_datos_item, alegra_disponible, alegra_caida_desde
+from inventario import (
+    COL_CODIGO, COL_NOMBRE, COL_BARRAS, COL_CANTIDAD_ACTUAL,
+    cargar_datos, progreso_conteo, registrar_conteo_por_codigo, buscar_producto, buscar_filas_por_barras,
+    buscar_productos_por_nombre, procesar_archivo_subido, reporte_colisiones_barras,
+    exportar_inventario_csv, pagina_productos, ESTADO_TODOS, ESTADO_CONTADOS, ESTADO_SIN_CONTAR
+)
+from sincronizacion import (
+    ESTADO_RECONCILIAR, ESTADO_PENDIENTE, ESTADO_ENVIANDO, ESTADO_ENVIADO, ESTADO_FALLIDO,
+    encolar_ajuste, cancelar_pendiente, ultimo_ajuste_item, resumen_cola, listar_fallidos,
+    reintentar_fallidos, iniciar_trabajador, despertar_trabajador
+)
+from stock_alegra import guardar_stock, leer_stock_precargado, resumen_precarga, precargar_stock
+from log_ajustes import (
+    LIMITE_HISTORIAL, pagina_log, contar_ajustes, ajustes_por_dia, exportar_log_csv
+)
+from metricas import cronometrado, registrar_duracion, resumen_metricas, reiniciar_metricas
+from perfilador import (
+    iniciar_perfil, al_iniciar_ejecucion, al_terminar_ejecucion, estado_perfil,
+    perfil_folded, funciones_mas_lentas, descartar_perfil
+)
+
+# Duración de la ejecución completa del script, aunque la corte st.rerun/st.stop
+inicio_rerun = time.perf_counter()
 
 # Configuración de la página
 st.set_page_config(
@@ -12,499 +37,157 @@ st.set_page_config(
     layout="centered"
 )
 
-# ========== ESTILOS CSS Y JAVASCRIPT ==========
-
-st.markdown("""
-<style>
-/* Indicadores visuales de diferencia */
-.diff-ok {
-    background: linear-gradient(135deg, #00c853 0%, #69f0ae 100%);
-    color: white;
-    padding: 20px;
-    border-radius: 15px;
-    text-align: center;
-    font-size: 24px;
-    font-weight: bold;
-    box-shadow: 0 4px 15px rgba(0, 200, 83, 0.4);
-    animation: pulse-green 2s infinite;
-}
-
-.diff-warning {
-    background: linear-gradient(135deg, #ff9800 0%, #ffcc02 100%);
-    color: white;
-    padding: 20px;
-    border-radius: 15px;
-    text-align: center;
-    font-size: 24px;
-    font-weight: bold;
-    box-shadow: 0 4px 15px rgba(255, 152, 0, 0.4);
-    animation: pulse-yellow 2s infinite;
-}
-
-.diff-danger {
-    background: linear-gradient(135deg, #f44336 0%, #ff5252 100%);
-    color: white;
-    padding: 20px;
-    border-radius: 15px;
-    text-align: center;
-    font-size: 24px;
-    font-weight: bold;
-    box-shadow: 0 4px 15px rgba(244, 67, 54, 0.4);
-    animation: pulse-red 2s infinite;
-}
-
-@keyframes pulse-green {
-    0%, 100% { transform: scale(1); }
-    50% { transform: scale(1.02); }
-}
-
-@keyframes pulse-yellow {
-    0%, 100% { transform: scale(1); }
-    50% { transform: scale(1.02); }
-}
-
-@keyframes pulse-red {
-    0%, 100% { transform: scale(1); }
-    50% { transform: scale(1.02); }
-}
-
-/* Historial de sesión */
-.historial-item {
-    background: #f8f9fa;
-    border-left: 4px solid #007bff;
-    padding: 10px 15px;
-    margin: 5px 0;
-    border-radius: 0 8px 8px 0;
-    font-size: 14px;
-}
-
-.historial-item.success {
-    border-left-color: #28a745;
-}
-
-.historial-item.warning {
-    border-left-color: #ffc107;
-}
-
-/* Contador de progreso grande */
-.progress-big {
-    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-    color: white;
-    padding: 15px 25px;
-    border-radius: 15px;
-    text-align: center;
-    margin: 10px 0;
-}
-
-.progress-big .number {
-    font-size: 36px;
-    font-weight: bold;
-}
-
-.progress-big .label {
-    font-size: 14px;
-    opacity: 0.9;
-}
-
-/* Modo rápido activo */
-.modo-rapido-activo {
-    background: linear-gradient(135deg, #00b4db 0%, #0083b0 100%);
-    color: white;
-    padding: 10px 20px;
-    border-radius: 25px;
-    text-align: center;
-    font-weight: bold;
-    margin: 10px 0;
-}
-
-/* Input numérico móvil */
-input[type="number"] {
-    font-size: 32px !important;
-    text-align: center !important;
-    padding: 15px !important;
-    height: 70px !important;
-}
-
-/* Inputs de texto grandes (código de barras y nombre) */
-.stTextInput input {
-    font-size: 24px !important;
-    padding: 15px 20px !important;
-    height: 60px !important;
-    border-radius: 10px !important;
-}
-
-/* Input de cantidad extra grande */
-.big-number-input input[type="number"] {
-    font-size: 48px !important;
-    height: 90px !important;
-    font-weight: bold !important;
-}
-
-/* Tarjeta de producto seleccionable */
-.producto-card {
-    background: white;
-    border: 2px solid #e0e0e0;
-    border-radius: 12px;
-    padding: 15px 20px;
-    margin: 8px 0;
-    cursor: pointer;
-    transition: all 0.2s ease;
-}
-
-.producto-card:hover {
-    border-color: #667eea;
-    box-shadow: 0 4px 12px rgba(102, 126, 234, 0.3);
-    transform: translateY(-2px);
-}
-
-.producto-card .nombre {
-    font-size: 16px;
-    font-weight: bold;
-    color: #333;
-    margin-bottom: 5px;
-}
-
-.producto-card .info {
-    font-size: 13px;
-    color: #666;
-}
-
-/* Atajos de teclado tooltip */
-.keyboard-hint {
-    background: #e9ecef;
-    color: #495057;
-    padding: 3px 8px;
-    border-radius: 4px;
-    font-size: 12px;
-    font-family: monospace;
-}
-</style>
-""", unsafe_allow_html=True)
+# Si un administrador pidió perfilar, se muestrea esta ejecución hasta que termine
+al_iniciar_ejecucion()
 
-# JavaScript para auto-focus, sonidos y atajos de teclado
-st.markdown("""
-<script>
-// Auto-focus en el campo de código de barras
-document.addEventListener('DOMContentLoaded', function() {
-    const barcodeInput = document.querySelector('input[data-testid="stTextInput"]');
-    if (barcodeInput) {
-        barcodeInput.focus();
-    }
-});
-
-// Función para reproducir sonidos (usando Web Audio API)
-function playSound(type) {
-    const audioContext = new (window.AudioContext || window.webkitAudioContext)();
-    const oscillator = audioContext.createOscillator();
-    const gainNode = audioContext.createGain();
-    
-    oscillator.connect(gainNode);
-    gainNode.connect(audioContext.destination);
-    
-    if (type === 'success') {
-        oscillator.frequency.setValueAtTime(880, audioContext.currentTime);
-        oscillator.frequency.setValueAtTime(1100, audioContext.currentTime + 0.1);
-        gainNode.gain.setValueAtTime(0.3, audioContext.currentTime);
-        gainNode.gain.exponentialRampToValueAtTime(0.01, audioContext.currentTime + 0.3);
-        oscillator.start(audioContext.currentTime);
-        oscillator.stop(audioContext.currentTime + 0.3);
-    } else if (type === 'error') {
-        oscillator.frequency.setValueAtTime(300, audioContext.currentTime);
-        oscillator.frequency.setValueAtTime(200, audioContext.currentTime + 0.2);
-        gainNode.gain.setValueAtTime(0.3, audioContext.currentTime);
-        gainNode.gain.exponentialRampToValueAtTime(0.01, audioContext.currentTime + 0.4);
-        oscillator.start(audioContext.currentTime);
-        oscillator.stop(audioContext.currentTime + 0.4);
-    } else if (type === 'warning') {
-        oscillator.frequency.setValueAtTime(500, audioContext.currentTime);
-        gainNode.gain.setValueAtTime(0.2, audioContext.currentTime);
-        gainNode.gain.exponentialRampToValueAtTime(0.01, audioContext.currentTime + 0.2);
-        oscillator.start(audioContext.currentTime);
-        oscillator.stop(audioContext.currentTime + 0.2);
-    }
-}
-</script>
-""", unsafe_allow_html=True)
+try:
+    # ========== ESTILOS CSS Y JAVASCRIPT ==========
 
+    # Se sirven desde static/ (server.enableStaticServing) y el navegador los guarda
+    # en caché: cada rerun solo envía las etiquetas que los referencian, no su contenido
+    DIR_ESTATICOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
 
-# ========== CONFIGURACIÓN ==========
 
-ARCHIVO_INVENTARIO = "inventario.csv"
-ARCHIVO_LOG = "log_ajustes.csv"
-LOCK = threading.Lock()
+    def url_estatico(archivo):
+        """URL de un archivo de static/ con su fecha de modificación para invalidar la caché."""
+        version = int(os.path.getmtime(os.path.join(DIR_ESTATICOS, archivo)))
+        return f"app/static/{archivo}?v={version}"
 
-# Columnas del CSV
-COL_CODIGO = "Codigo"
-COL_NOMBRE = "Nombre"
-COL_STOCK = "Cantidad inicial en bodega: Principal"
-COL_BARRAS = "Codigo de barras"
-COL_CANTIDAD_ACTUAL = "cantidad_actual"
 
-# API Alegra
-ALEGRA_API_URL = "https://api.alegra.com/api/v1"
-ALEGRA_API_KEY = os.getenv(
-    "ALEGRA_API_KEY",
-    "bmFub3Ryb25pY3NhbHNvbmRlbGF0ZWNub2xvZ2lhQGdtYWlsLmNvbTphMmM4OTA3YjE1M2VmYTc0ODE5ZA=="
-)
-WAREHOUSE_ID = 1
+    st.markdown(
+        f'<link rel="stylesheet" href="{url_estatico("estilos.css")}">'
+        f'<script src="{url_estatico("sonidos.js")}"></script>',
+        unsafe_allow_html=True
+    )
 
-# ========== INICIALIZAR SESSION STATE ==========
 
-if "historial_sesion" not in st.session_state:
-    st.session_state.historial_sesion = []
+    # ========== CONFIGURACIÓN ==========
 
-if "modo_rapido" not in st.session_state:
-    st.session_state.modo_rapido = False
 
-if "ultimo_producto" not in st.session_state:
-    st.session_state.ultimo_producto = None
+    # Segundos que se reutiliza la consulta de un item antes de volver a pedirlo a Alegra
+    TTL_SNAPSHOT_ALEGRA = 60
 
-if "buscar_por" not in st.session_state:
-    st.session_state.buscar_por = "codigo_barras"
+    # El panel de métricas solo aparece abriendo la app con ?admin=<ADMIN_TOKEN>
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
-if "auto_submit" not in st.session_state:
-    st.session_state.auto_submit = True
+    # ========== INICIALIZAR SESSION STATE ==========
 
-if "sonidos_activos" not in st.session_state:
-    st.session_state.sonidos_activos = True
+    if "historial_sesion" not in st.session_state:
+        st.session_state.historial_sesion = []
 
-if "codigo_actual" not in st.session_state:
-    st.session_state.codigo_actual = ""
+    if "modo_rapido" not in st.session_state:
+        st.session_state.modo_rapido = False
 
-if "producto_seleccionado" not in st.session_state:
-    st.session_state.producto_seleccionado = None
+    if "ultimo_producto" not in st.session_state:
+        st.session_state.ultimo_producto = None
 
-if "mostrar_opciones_nombre" not in st.session_state:
-    st.session_state.mostrar_opciones_nombre = False
+    if "buscar_por" not in st.session_state:
+        st.session_state.buscar_por = "codigo_barras"
 
+    if "auto_submit" not in st.session_state:
+        st.session_state.auto_submit = True
 
-# ========== FUNCIONES DE API ALEGRA ==========
+    if "sonidos_activos" not in st.session_state:
+        st.session_state.sonidos_activos = True
 
-def consultar_item_alegra(item_id):
-    """Consulta un item en la API de Alegra."""
-    try:
-        url = f"{ALEGRA_API_URL}/items/{item_id}"
-        headers = {
-            "accept": "application/json",
-            "authorization": f"Basic {ALEGRA_API_KEY}"
-        }
-        response = requests.get(url, headers=headers, timeout=30)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        st.error(f"Error al consultar Alegra: {e}")
-        return None
+    if "codigo_actual" not in st.session_state:
+        st.session_state.codigo_actual = ""
 
+    if "producto_seleccionado" not in st.session_state:
+        st.session_state.producto_seleccionado = None
 
-def crear_ajuste_inventario(item_id, tipo, cantidad, costo):
-    """Crea un ajuste de inventario en Alegra."""
-    try:
-        url = f"{ALEGRA_API_URL}/inventory-adjustments"
-        headers = {
-            "accept": "application/json",
-            "authorization": f"Basic {ALEGRA_API_KEY}",
-            "content-type": "application/json"
-        }
-        payload = {
-            "date": date.today().isoformat(),
-            "warehouse": {"id": str(WAREHOUSE_ID)},
-            "items": [{
-                "id": str(item_id),
-                "type": tipo,
-                "quantity": float(cantidad),
-                "unitCost": float(costo) if costo else 0
-            }]
-        }
-        response = requests.post(url, headers=headers, json=payload, timeout=30)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        st.error(f"Error al crear ajuste en Alegra: {e}")
-        return None
+    if "mostrar_opciones_nombre" not in st.session_state:
+        st.session_state.mostrar_opciones_nombre = False
 
+    if "snapshots_alegra" not in st.session_state:
+        st.session_state.snapshots_alegra = {}
 
-def extraer_datos_item(item_data):
-    """Extrae los datos relevantes de la respuesta de la API de Alegra."""
-    if not item_data:
-        return None
-    
-    nombre = item_data.get("name", "Sin nombre")
-    inventory = item_data.get("inventory", {})
-    cantidad_disponible = inventory.get("availableQuantity", 0)
-    costo_unitario = inventory.get("unitCost", 0)
-    
-    price_list = item_data.get("price", [])
-    precio = 0
-    if price_list and len(price_list) > 0:
-        precio = price_list[0].get("price", 0)
-    
-    return {
-        "nombre": nombre,
-        "cantidad_disponible": float(cantidad_disponible) if cantidad_disponible else 0,
-        "costo_unitario": float(costo_unitario) if costo_unitario else 0,
-        "precio": float(precio) if precio else 0
-    }
-
-
-# ========== FUNCIONES DE LOG ==========
-
-def guardar_log_ajuste(codigo_barras, item_id, nombre, precio, cantidad_anterior, cantidad_nueva, diferencia, tipo_ajuste):
-    """Guarda un registro en el log de ajustes."""
-    log_entry = {
-        "fecha_hora": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "codigo_barras": codigo_barras,
-        "id_alegra": item_id,
-        "nombre": nombre,
-        "precio": precio,
-        "cantidad_anterior": cantidad_anterior,
-        "cantidad_nueva": cantidad_nueva,
-        "diferencia": diferencia,
-        "tipo_ajuste": tipo_ajuste
-    }
-    
-    with LOCK:
-        if os.path.exists(ARCHIVO_LOG):
-            df_log = pd.read_csv(ARCHIVO_LOG)
-            df_log = pd.concat([df_log, pd.DataFrame([log_entry])], ignore_index=True)
-        else:
-            df_log = pd.DataFrame([log_entry])
-        
-        df_log.to_csv(ARCHIVO_LOG, index=False)
+    if "verificar_stock" not in st.session_state:
+        st.session_state.verificar_stock = False
 
 
-def cargar_log():
-    """Carga el log de ajustes si existe."""
-    if os.path.exists(ARCHIVO_LOG):
-        try:
-            return pd.read_csv(ARCHIVO_LOG)
-        except Exception:
-            return pd.DataFrame()
-    return pd.DataFrame()
-
-
-# ========== FUNCIONES DE HISTORIAL DE SESIÓN ==========
-
-def agregar_al_historial(codigo_barras, nombre, cantidad_alegra, cantidad_contada, estado):
-    """Agrega un producto al historial de la sesión actual."""
-    entry = {
-        "hora": datetime.now().strftime("%H:%M:%S"),
-        "codigo_barras": codigo_barras,
-        "nombre": nombre[:30] + "..." if len(nombre) > 30 else nombre,
-        "cantidad_alegra": cantidad_alegra,
-        "cantidad_contada": cantidad_contada,
-        "estado": estado  # "ok", "ajustado", "error"
-    }
-    st.session_state.historial_sesion.insert(0, entry)
-    # Mantener solo los últimos 50
-    if len(st.session_state.historial_sesion) > 50:
-        st.session_state.historial_sesion = st.session_state.historial_sesion[:50]
-
-
-# ========== FUNCIONES DE DATOS LOCALES ==========
-
-def cargar_datos():
-    """Carga los datos del CSV si existe"""
-    if os.path.exists(ARCHIVO_INVENTARIO):
-        try:
-            df = pd.read_csv(ARCHIVO_INVENTARIO, sep=";", dtype={COL_BARRAS: str, COL_CODIGO: str})
-            df[COL_BARRAS] = df[COL_BARRAS].astype(str).str.strip()
-            df[COL_CODIGO] = df[COL_CODIGO].astype(str).str.strip()
-            if COL_CANTIDAD_ACTUAL not in df.columns:
-                df[COL_CANTIDAD_ACTUAL] = ""
-            return df
-        except Exception as e:
-            st.error(f"Error al cargar el archivo: {e}")
-            return None
-    return None
+    # ========== FUNCIONES DE API ALEGRA ==========
 
+    def obtener_snapshot_alegra(item_id):
+        """Retorna la consulta guardada en la sesión para el item si no ha vencido."""
+        snapshot = st.session_state.snapshots_alegra.get(str(item_id))
+        if snapshot and time.time() - snapshot["obtenido"] < TTL_SNAPSHOT_ALEGRA:
+            return snapshot
+        return None
 
-def guardar_datos(df):
-    """Guarda los datos al CSV con bloqueo para concurrencia"""
-    with LOCK:
-        df.to_csv(ARCHIVO_INVENTARIO, sep=";", index=False)
 
+    def invalidar_snapshot_alegra(item_id):
+        """Descarta la consulta guardada en la sesión para el item."""
+        st.session_state.snapshots_alegra.pop(str(item_id), None)
 
-def buscar_producto(df, termino_busqueda, tipo_busqueda="codigo_barras"):
-    """Busca un producto por código de barras o por nombre"""
-    termino = str(termino_busqueda).strip()
-    
-    if tipo_busqueda == "codigo_barras":
-        resultado = df[df[COL_BARRAS] == termino]
-        if not resultado.empty:
-            return resultado.index[0], resultado.iloc[0]
-    else:  # buscar por nombre - no retorna nada, usa buscar_productos_por_nombre
-        pass
+
+    @cronometrado("consultar_item_alegra")
+    def consultar_item_alegra(item_id, forzar=False):
+        """Consulta un item en la API de Alegra, reutilizando la consulta reciente de la sesión."""
+        if not forzar:
+            snapshot = obtener_snapshot_alegra(item_id)
+            if snapshot:
+                return snapshot["datos"]
     
-    return None, None
+        try:
+            response = obtener_cliente_alegra().get(f"/items/{item_id}")
+            response.raise_for_status()
+            item_data = response.json()
+            st.session_state.snapshots_alegra[str(item_id)] = {
+                "datos": item_data,
+                "obtenido": time.time()
+            }
+            guardar_stock(item_id, item_data)
+            return item_data
+        except requests.exceptions.RequestException as e:
+            # Sin conexión no es un error del item: quien llama sigue con la última foto del stock
+            if alegra_disponible():
+                st.error(f"Error al consultar Alegra: {e}")
+            return None
 
 
-def buscar_productos_por_nombre(df, termino_busqueda, limite=10):
-    """Busca productos que contengan el término en el nombre y retorna múltiples resultados."""
-    termino = str(termino_busqueda).strip()
-    if not termino or len(termino) < 2:
-        return pd.DataFrame()
-    
-    # Buscar coincidencias parciales
-    resultado = df[df[COL_NOMBRE].str.contains(termino, case=False, na=False)]
-    return resultado.head(limite)
-
-
-def procesar_archivo_subido(archivo):
-    """Procesa el archivo subido y lo guarda"""
-    try:
-        if archivo.name.endswith('.csv'):
-            contenido = archivo.getvalue().decode('utf-8')
-            if ';' in contenido[:1000]:
-                df = pd.read_csv(archivo, sep=";", dtype={COL_BARRAS: str, COL_CODIGO: str})
-            else:
-                df = pd.read_csv(archivo, dtype={COL_BARRAS: str, COL_CODIGO: str})
-        else:
-            df = pd.read_excel(archivo, dtype={COL_BARRAS: str, COL_CODIGO: str})
-        
-        columnas_requeridas = [COL_CODIGO, COL_BARRAS]
-        columnas_faltantes = [c for c in columnas_requeridas if c not in df.columns]
-        
-        if columnas_faltantes:
-            st.error(f"Faltan columnas requeridas: {columnas_faltantes}")
-            return False
-        
-        df[COL_BARRAS] = df[COL_BARRAS].astype(str).str.strip()
-        df[COL_CODIGO] = df[COL_CODIGO].astype(str).str.strip()
-        
-        if COL_CANTIDAD_ACTUAL not in df.columns:
-            df[COL_CANTIDAD_ACTUAL] = ""
-        
-        guardar_datos(df)
-        return True
-    except Exception as e:
-        st.error(f"Error al procesar el archivo: {e}")
-        return False
+    # ========== FUNCIONES DE HISTORIAL DE SESIÓN ==========
+
+    def agregar_al_historial(codigo_barras, nombre, cantidad_alegra, cantidad_contada, estado):
+        """Agrega un producto al historial de la sesión actual."""
+        entry = {
+            "hora": datetime.now().strftime("%H:%M:%S"),
+            "codigo_barras": codigo_barras,
+            "nombre": nombre[:30] + "..." if len(nombre) > 30 else nombre,
+            "cantidad_alegra": cantidad_alegra,
+            "cantidad_contada": cantidad_contada,
+            "estado": estado  # "ok", "ajustado", "en_cola", "sin_conexion", "error"
+        }
+        st.session_state.historial_sesion.insert(0, entry)
+        # Mantener solo los últimos 50
+        if len(st.session_state.historial_sesion) > 50:
+            st.session_state.historial_sesion = st.session_state.historial_sesion[:50]
 
 
-# ========== FUNCIONES DE UI ==========
+    # ========== FUNCIONES DE UI ==========
 
-def mostrar_indicador_diferencia(diferencia):
-    """Muestra un indicador visual grande según la diferencia."""
-    abs_diff = abs(diferencia)
+    def mostrar_indicador_diferencia(diferencia):
+        """Muestra un indicador visual grande según la diferencia."""
+        abs_diff = abs(diferencia)
     
-    if diferencia == 0:
-        st.markdown("""
+        if diferencia == 0:
+            st.markdown("""
         <div class="diff-ok">
             ✅ COINCIDE<br>
             <small>El conteo es igual al stock</small>
         </div>
         """, unsafe_allow_html=True)
-    elif abs_diff <= 2:
-        signo = "+" if diferencia > 0 else ""
-        st.markdown(f"""
+        elif abs_diff <= 2:
+            signo = "+" if diferencia > 0 else ""
+            st.markdown(f"""
         <div class="diff-warning">
             ⚠️ DIFERENCIA: {signo}{diferencia:.0f}<br>
             <small>Pequeña diferencia detectada</small>
         </div>
         """, unsafe_allow_html=True)
-    else:
-        signo = "+" if diferencia > 0 else ""
-        st.markdown(f"""
+        else:
+            signo = "+" if diferencia > 0 else ""
+            st.markdown(f"""
         <div class="diff-danger">
             🚨 DIFERENCIA: {signo}{diferencia:.0f}<br>
             <small>Diferencia significativa</small>
@@ -512,202 +195,531 @@ def mostrar_indicador_diferencia(diferencia):
         """, unsafe_allow_html=True)
 
 
-def mostrar_historial_sesion():
-    """Muestra el historial de productos escaneados en la sesión."""
-    if not st.session_state.historial_sesion:
-        st.info("No hay productos escaneados en esta sesión")
-        return
+    def mostrar_historial_sesion():
+        """Muestra el historial de productos escaneados en la sesión."""
+        if not st.session_state.historial_sesion:
+            st.info("No hay productos escaneados en esta sesión")
+            return
     
-    for item in st.session_state.historial_sesion[:10]:  # Mostrar últimos 10
-        estado_color = {
-            "ok": "success",
-            "ajustado": "warning",
-            "error": ""
-        }.get(item["estado"], "")
+        for item in st.session_state.historial_sesion[:10]:  # Mostrar últimos 10
+            estado_color = {
+                "ok": "success",
+                "ajustado": "warning",
+                "en_cola": "warning",
+                "sin_conexion": "warning",
+                "error": ""
+            }.get(item["estado"], "")
         
-        diferencia = item["cantidad_contada"] - item["cantidad_alegra"]
-        diff_texto = f"({'+' if diferencia > 0 else ''}{diferencia:.0f})" if diferencia != 0 else "(=)"
+            if item["cantidad_alegra"] is None:
+                # Contado sin conexión y sin foto del stock
+                alegra_texto, diff_texto = "?", "(?)"
+            else:
+                diferencia = item["cantidad_contada"] - item["cantidad_alegra"]
+                alegra_texto = f"{item['cantidad_alegra']:.0f}"
+                diff_texto = f"({'+' if diferencia > 0 else ''}{diferencia:.0f})" if diferencia != 0 else "(=)"
         
-        st.markdown(f"""
+            st.markdown(f"""
         <div class="historial-item {estado_color}">
             <strong>{item['hora']}</strong> - {item['nombre']}<br>
-            <small>📊 Alegra: {item['cantidad_alegra']:.0f} → Contado: {item['cantidad_contada']:.0f} {diff_texto}</small>
+            <small>📊 Alegra: {alegra_texto} → Contado: {item['cantidad_contada']:.0f} {diff_texto}</small>
         </div>
         """, unsafe_allow_html=True)
 
 
-def limpiar_para_nuevo_escaneo():
-    """Limpia el estado para un nuevo escaneo."""
-    if "mostrar_confirmacion" in st.session_state:
-        del st.session_state.mostrar_confirmacion
-    if "datos_ajuste" in st.session_state:
-        del st.session_state.datos_ajuste
-    st.session_state.codigo_actual = ""
-    st.session_state.producto_seleccionado = None
+    def limpiar_para_nuevo_escaneo():
+        """Limpia el estado para un nuevo escaneo."""
+        if "mostrar_confirmacion" in st.session_state:
+            del st.session_state.mostrar_confirmacion
+        if "datos_ajuste" in st.session_state:
+            del st.session_state.datos_ajuste
+        st.session_state.codigo_actual = ""
+        st.session_state.producto_seleccionado = None
 
 
-# ========== INTERFAZ PRINCIPAL ==========
+    def es_admin():
+        """True si la sesión abrió la app con el token de administración."""
+        return bool(ADMIN_TOKEN) and st.query_params.get("admin") == ADMIN_TOKEN
 
-st.title("📦 Inventario Scanner")
-st.markdown("Escanea códigos de barras para actualizar inventario en **Alegra** en tiempo real")
 
-# Sidebar para administración
-with st.sidebar:
-    st.header("⚙️ Configuración")
+    def mostrar_panel_metricas():
+        """Latencias por operación y contadores de Alegra de este proceso."""
+        metricas = resumen_metricas()
+        desde = datetime.fromtimestamp(metricas["desde"]).strftime("%d/%m %H:%M")
+        st.caption(f"Proceso {metricas['pid']}, desde {desde}. Ordenado por tiempo total.")
     
-    # Toggle de modo rápido
-    st.session_state.modo_rapido = st.toggle(
-        "⚡ Modo Conteo Rápido",
-        value=st.session_state.modo_rapido,
-        help="Auto-guarda al confirmar y limpia para el siguiente escaneo"
-    )
+        latencias = pd.DataFrame([
+            {"operacion": nombre, **{k: v for k, v in datos.items() if k != "tramos"}}
+            for nombre, datos in metricas["latencias"].items()
+        ])
+        if not latencias.empty:
+            st.dataframe(
+                latencias.sort_values("total_s", ascending=False),
+                use_container_width=True,
+                hide_index=True,
+                column_config={
+                    "operacion": st.column_config.TextColumn("Operación"),
+                    "n": st.column_config.NumberColumn("Llamadas"),
+                    "errores": st.column_config.NumberColumn("Errores"),
+                    "media_ms": st.column_config.NumberColumn("Media ms", format="%.1f"),
+                    "p50_ms": st.column_config.NumberColumn("p50 ms"),
+                    "p95_ms": st.column_config.NumberColumn("p95 ms"),
+                    "max_ms": st.column_config.NumberColumn("Máx ms", format="%.0f"),
+                    "total_s": st.column_config.NumberColumn("Total s", format="%.2f")
+                }
+            )
+        if metricas["contadores"]:
+            st.dataframe(
+                pd.DataFrame(list(metricas["contadores"].items()), columns=["contador", "cantidad"]),
+                use_container_width=True,
+                hide_index=True
+            )
     
-    if st.session_state.modo_rapido:
-        st.markdown('<div class="modo-rapido-activo">🚀 MODO RÁPIDO ACTIVO</div>', unsafe_allow_html=True)
+        col_descargar, col_reiniciar = st.columns(2)
+        with col_descargar:
+            st.download_button(
+                "⬇️ JSON",
+                data=json.dumps(metricas, indent=2, ensure_ascii=False),
+                file_name=f"metricas_{datetime.now().strftime('%Y%m%d_%H%M')}.json",
+                mime="application/json",
+                use_container_width=True
+            )
+        with col_reiniciar:
+            if st.button("🧹 Reiniciar", use_container_width=True):
+                reiniciar_metricas()
+                st.rerun()
+
+
+    def mostrar_panel_perfilador():
+        """Muestreo de la pila de las próximas ejecuciones de esta sesión, descargable como flamegraph."""
+        estado = estado_perfil()
+        if estado is None:
+            ejecuciones = st.number_input("Ejecuciones a perfilar", min_value=1, max_value=20, value=3)
+            st.caption("Se muestrean las siguientes ejecuciones del script en esta sesión (escanear, guardar, etc.).")
+            if not st.button("▶️ Perfilar", use_container_width=True):
+                return
+            # Sin st.rerun: esa ejecución extra gastaría una de las pedidas
+            iniciar_perfil(int(ejecuciones))
+            estado = estado_perfil()
     
-    st.session_state.sonidos_activos = st.toggle(
-        "🔊 Sonidos de confirmación",
-        value=st.session_state.sonidos_activos,
-        help="Reproduce sonidos al encontrar/no encontrar productos"
-    )
+        perfiladas, restantes, listo = estado
+        if not listo:
+            st.info(f"⏳ Perfilando: {perfiladas} ejecuciones muestreadas, faltan {restantes}.")
+        else:
+            st.success(f"✅ Perfil de {perfiladas} ejecuciones")
+            st.dataframe(
+                pd.DataFrame(funciones_mas_lentas()),
+                use_container_width=True,
+                hide_index=True,
+                column_config={
+                    "funcion": st.column_config.TextColumn("Función"),
+                    "propio_pct": st.column_config.NumberColumn("% propio", format="%.1f"),
+                    "total_pct": st.column_config.NumberColumn("% total", format="%.1f")
+                }
+            )
+            st.download_button(
+                "⬇️ Perfil (.folded)",
+                data=perfil_folded(),
+                file_name=f"perfil_{datetime.now().strftime('%Y%m%d_%H%M')}.folded",
+                mime="text/plain",
+                use_container_width=True
+            )
+            st.caption("Abrir en speedscope.app o con flamegraph.pl.")
+        if st.button("🗑️ Descartar perfil", use_container_width=True):
+            descartar_perfil()
+            st.rerun()
+
+
+    # ========== INTERFAZ PRINCIPAL ==========
+
+    st.title("📦 Inventario Scanner")
+    st.markdown("Escanea códigos de barras para actualizar inventario en **Alegra** en tiempo real")
+
+    # Sidebar para administración
+    with st.sidebar:
+        st.header("⚙️ Configuración")
     
-    st.divider()
+        # Toggle de modo rápido
+        st.session_state.modo_rapido = st.toggle(
+            "⚡ Modo Conteo Rápido",
+            value=st.session_state.modo_rapido,
+            help="Auto-guarda al confirmar y limpia para el siguiente escaneo"
+        )
     
-    # Subir archivo
-    archivo_subido = st.file_uploader(
-        "📁 Subir inventario",
-        type=['csv', 'xlsx'],
-        help="Sube el archivo CSV o Excel con el inventario"
-    )
+        if st.session_state.modo_rapido:
+            st.markdown('<div class="modo-rapido-activo">🚀 MODO RÁPIDO ACTIVO</div>', unsafe_allow_html=True)
+    
+        st.session_state.sonidos_activos = st.toggle(
+            "🔊 Sonidos de confirmación",
+            value=st.session_state.sonidos_activos,
+            help="Reproduce sonidos al encontrar/no encontrar productos"
+        )
+    
+        st.divider()
+    
+        # Subir archivo
+        archivo_subido = st.file_uploader(
+            "📁 Subir inventario",
+            type=['csv', 'xlsx'],
+            help="Sube el archivo CSV o Excel con el inventario"
+        )
     
-    if archivo_subido:
-        if st.button("📤 Cargar archivo", type="primary"):
-            with st.spinner("Procesando archivo..."):
-                if procesar_archivo_subido(archivo_subido):
-                    st.success("✅ Archivo cargado")
+        if archivo_subido:
+            combinar_carga = st.toggle(
+                "🔀 Conservar conteos y productos que no vienen en el archivo",
+                value=True,
+                help="Actualiza el inventario por Codigo. Desactívalo para reemplazarlo por completo y empezar el conteo de cero"
+            )
+            if st.button("📤 Cargar archivo", type="primary"):
+                barra_carga = st.progress(0.0, text="Procesando archivo...")
+                resumen_carga = procesar_archivo_subido(
+                    archivo_subido,
+                    lambda fraccion, filas: barra_carga.progress(fraccion, text=f"{filas:,} filas leídas"),
+                    combinar=combinar_carga
+                )
+                barra_carga.empty()
+                if resumen_carga:
+                    st.session_state.resumen_carga = resumen_carga
+                    st.session_state.colisiones_carga = reporte_colisiones_barras()
                     st.rerun()
     
-    st.divider()
+        # Resumen de la última carga: filas guardadas y problemas del archivo
+        resumen_carga = st.session_state.pop("resumen_carga", None)
+        if resumen_carga:
+            st.success(f"✅ Archivo cargado: {resumen_carga.filas:,} productos ({resumen_carga.nuevos:,} nuevos)")
+            if resumen_carga.conservados:
+                st.caption(f"{resumen_carga.conservados:,} productos que no venían en el archivo se conservaron")
+            if resumen_carga.conteos_conservados:
+                st.caption(f"{resumen_carga.conteos_conservados:,} conteos ya hechos se conservaron")
+            if resumen_carga.sin_codigo:
+                st.warning(f"⚠️ {resumen_carga.sin_codigo:,} filas sin Codigo se omitieron")
+            if resumen_carga.sin_barras:
+                st.caption(f"{resumen_carga.sin_barras:,} productos sin código de barras (solo se encuentran por nombre)")
+            if resumen_carga.codigos_repetidos:
+                st.caption(f"{resumen_carga.codigos_repetidos:,} filas repiten un Codigo ya usado en el archivo")
     
-    # Contador de progreso grande
-    df = cargar_datos()
-    if df is not None:
-        total_productos = len(df)
-        productos_contados = df[COL_CANTIDAD_ACTUAL].notna() & (df[COL_CANTIDAD_ACTUAL] != "")
-        contados = productos_contados.sum()
+        # Reporte de códigos de barras repetidos del último archivo cargado
+        colisiones = st.session_state.get("colisiones_carga")
+        if colisiones is not None and not colisiones.empty:
+            st.warning(f"⚠️ {len(colisiones)} códigos de barras están asignados a más de un producto")
+            with st.expander("Ver códigos repetidos", expanded=False):
+                st.dataframe(
+                    colisiones,
+                    use_container_width=True,
+                    hide_index=True,
+                    column_config={
+                        "codigo_barras": st.column_config.TextColumn("Código de Barras"),
+                        "productos": st.column_config.TextColumn("IDs Alegra"),
+                        "cantidad": st.column_config.NumberColumn("Productos")
+                    }
+                )
+                if st.button("Ocultar aviso", key="btn_ocultar_colisiones"):
+                    del st.session_state.colisiones_carga
+                    st.rerun()
+    
+        st.divider()
+    
+        # Contador de progreso grande
+        progreso_inventario = progreso_conteo()
+        if progreso_inventario is not None:
+            total_productos = progreso_inventario.total
+            contados = progreso_inventario.contados
         
-        st.markdown(f"""
+            st.markdown(f"""
         <div class="progress-big">
             <div class="number">{contados} / {total_productos}</div>
             <div class="label">Productos contados</div>
         </div>
         """, unsafe_allow_html=True)
         
-        if total_productos > 0:
-            progreso = contados / total_productos
-            st.progress(progreso)
-            st.caption(f"{progreso*100:.1f}% completado")
+            if total_productos > 0:
+                progreso = contados / total_productos
+                st.progress(progreso)
+                st.caption(f"{progreso*100:.1f}% completado")
         
-        st.divider()
+            for columna, conteo in progreso_inventario.desglose.items():
+                with st.expander(f"📊 Avance por {columna.lower()}", expanded=False):
+                    st.dataframe(
+                        pd.DataFrame(
+                            [(grupo, c, t, c / t * 100) for grupo, (c, t) in sorted(conteo.items())],
+                            columns=[columna, "Contados", "Total", "Avance"]
+                        ),
+                        use_container_width=True,
+                        hide_index=True,
+                        column_config={"Avance": st.column_config.ProgressColumn("Avance", format="%.0f%%", min_value=0, max_value=100)}
+                    )
         
-        csv = df.to_csv(sep=";", index=False).encode('utf-8')
-        st.download_button(
-            label="⬇️ Descargar inventario",
-            data=csv,
-            file_name=f"inventario_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-            mime="text/csv"
-        )
+            st.divider()
+        
+            # Los archivos se generan al hacer clic, no en cada rerun
+            st.download_button(
+                label="⬇️ Descargar inventario",
+                data=exportar_inventario_csv,
+                file_name=f"inventario_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+                mime="text/csv"
+            )
     
-    # Log de ajustes
-    df_log = cargar_log()
-    if not df_log.empty:
+        # Log de ajustes
+        total_ajustes = contar_ajustes()
+        if total_ajustes > 0:
+            st.divider()
+            st.subheader("📋 Log de Ajustes")
+            hoy = date.today()
+            st.metric("Ajustes hoy", contar_ajustes(hoy, hoy))
+            st.caption(f"{total_ajustes:,} ajustes registrados en total")
+        
+            st.download_button(
+                label="⬇️ Descargar log",
+                data=exportar_log_csv,
+                file_name=f"log_ajustes_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+                mime="text/csv"
+            )
+    
+        # Foto local del stock de Alegra
         st.divider()
-        st.subheader("📋 Log de Ajustes")
-        st.metric("Ajustes hoy", len(df_log))
+        st.subheader("📥 Stock de Alegra")
+        precarga = resumen_precarga()
+        if precarga["items"]:
+            hora_precarga = datetime.fromtimestamp(precarga["desde"]).strftime("%d/%m %H:%M")
+            st.caption(f"{precarga['items']} items precargados (el más antiguo de {hora_precarga})")
+    
+        if st.button("📥 Precargar stock de Alegra", use_container_width=True):
+            barra = st.progress(0.0, text="Descargando catálogo de Alegra...")
         
-        log_csv = df_log.to_csv(index=False).encode('utf-8')
-        st.download_button(
-            label="⬇️ Descargar log",
-            data=log_csv,
-            file_name=f"log_ajustes_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-            mime="text/csv"
+            def mostrar_progreso(hechas, total):
+                if total:
+                    barra.progress(hechas / total, text=f"Página {hechas} de {total}")
+                else:
+                    barra.progress(0.0, text=f"Página {hechas}")
+        
+            try:
+                guardados, segundos = precargar_stock(mostrar_progreso)
+                barra.empty()
+                st.success(f"✅ {guardados} items precargados en {segundos:.1f} s")
+            except requests.exceptions.RequestException as e:
+                barra.empty()
+                st.error(f"Error al precargar el stock: {e}")
+    
+        st.session_state.verificar_stock = st.toggle(
+            "🔎 Verificar stock antes de ajustar",
+            value=st.session_state.verificar_stock,
+            help="Al guardar un ajuste calculado con la precarga, consulta Alegra y avisa si el stock cambió"
         )
     
-    st.divider()
+        # Estado de la sincronización en segundo plano
+        trabajador = iniciar_trabajador()
+        resumen = resumen_cola()
+        st.divider()
+        st.subheader("🔄 Sincronización Alegra")
+        caida_desde = alegra_caida_desde()
+        if caida_desde:
+            hora_caida = datetime.fromtimestamp(caida_desde).strftime("%H:%M:%S")
+            st.warning(f"📴 Sin conexión con Alegra desde las {hora_caida}. Se sigue contando con la última foto del stock.")
+        col_pendientes, col_enviados = st.columns(2)
+        col_pendientes.metric("Pendientes", resumen[ESTADO_PENDIENTE] + resumen[ESTADO_ENVIANDO])
+        col_enviados.metric("Enviados", resumen[ESTADO_ENVIADO])
+        if resumen[ESTADO_RECONCILIAR]:
+            st.metric(
+                "Por reconciliar", resumen[ESTADO_RECONCILIAR],
+                help="Conteos hechos sin conexión: al volver Alegra se recalcula su diferencia y se envían"
+            )
+        if resumen[ESTADO_FALLIDO]:
+            st.metric("Fallidos", resumen[ESTADO_FALLIDO])
+        if trabajador.ultimo_error:
+            st.error(f"❌ Último intento con error: {trabajador.ultimo_error}")
+        elif trabajador.ultima_ejecucion:
+            hora = datetime.fromtimestamp(trabajador.ultima_ejecucion).strftime("%H:%M:%S")
+            st.caption(f"Última revisión de la cola: {hora}")
     
-    # Historial de sesión en sidebar
-    with st.expander("📜 Historial de sesión", expanded=False):
-        mostrar_historial_sesion()
-        if st.session_state.historial_sesion:
-            if st.button("🗑️ Limpiar historial"):
-                st.session_state.historial_sesion = []
+        if resumen[ESTADO_PENDIENTE]:
+            if st.button("📤 Sincronizar ahora", use_container_width=True):
+                despertar_trabajador()
                 st.rerun()
     
-    st.caption("🔗 Conectado a Alegra API")
+        if resumen[ESTADO_FALLIDO]:
+            with st.expander("Ver ajustes fallidos", expanded=False):
+                for fila in listar_fallidos():
+                    st.caption(f"🆔 {fila['item_id']} {fila['nombre']} ({fila['diferencia']:+.0f}): {fila['error']}")
+                if st.button("🔁 Reintentar fallidos", use_container_width=True):
+                    reintentar_fallidos()
+                    st.rerun()
+    
+        st.divider()
+    
+        # Historial de sesión en sidebar
+        with st.expander("📜 Historial de sesión", expanded=False):
+            mostrar_historial_sesion()
+            if st.session_state.historial_sesion:
+                if st.button("🗑️ Limpiar historial"):
+                    st.session_state.historial_sesion = []
+                    st.rerun()
+    
+        if es_admin():
+            with st.expander("⏱️ Métricas", expanded=False):
+                mostrar_panel_metricas()
+            with st.expander("🔬 Perfilador", expanded=False):
+                mostrar_panel_perfilador()
+    
+        st.caption("🔗 Conectado a Alegra API")
 
 
-# ========== CONTENIDO PRINCIPAL ==========
+    # ========== CONTENIDO PRINCIPAL ==========
 
-df = cargar_datos()
+    df = cargar_datos()
 
-if df is None:
-    st.warning("⚠️ No hay inventario cargado. Sube un archivo en la barra lateral.")
-    st.stop()
+    if df is None:
+        st.warning("⚠️ No hay inventario cargado. Sube un archivo en la barra lateral.")
+        st.stop()
 
-# Función para mostrar y procesar un producto seleccionado
-def mostrar_producto_seleccionado(idx, producto_local, df):
-    """Muestra la interfaz de conteo para un producto seleccionado."""
-    item_id = producto_local[COL_CODIGO]
-    codigo_barras_producto = producto_local[COL_BARRAS]
+    # Función para mostrar y procesar un producto seleccionado
+    def mostrar_producto_seleccionado(producto_local, df):
+        """Muestra la interfaz de conteo para un producto seleccionado."""
+        item_id = producto_local[COL_CODIGO]
+        codigo_barras_producto = producto_local[COL_BARRAS]
     
-    with st.spinner("🔄 Consultando Alegra..."):
-        item_alegra = consultar_item_alegra(item_id)
+        # Si un ajuste del item se envió después de la consulta guardada, el stock ya cambió
+        ajuste_en_cola = ultimo_ajuste_item(item_id)
+        snapshot = obtener_snapshot_alegra(item_id)
+        if snapshot and ajuste_en_cola and ajuste_en_cola["estado"] == ESTADO_ENVIADO and ajuste_en_cola["enviado"]:
+            enviado = datetime.strptime(ajuste_en_cola["enviado"], "%Y-%m-%d %H:%M:%S").timestamp()
+            if enviado + 1 > snapshot["obtenido"]:
+                invalidar_snapshot_alegra(item_id)
     
-    if item_alegra:
-        datos = extraer_datos_item(item_alegra)
+        # Sin consulta reciente en la sesión, la foto precargada evita ir a Alegra
+        item_alegra = None
+        precargado = None if obtener_snapshot_alegra(item_id) else leer_stock_precargado(item_id)
+        if obtener_snapshot_alegra(item_id):
+            item_alegra = consultar_item_alegra(item_id)
+        elif not precargado:
+            with st.spinner("🔄 Consultando Alegra..."):
+                item_alegra = consultar_item_alegra(item_id)
+    
+        # Sin conexión se cuenta contra la última foto del stock, por vieja que sea, o sin
+        # base si no hay foto; el ajuste se recalcula contra Alegra cuando vuelva
+        sin_conexion = not alegra_disponible()
+        if sin_conexion and not item_alegra and not precargado:
+            precargado = leer_stock_precargado(item_id, max_antiguedad=None)
+    
+        if item_alegra or precargado or sin_conexion:
+            if item_alegra or precargado:
+                datos = precargado or extraer_datos_item(item_alegra)
+                # Hora de la foto contra la que se calcula la diferencia; queda con el ajuste en cola
+                snapshot = obtener_snapshot_alegra(item_id)
+                base_actualizado = precargado["actualizado"] if precargado else (snapshot["obtenido"] if snapshot else time.time())
+            else:
+                datos = {
+                    "nombre": str(producto_local.get(COL_NOMBRE, "") or ""),
+                    "precio": None,
+                    "costo_unitario": None,
+                    "cantidad_disponible": None
+                }
+                base_actualizado = None
         
-        if datos:
-            # Sonido de éxito
-            if st.session_state.sonidos_activos:
-                st.markdown('<script>playSound("success")</script>', unsafe_allow_html=True)
+            ajuste_sin_enviar = bool(ajuste_en_cola) and ajuste_en_cola["estado"] in (
+                ESTADO_RECONCILIAR, ESTADO_PENDIENTE, ESTADO_ENVIANDO
+            )
+            # Un conteo sin conexión que aún no se reconcilia no fija la base: con Alegra de vuelta vale su stock
+            por_reconciliar = ajuste_sin_enviar and ajuste_en_cola["estado"] == ESTADO_RECONCILIAR and not sin_conexion
+            # Un conteo sin conexión sin foto del stock no tiene base con la cual comparar
+            base_en_cola = ajuste_sin_enviar and ajuste_en_cola["cantidad_anterior"] is not None
+            if datos and base_en_cola and not por_reconciliar:
+                # Alegra aún no refleja el ajuste en cola: comparar contra el stock con el que se calculó
+                datos["cantidad_disponible"] = float(ajuste_en_cola["cantidad_anterior"])
+        
+            if datos:
+                stock_desconocido = datos["cantidad_disponible"] is None
+                # Sonido de éxito
+                if st.session_state.sonidos_activos:
+                    st.markdown('<script>playSound("success")</script>', unsafe_allow_html=True)
+            
+                if stock_desconocido:
+                    st.warning(
+                        "📴 Sin conexión con Alegra y sin foto del stock de este item: se guarda el conteo "
+                        "y la diferencia se calcula contra Alegra cuando vuelva la conexión."
+                    )
+                elif sin_conexion:
+                    st.warning(
+                        "📴 Sin conexión con Alegra: se cuenta contra la última foto del stock. "
+                        "El ajuste se recalcula contra Alegra y se envía cuando vuelva la conexión."
+                    )
+                else:
+                    st.success("✅ Producto encontrado en Alegra")
+            
+                snapshot = obtener_snapshot_alegra(item_id)
+                if snapshot:
+                    col_hora, col_refrescar = st.columns([3, 1])
+                    with col_hora:
+                        hora_consulta = datetime.fromtimestamp(snapshot["obtenido"]).strftime("%H:%M:%S")
+                        antiguedad = int(time.time() - snapshot["obtenido"])
+                        st.caption(f"🕒 Stock consultado a las {hora_consulta} (hace {antiguedad} s)")
+                    with col_refrescar:
+                        if st.button("🔄 Actualizar", key="btn_refrescar_alegra", use_container_width=True):
+                            invalidar_snapshot_alegra(item_id)
+                            st.rerun()
+                elif precargado:
+                    col_hora, col_refrescar = st.columns([3, 1])
+                    with col_hora:
+                        hora_precarga = datetime.fromtimestamp(precargado["actualizado"]).strftime("%H:%M:%S")
+                        minutos = int((time.time() - precargado["actualizado"]) // 60)
+                        st.caption(f"📥 Stock de la precarga de las {hora_precarga} (hace {minutos} min)")
+                    with col_refrescar:
+                        if st.button("🔄 Actualizar", key="btn_refrescar_alegra", use_container_width=True):
+                            consultar_item_alegra(item_id, forzar=True)
+                            st.rerun()
+            
+                # Aviso de la verificación de stock hecha al intentar guardar
+                aviso_stock = st.session_state.pop("aviso_stock", None)
+                if aviso_stock:
+                    st.warning(
+                        f"⚠️ El stock en Alegra cambió de {aviso_stock[0]:.0f} a {aviso_stock[1]:.0f} "
+                        "desde la precarga. Revisa la diferencia antes de guardar."
+                    )
             
-            st.success("✅ Producto encontrado en Alegra")
+                # Mostrar información del producto
+                col1, col2, col3 = st.columns(3)
             
-            # Mostrar información del producto
-            col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.markdown("**Nombre:**")
+                    st.info(datos["nombre"])
             
-            with col1:
-                st.markdown("**Nombre:**")
-                st.info(datos["nombre"])
+                with col2:
+                    st.markdown("**Stock Alegra:**")
+                    if stock_desconocido:
+                        st.info("❔ Sin dato")
+                    else:
+                        stock_color = "🟢" if datos['cantidad_disponible'] > 0 else "🔴"
+                        st.info(f"{stock_color} {datos['cantidad_disponible']:.0f} unidades")
             
-            with col2:
-                st.markdown("**Stock Alegra:**")
-                stock_color = "🟢" if datos['cantidad_disponible'] > 0 else "🔴"
-                st.info(f"{stock_color} {datos['cantidad_disponible']:.0f} unidades")
+                with col3:
+                    st.markdown("**Precio:**")
+                    st.info("❔ Sin dato" if datos["precio"] is None else f"${datos['precio']:,.0f}")
             
-            with col3:
-                st.markdown("**Precio:**")
-                st.info(f"${datos['precio']:,.0f}")
+                # Mostrar si ya fue contado
+                cantidad_previa = producto_local.get(COL_CANTIDAD_ACTUAL, "")
+                if pd.notna(cantidad_previa):
+                    st.warning(f"⚠️ Este producto ya fue contado: **{cantidad_previa}** unidades")
             
-            # Mostrar si ya fue contado
-            cantidad_previa = producto_local.get(COL_CANTIDAD_ACTUAL, "")
-            if pd.notna(cantidad_previa) and cantidad_previa != "":
-                st.warning(f"⚠️ Este producto ya fue contado: **{cantidad_previa}** unidades")
+                if por_reconciliar or (ajuste_sin_enviar and not base_en_cola):
+                    st.info("⏳ Hay un conteo hecho sin conexión por reconciliar; este conteo lo reemplaza")
+                elif ajuste_sin_enviar:
+                    st.info(
+                        f"⏳ Hay un ajuste de {ajuste_en_cola['diferencia']:+.0f} sin sincronizar con Alegra; "
+                        f"la diferencia se calcula contra el stock previo ({ajuste_en_cola['cantidad_anterior']:.0f})"
+                    )
             
-            # Input para cantidad contada - GRANDE
-            st.markdown("---")
+                # Input para cantidad contada - GRANDE
+                st.markdown("---")
             
-            # En modo rápido, mostrar indicador visual y auto-focus
-            if st.session_state.modo_rapido:
-                st.markdown("""
+                # En modo rápido, mostrar indicador visual y auto-focus
+                if st.session_state.modo_rapido:
+                    st.markdown("""
                 <div style="background: linear-gradient(135deg, #00b4db 0%, #0083b0 100%); 
                             color: white; padding: 10px 20px; border-radius: 10px; 
                             text-align: center; margin-bottom: 15px; font-weight: bold;">
                     ⚡ MODO RÁPIDO - Ingresa cantidad y presiona Enter para guardar
                 </div>
                 """, unsafe_allow_html=True)
-                # Auto-focus usando componente HTML con autofocus
-                st.components.v1.html("""
+                    # Auto-focus usando componente HTML con autofocus
+                    st.components.v1.html("""
                 <script>
                     setTimeout(function() {
                         // Buscar el input de número en el documento padre
@@ -719,53 +731,66 @@ def mostrar_producto_seleccionado(idx, producto_local, df):
                     }, 300);
                 </script>
                 """, height=0)
-            else:
-                st.subheader("📝 Registrar conteo físico")
+                else:
+                    st.subheader("📝 Registrar conteo físico")
             
-            # Si el stock en Alegra es negativo, iniciar en 0
-            valor_inicial = max(0, int(datos["cantidad_disponible"]))
+                # Si el stock en Alegra es negativo (o no se conoce), iniciar en 0
+                valor_inicial = 0 if stock_desconocido else max(0, int(datos["cantidad_disponible"]))
             
-            # Input numérico GRANDE
-            st.markdown("##### 👇 Ingresa la cantidad contada:")
-            cantidad_contada = st.number_input(
-                "Cantidad física contada:",
-                min_value=0,
-                step=1,
-                value=valor_inicial,
-                key="cantidad_contada",
-                label_visibility="collapsed",
-                help="Escribe la cantidad que contaste físicamente en tienda"
-            )
+                # Input numérico GRANDE
+                st.markdown("##### 👇 Ingresa la cantidad contada:")
+                cantidad_contada = st.number_input(
+                    "Cantidad física contada:",
+                    min_value=0,
+                    step=1,
+                    value=valor_inicial,
+                    key="cantidad_contada",
+                    label_visibility="collapsed",
+                    help="Escribe la cantidad que contaste físicamente en tienda"
+                )
             
-            # Calcular diferencia
-            diferencia = cantidad_contada - datos["cantidad_disponible"]
+                # Calcular diferencia (sin stock conocido la calcula la reconciliación)
+                diferencia = 0 if stock_desconocido else cantidad_contada - datos["cantidad_disponible"]
             
-            # Mostrar indicador visual grande
-            st.markdown("---")
-            mostrar_indicador_diferencia(diferencia)
+                # Mostrar indicador visual grande
+                st.markdown("---")
+                if stock_desconocido:
+                    st.info("❔ La diferencia se calcula contra Alegra cuando vuelva la conexión")
+                else:
+                    mostrar_indicador_diferencia(diferencia)
             
-            if diferencia != 0:
-                if diferencia > 0:
-                    tipo_ajuste = "in"
+                if diferencia != 0:
+                    if diferencia > 0:
+                        tipo_ajuste = "in"
+                    else:
+                        tipo_ajuste = "out"
                 else:
-                    tipo_ajuste = "out"
-            else:
-                tipo_ajuste = None
+                    tipo_ajuste = None
             
-            st.markdown("---")
+                st.markdown("---")
             
-            col_btn1, col_btn2 = st.columns(2)
+                col_btn1, col_btn2 = st.columns(2)
             
-            with col_btn1:
-                if diferencia != 0:
-                    btn_label = "💾 Guardar y Sincronizar"
-                else:
-                    btn_label = "💾 Guardar conteo"
-                
-                if st.button(btn_label, type="primary", use_container_width=True, key="btn_guardar"):
+                with col_btn1:
                     if diferencia != 0:
-                        st.session_state.mostrar_confirmacion = True
-                        st.session_state.datos_ajuste = {
+                        btn_label = "💾 Guardar y Sincronizar"
+                    else:
+                        btn_label = "💾 Guardar conteo"
+                
+                    # Mientras el ajuste anterior está en vuelo no se puede reemplazar
+                    enviando = ajuste_sin_enviar and ajuste_en_cola["estado"] == ESTADO_ENVIANDO
+                    if st.button(btn_label, type="primary", use_container_width=True, key="btn_guardar", disabled=enviando):
+                        verificar = precargado and st.session_state.verificar_stock and not sin_conexion
+                        if diferencia != 0 and verificar and not ajuste_sin_enviar:
+                            # Confirmar contra Alegra que la foto precargada sigue vigente
+                            fresco = extraer_datos_item(consultar_item_alegra(item_id, forzar=True))
+                            if not fresco:
+                                st.stop()
+                            if fresco["cantidad_disponible"] != datos["cantidad_disponible"]:
+                                st.session_state.aviso_stock = (datos["cantidad_disponible"], fresco["cantidad_disponible"])
+                                st.rerun()
+                    
+                        datos_ajuste = {
                             "codigo_barras": codigo_barras_producto,
                             "item_id": item_id,
                             "nombre": datos["nombre"],
@@ -775,303 +800,357 @@ def mostrar_producto_seleccionado(idx, producto_local, df):
                             "diferencia": diferencia,
                             "tipo_ajuste": tipo_ajuste,
                             "costo_unitario": datos["costo_unitario"],
-                            "idx": idx
+                            "base_actualizado": base_actualizado,
+                            "sin_conexion": sin_conexion
                         }
-                        st.rerun()
-                    else:
-                        # Sin diferencia, solo guardar localmente
-                        df_actualizado = cargar_datos()
-                        if df_actualizado is not None:
-                            df_actualizado.at[idx, COL_CANTIDAD_ACTUAL] = cantidad_contada
-                            guardar_datos(df_actualizado)
+                        if diferencia != 0:
+                            st.session_state.mostrar_confirmacion = True
+                            st.session_state.datos_ajuste = datos_ajuste
+                            st.rerun()
+                        else:
+                            # Sin diferencia, solo guardar localmente (y anular un ajuste en cola que ya no aplica)
+                            registrar_conteo_por_codigo(item_id, cantidad_contada)
+                            if sin_conexion:
+                                # Coincide con la foto, pero Alegra pudo moverse: se revisa al volver la conexión
+                                encolar_ajuste(datos_ajuste, reconciliar=True)
+                            elif ajuste_sin_enviar:
+                                cancelar_pendiente(item_id)
                         
-                        # Agregar al historial
-                        agregar_al_historial(
-                            codigo_barras_producto,
-                            datos["nombre"],
-                            datos["cantidad_disponible"],
-                            cantidad_contada,
-                            "ok"
-                        )
+                            # Agregar al historial
+                            agregar_al_historial(
+                                codigo_barras_producto,
+                                datos["nombre"],
+                                datos["cantidad_disponible"],
+                                cantidad_contada,
+                                "sin_conexion" if sin_conexion else "ok"
+                            )
                         
-                        st.success("✅ Conteo guardado (sin cambios en Alegra)")
+                            if sin_conexion:
+                                st.success("✅ Conteo guardado sin conexión; se verifica contra Alegra al volver")
+                            else:
+                                st.success("✅ Conteo guardado (sin cambios en Alegra)")
                         
-                        if st.session_state.modo_rapido:
-                            limpiar_para_nuevo_escaneo()
-                            st.session_state.producto_seleccionado = None
-                            st.rerun()
+                            if st.session_state.modo_rapido:
+                                limpiar_para_nuevo_escaneo()
+                                st.session_state.producto_seleccionado = None
+                                st.rerun()
             
-            with col_btn2:
-                if st.button("🔄 Nuevo escaneo", use_container_width=True, key="btn_nuevo"):
-                    limpiar_para_nuevo_escaneo()
-                    st.session_state.producto_seleccionado = None
-                    st.rerun()
+                with col_btn2:
+                    if st.button("🔄 Nuevo escaneo", use_container_width=True, key="btn_nuevo"):
+                        limpiar_para_nuevo_escaneo()
+                        st.session_state.producto_seleccionado = None
+                        st.rerun()
+            else:
+                st.error("❌ Error al procesar datos del item")
         else:
-            st.error("❌ Error al procesar datos del item")
-    else:
-        # Sonido de error
-        if st.session_state.sonidos_activos:
-            st.markdown('<script>playSound("error")</script>', unsafe_allow_html=True)
-        st.error(f"❌ No se pudo consultar el item ID {item_id} en Alegra")
+            # Sonido de error
+            if st.session_state.sonidos_activos:
+                st.markdown('<script>playSound("error")</script>', unsafe_allow_html=True)
+            st.error(f"❌ No se pudo consultar el item ID {item_id} en Alegra")
 
 
-# Selector de tipo de búsqueda
-st.subheader("🔍 Buscar producto")
+    # Selector de tipo de búsqueda
+    st.subheader("🔍 Buscar producto")
 
-col_busqueda1, col_busqueda2 = st.columns([3, 1])
+    col_busqueda1, col_busqueda2 = st.columns([3, 1])
 
-with col_busqueda2:
-    tipo_busqueda = st.radio(
-        "Buscar por:",
-        ["📷 Código de barras", "🔤 Nombre"],
-        horizontal=False,
-        label_visibility="collapsed"
-    )
-    st.session_state.buscar_por = "codigo_barras" if "Código" in tipo_busqueda else "nombre"
-
-with col_busqueda1:
-    if st.session_state.buscar_por == "codigo_barras":
-        # Input GRANDE para código de barras
-        st.markdown("##### 📷 Escanea o escribe el código:")
-        codigo_input = st.text_input(
-            "Código de barras:",
-            placeholder="Escanea o escribe el código de barras...",
-            key="input_codigo",
-            label_visibility="collapsed",
-            autocomplete="off"
-        )
-        nombre_input = None
-    else:
-        # Input GRANDE para búsqueda por nombre
-        st.markdown("##### 🔤 Escribe el nombre del producto:")
-        nombre_input = st.text_input(
-            "Nombre del producto:",
-            placeholder="Ej: cargador, cable, audifono...",
-            key="input_nombre",
+    with col_busqueda2:
+        tipo_busqueda = st.radio(
+            "Buscar por:",
+            ["📷 Código de barras", "🔤 Nombre"],
+            horizontal=False,
             label_visibility="collapsed"
         )
-        codigo_input = None
+        st.session_state.buscar_por = "codigo_barras" if "Código" in tipo_busqueda else "nombre"
+
+    with col_busqueda1:
+        if st.session_state.buscar_por == "codigo_barras":
+            # Input GRANDE para código de barras
+            st.markdown("##### 📷 Escanea o escribe el código:")
+            codigo_input = st.text_input(
+                "Código de barras:",
+                placeholder="Escanea o escribe el código de barras...",
+                key="input_codigo",
+                label_visibility="collapsed",
+                autocomplete="off"
+            )
+            nombre_input = None
+        else:
+            # Input GRANDE para búsqueda por nombre
+            st.markdown("##### 🔤 Escribe el nombre del producto:")
+            nombre_input = st.text_input(
+                "Nombre del producto:",
+                placeholder="Ej: cargador, cable, audifono...",
+                key="input_nombre",
+                label_visibility="collapsed"
+            )
+            codigo_input = None
 
-# Atajos de teclado info
-st.markdown("""
+    # Atajos de teclado info
+    st.markdown("""
 <small>
 <span class="keyboard-hint">Enter</span> Buscar &nbsp;&nbsp;
 <span class="keyboard-hint">Tab</span> Siguiente
 </small>
 """, unsafe_allow_html=True)
 
-# ========== LÓGICA DE BÚSQUEDA ==========
+    # ========== LÓGICA DE BÚSQUEDA ==========
 
-# Si hay un producto ya seleccionado, mostrarlo
-if st.session_state.producto_seleccionado is not None:
-    idx = st.session_state.producto_seleccionado["idx"]
-    producto_local = df.iloc[idx]
-    mostrar_producto_seleccionado(idx, producto_local, df)
+    # Si hay un producto ya seleccionado, mostrarlo (por ID Alegra: una carga combinada reordena las filas)
+    if st.session_state.producto_seleccionado is not None:
+        seleccionado = st.session_state.producto_seleccionado
+        _, producto_local = buscar_producto(df, seleccionado["codigo"], "codigo")
+        if producto_local is not None:
+            mostrar_producto_seleccionado(producto_local, df)
+        else:
+            st.session_state.producto_seleccionado = None
+            st.warning(f"⚠️ **{seleccionado['nombre']}** ya no está en el inventario cargado")
 
-# Búsqueda por CÓDIGO DE BARRAS
-elif st.session_state.buscar_por == "codigo_barras" and codigo_input:
-    idx, producto_local = buscar_producto(df, codigo_input, "codigo_barras")
+    # Búsqueda por CÓDIGO DE BARRAS
+    elif st.session_state.buscar_por == "codigo_barras" and codigo_input:
+        idx, producto_local = buscar_producto(df, codigo_input, "codigo_barras")
     
-    if producto_local is not None:
-        mostrar_producto_seleccionado(idx, producto_local, df)
-    else:
-        # Sonido de error
-        if st.session_state.sonidos_activos:
-            st.markdown('<script>playSound("error")</script>', unsafe_allow_html=True)
-        st.error(f"❌ Producto no encontrado con código: **{codigo_input}**")
-        st.info("Verifica que el código de barras esté en el archivo CSV cargado")
-
-# Búsqueda por NOMBRE - Mostrar opciones seleccionables
-elif st.session_state.buscar_por == "nombre" and nombre_input and len(nombre_input) >= 2:
-    productos_encontrados = buscar_productos_por_nombre(df, nombre_input, limite=15)
+        if producto_local is not None:
+            coincidencias = buscar_filas_por_barras(df, codigo_input)
+            if len(coincidencias) > 1:
+                ids = ", ".join(df.loc[coincidencias, COL_CODIGO].astype(str))
+                st.warning(f"⚠️ Este código de barras está en {len(coincidencias)} productos (IDs {ids}). Se muestra el primero; busca por nombre para elegir otro.")
+            mostrar_producto_seleccionado(producto_local, df)
+        else:
+            # Sonido de error
+            if st.session_state.sonidos_activos:
+                st.markdown('<script>playSound("error")</script>', unsafe_allow_html=True)
+            st.error(f"❌ Producto no encontrado con código: **{codigo_input}**")
+            st.info("Verifica que el código de barras esté en el archivo CSV cargado")
+
+    # Búsqueda por NOMBRE - Mostrar opciones seleccionables
+    elif st.session_state.buscar_por == "nombre" and nombre_input and len(nombre_input) >= 2:
+        productos_encontrados = buscar_productos_por_nombre(df, nombre_input, limite=15)
     
-    if not productos_encontrados.empty:
-        st.success(f"✅ Se encontraron **{len(productos_encontrados)}** productos")
-        st.markdown("### 👇 Selecciona un producto:")
+        if not productos_encontrados.empty:
+            st.success(f"✅ Se encontraron **{len(productos_encontrados)}** productos")
+            st.markdown("### 👇 Selecciona un producto:")
         
-        # Mostrar productos como botones seleccionables
-        for i, (idx, row) in enumerate(productos_encontrados.iterrows()):
-            nombre_producto = row[COL_NOMBRE]
-            codigo_barras = row[COL_BARRAS]
-            id_alegra = row[COL_CODIGO]
+            # Mostrar productos como botones seleccionables
+            for i, (idx, row) in enumerate(productos_encontrados.iterrows()):
+                nombre_producto = row[COL_NOMBRE]
+                codigo_barras = row[COL_BARRAS]
+                id_alegra = row[COL_CODIGO]
             
-            # Verificar si ya fue contado
-            cantidad_actual = row.get(COL_CANTIDAD_ACTUAL, "")
-            ya_contado = pd.notna(cantidad_actual) and cantidad_actual != ""
+                # Verificar si ya fue contado
+                cantidad_actual = row.get(COL_CANTIDAD_ACTUAL, "")
+                ya_contado = pd.notna(cantidad_actual)
             
-            col_prod, col_btn = st.columns([4, 1])
+                col_prod, col_btn = st.columns([4, 1])
             
-            with col_prod:
-                estado_icono = "✅" if ya_contado else "⏳"
-                st.markdown(f"""
+                with col_prod:
+                    estado_icono = "✅" if ya_contado else "⏳"
+                    st.markdown(f"""
                 <div class="producto-card">
                     <div class="nombre">{estado_icono} {nombre_producto}</div>
                     <div class="info">📷 {codigo_barras} &nbsp;|&nbsp; 🆔 {id_alegra}</div>
                 </div>
                 """, unsafe_allow_html=True)
             
-            with col_btn:
-                if st.button("Seleccionar", key=f"btn_select_{i}_{idx}", use_container_width=True):
-                    st.session_state.producto_seleccionado = {
-                        "idx": idx,
-                        "nombre": nombre_producto
-                    }
-                    st.rerun()
-    else:
-        # Sonido de error
-        if st.session_state.sonidos_activos:
-            st.markdown('<script>playSound("error")</script>', unsafe_allow_html=True)
-        st.warning(f"⚠️ No se encontraron productos con: **{nombre_input}**")
-        st.info("Intenta con otra palabra o parte del nombre")
+                with col_btn:
+                    if st.button("Seleccionar", key=f"btn_select_{i}_{idx}", use_container_width=True):
+                        st.session_state.producto_seleccionado = {
+                            "codigo": id_alegra,
+                            "nombre": nombre_producto
+                        }
+                        st.rerun()
+        else:
+            # Sonido de error
+            if st.session_state.sonidos_activos:
+                st.markdown('<script>playSound("error")</script>', unsafe_allow_html=True)
+            st.warning(f"⚠️ No se encontraron productos con: **{nombre_input}**")
+            st.info("Intenta con otra palabra o parte del nombre")
 
-elif st.session_state.buscar_por == "nombre" and nombre_input and len(nombre_input) < 2:
-    st.info("✍️ Escribe al menos 2 caracteres para buscar...")
+    elif st.session_state.buscar_por == "nombre" and nombre_input and len(nombre_input) < 2:
+        st.info("✍️ Escribe al menos 2 caracteres para buscar...")
 
 
-# ========== DIÁLOGO DE CONFIRMACIÓN ==========
+    # ========== DIÁLOGO DE CONFIRMACIÓN ==========
 
-if st.session_state.get("mostrar_confirmacion", False):
-    datos = st.session_state.datos_ajuste
+    if st.session_state.get("mostrar_confirmacion", False):
+        datos = st.session_state.datos_ajuste
     
-    st.markdown("---")
-    st.markdown("### ⚠️ Confirmar ajuste de inventario")
+        st.markdown("---")
+        st.markdown("### ⚠️ Confirmar ajuste de inventario")
     
-    st.warning(f"""
+        st.warning(f"""
     **¿Estás seguro de que el artículo "{datos['nombre']}" tiene {datos['cantidad_contada']:.0f} unidades en tienda?**
     
     - **Código de barras:** {datos['codigo_barras']}
     - **ID Alegra:** {datos['item_id']}
-    - **Stock actual en Alegra:** {datos['cantidad_anterior']:.0f} unidades
+    - **{'Stock en la última foto' if datos['sin_conexion'] else 'Stock actual en Alegra'}:** {datos['cantidad_anterior']:.0f} unidades
     - **Cantidad contada:** {datos['cantidad_contada']:.0f} unidades
     - **Diferencia:** {'+' if datos['diferencia'] > 0 else ''}{datos['diferencia']:.0f} unidades ({'entrada' if datos['tipo_ajuste'] == 'in' else 'salida'})
     """)
     
-    col_confirm1, col_confirm2 = st.columns(2)
+        col_confirm1, col_confirm2 = st.columns(2)
     
-    with col_confirm1:
-        if st.button("✅ Sí, confirmar", type="primary", use_container_width=True, key="btn_confirmar"):
-            with st.spinner("Enviando ajuste a Alegra..."):
-                resultado = crear_ajuste_inventario(
-                    item_id=datos["item_id"],
-                    tipo=datos["tipo_ajuste"],
-                    cantidad=abs(datos["diferencia"]),
-                    costo=datos["costo_unitario"]
-                )
+        with col_confirm1:
+            if st.button("✅ Sí, confirmar", type="primary", use_container_width=True, key="btn_confirmar"):
+                # El conteo queda guardado ya; el ajuste se envía a Alegra en segundo plano
+                registrar_conteo_por_codigo(datos["item_id"], datos["cantidad_contada"])
+                encolar_ajuste(datos, reconciliar=datos["sin_conexion"])
+                despertar_trabajador()
             
-            if resultado:
                 # Sonido de éxito
                 if st.session_state.sonidos_activos:
                     st.markdown('<script>playSound("success")</script>', unsafe_allow_html=True)
-                
-                # Guardar en CSV local
-                df_actualizado = cargar_datos()
-                if df_actualizado is not None:
-                    df_actualizado.at[datos["idx"], COL_CANTIDAD_ACTUAL] = datos["cantidad_contada"]
-                    guardar_datos(df_actualizado)
-                
-                # Guardar en log
-                guardar_log_ajuste(
-                    codigo_barras=datos["codigo_barras"],
-                    item_id=datos["item_id"],
-                    nombre=datos["nombre"],
-                    precio=datos["precio"],
-                    cantidad_anterior=datos["cantidad_anterior"],
-                    cantidad_nueva=datos["cantidad_contada"],
-                    diferencia=datos["diferencia"],
-                    tipo_ajuste=datos["tipo_ajuste"]
-                )
-                
+            
                 # Agregar al historial
                 agregar_al_historial(
                     datos["codigo_barras"],
                     datos["nombre"],
                     datos["cantidad_anterior"],
                     datos["cantidad_contada"],
-                    "ajustado"
+                    "sin_conexion" if datos["sin_conexion"] else "en_cola"
                 )
-                
+            
                 # Limpiar session state
                 del st.session_state.mostrar_confirmacion
                 del st.session_state.datos_ajuste
-                
-                st.success(f"✅ Inventario actualizado en Alegra!")
-                st.success(f"Nueva cantidad: **{datos['cantidad_contada']:.0f}** unidades")
-                
+            
                 if st.session_state.modo_rapido:
-                    st.info("🚀 Modo rápido: Listo para siguiente escaneo")
                     limpiar_para_nuevo_escaneo()
                     st.rerun()
+            
+                if datos["sin_conexion"]:
+                    st.success("✅ Conteo guardado. El ajuste se recalcula y envía a Alegra cuando vuelva la conexión")
                 else:
-                    st.balloons()
-            else:
-                if st.session_state.sonidos_activos:
-                    st.markdown('<script>playSound("error")</script>', unsafe_allow_html=True)
-                st.error("❌ Error al actualizar Alegra. Intenta de nuevo.")
+                    st.success("✅ Conteo guardado. El ajuste se está enviando a Alegra")
+                st.success(f"Nueva cantidad: **{datos['cantidad_contada']:.0f}** unidades")
+                st.balloons()
     
-    with col_confirm2:
-        if st.button("❌ Cancelar", use_container_width=True, key="btn_cancelar"):
-            del st.session_state.mostrar_confirmacion
-            del st.session_state.datos_ajuste
-            st.rerun()
+        with col_confirm2:
+            if st.button("❌ Cancelar", use_container_width=True, key="btn_cancelar"):
+                del st.session_state.mostrar_confirmacion
+                del st.session_state.datos_ajuste
+                st.rerun()
+
+
+    # ========== SECCIÓN DE PRODUCTOS ==========
+
+    st.divider()
+    # Filas por página en la tabla de productos
+    OPCIONES_POR_PAGINA = [25, 50, 100, 200]
 
 
-# ========== SECCIÓN DE PRODUCTOS ==========
+    def mover_pagina_tabla(paso):
+        st.session_state.pagina_tabla += paso
 
-st.divider()
-with st.expander("📋 Ver todos los productos", expanded=False):
-    col_filtro1, col_filtro2 = st.columns(2)
+
+    @st.fragment
+    def tabla_productos():
+        """Tabla paginada del inventario; cambiar de página solo recarga este bloque."""
+        col_filtro1, col_filtro2, col_filtro3 = st.columns([2, 3, 1])
     
-    with col_filtro1:
-        filtro_estado = st.selectbox(
-            "Filtrar por estado:",
-            ["Todos", "Contados", "Sin contar"]
-        )
+        with col_filtro1:
+            filtro_estado = st.selectbox(
+                "Filtrar por estado:",
+                [ESTADO_TODOS, ESTADO_CONTADOS, ESTADO_SIN_CONTAR]
+            )
     
-    with col_filtro2:
-        buscar_nombre = st.text_input("Buscar por nombre:", placeholder="Escribe para filtrar...")
+        with col_filtro2:
+            buscar_nombre = st.text_input("Buscar por nombre:", placeholder="Escribe para filtrar...")
     
-    df_filtrado = df.copy()
+        with col_filtro3:
+            por_pagina = st.selectbox("Filas:", OPCIONES_POR_PAGINA, index=1)
     
-    if filtro_estado == "Contados":
-        df_filtrado = df_filtrado[df_filtrado[COL_CANTIDAD_ACTUAL].notna() & (df_filtrado[COL_CANTIDAD_ACTUAL] != "")]
-    elif filtro_estado == "Sin contar":
-        df_filtrado = df_filtrado[df_filtrado[COL_CANTIDAD_ACTUAL].isna() | (df_filtrado[COL_CANTIDAD_ACTUAL] == "")]
+        # Con otros filtros se vuelve a la primera página
+        filtros = (filtro_estado, buscar_nombre.strip(), por_pagina)
+        # La página es estado de un widget: Streamlit la borra si un rerun cortó el script antes de dibujarlo
+        if st.session_state.get("filtros_tabla") != filtros or "pagina_tabla" not in st.session_state:
+            st.session_state.filtros_tabla = filtros
+            st.session_state.pagina_tabla = 1
     
-    if buscar_nombre and COL_NOMBRE in df_filtrado.columns:
-        df_filtrado = df_filtrado[df_filtrado[COL_NOMBRE].str.contains(buscar_nombre, case=False, na=False)]
+        columnas_mostrar = [COL_CODIGO, COL_BARRAS, COL_NOMBRE, COL_CANTIDAD_ACTUAL]
+        # El filtro de nombre usa el mismo índice que la búsqueda y deja las mejores coincidencias arriba
+        df_pagina, total = pagina_productos(
+            filtro_estado, buscar_nombre, st.session_state.pagina_tabla - 1, por_pagina, columnas_mostrar
+        )
+        if df_pagina is None:
+            return
     
-    columnas_mostrar = [COL_CODIGO, COL_BARRAS]
-    if COL_NOMBRE in df_filtrado.columns:
-        columnas_mostrar.append(COL_NOMBRE)
-    columnas_mostrar.append(COL_CANTIDAD_ACTUAL)
+        paginas = max(1, -(-total // por_pagina))
+        if st.session_state.pagina_tabla > paginas:
+            st.session_state.pagina_tabla = paginas
+            df_pagina, total = pagina_productos(
+                filtro_estado, buscar_nombre, paginas - 1, por_pagina, columnas_mostrar
+            )
     
-    st.dataframe(
-        df_filtrado[columnas_mostrar],
-        use_container_width=True,
-        hide_index=True,
-        column_config={
-            COL_CODIGO: st.column_config.TextColumn("ID Alegra"),
-            COL_BARRAS: st.column_config.TextColumn("Código de Barras"),
-            COL_NOMBRE: st.column_config.TextColumn("Nombre"),
-            COL_CANTIDAD_ACTUAL: st.column_config.NumberColumn("Conteo Físico")
-        }
-    )
+        st.dataframe(
+            df_pagina,
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                COL_CODIGO: st.column_config.TextColumn("ID Alegra"),
+                COL_BARRAS: st.column_config.TextColumn("Código de Barras"),
+                COL_NOMBRE: st.column_config.TextColumn("Nombre"),
+                COL_CANTIDAD_ACTUAL: st.column_config.NumberColumn("Conteo Físico")
+            }
+        )
+    
+        col_anterior, col_pagina, col_siguiente = st.columns([1, 2, 1])
+        with col_anterior:
+            st.button(
+                "⬅️ Anterior", disabled=st.session_state.pagina_tabla <= 1, use_container_width=True,
+                on_click=mover_pagina_tabla, args=(-1,)
+            )
+        with col_pagina:
+            st.number_input(
+                "Página", min_value=1, max_value=paginas, key="pagina_tabla", label_visibility="collapsed"
+            )
+        with col_siguiente:
+            st.button(
+                "Siguiente ➡️", disabled=st.session_state.pagina_tabla >= paginas, use_container_width=True,
+                on_click=mover_pagina_tabla, args=(1,)
+            )
     
-    st.caption(f"Mostrando {len(df_filtrado)} de {len(df)} productos")
+        inicio = (st.session_state.pagina_tabla - 1) * por_pagina
+        st.caption(
+            f"Mostrando {inicio + 1 if total else 0}-{inicio + len(df_pagina)} de {total:,} productos "
+            f"(página {st.session_state.pagina_tabla} de {paginas})"
+        )
 
 
-# ========== HISTORIAL DE AJUSTES ==========
+    with st.expander("📋 Ver todos los productos", expanded=False):
+        tabla_productos()
 
-with st.expander("📜 Ver historial de ajustes", expanded=False):
-    df_log = cargar_log()
+
+    # ========== HISTORIAL DE AJUSTES ==========
+
+    @st.fragment
+    def historial_ajustes():
+        """Historial paginado, los más recientes primero; filtrar o paginar solo recarga este bloque."""
+        col_fechas, col_item = st.columns([3, 2])
+        with col_fechas:
+            rango = st.date_input("Fechas:", value=(), format="YYYY-MM-DD")
+        with col_item:
+            item = st.text_input("ID Alegra o código de barras:", key="historial_item").strip()
+        desde = rango[0] if len(rango) > 0 else None
+        hasta = rango[1] if len(rango) > 1 else desde
+    
+        filtros = (desde, hasta, item)
+        if st.session_state.get("filtros_historial") != filtros or "pagina_historial" not in st.session_state:
+            st.session_state.filtros_historial = filtros
+            st.session_state.pagina_historial = 1
+    
+        df_log, total = pagina_log(st.session_state.pagina_historial - 1, LIMITE_HISTORIAL, desde, hasta, item)
+        paginas = max(1, -(-total // LIMITE_HISTORIAL))
+        if st.session_state.pagina_historial > paginas:
+            st.session_state.pagina_historial = paginas
+            df_log, total = pagina_log(paginas - 1, LIMITE_HISTORIAL, desde, hasta, item)
+    
+        if df_log.empty:
+            st.info("No hay ajustes registrados todavía" if not any(filtros) else "No hay ajustes con esos filtros")
+            return
     
-    if df_log.empty:
-        st.info("No hay ajustes registrados todavía")
-    else:
-        df_log_ordenado = df_log.sort_values("fecha_hora", ascending=False)
-        
         st.dataframe(
-            df_log_ordenado,
+            df_log,
             use_container_width=True,
             hide_index=True,
             column_config={
@@ -1086,14 +1165,42 @@ with st.expander("📜 Ver historial de ajustes", expanded=False):
                 "tipo_ajuste": st.column_config.TextColumn("Tipo")
             }
         )
-        
-        st.caption(f"Total: {len(df_log)} ajustes registrados")
+    
+        col_pagina, col_total = st.columns([1, 3])
+        with col_pagina:
+            st.number_input(
+                "Página", min_value=1, max_value=paginas, key="pagina_historial", label_visibility="collapsed"
+            )
+        with col_total:
+            inicio = (st.session_state.pagina_historial - 1) * LIMITE_HISTORIAL
+            st.caption(
+                f"Mostrando {inicio + 1}-{inicio + len(df_log)} de {total:,} ajustes "
+                f"(página {st.session_state.pagina_historial} de {paginas})"
+            )
+    
+        if st.toggle("📅 Ver totales por día", key="historial_por_dia"):
+            st.dataframe(
+                ajustes_por_dia(desde, hasta),
+                use_container_width=True,
+                hide_index=True,
+                column_config={
+                    "dia": st.column_config.TextColumn("Día"),
+                    "ajustes": st.column_config.NumberColumn("Ajustes"),
+                    "entradas": st.column_config.NumberColumn("Entradas"),
+                    "salidas": st.column_config.NumberColumn("Salidas"),
+                    "diferencia_neta": st.column_config.NumberColumn("Diferencia neta")
+                }
+            )
+
 
+    with st.expander("📜 Ver historial de ajustes", expanded=False):
+        historial_ajustes()
 
-# ========== FOOTER CON ATAJOS ==========
 
-st.markdown("---")
-st.markdown("""
+    # ========== FOOTER CON ATAJOS ==========
+
+    st.markdown("---")
+    st.markdown("""
 <div style="text-align: center; color: #666; font-size: 12px;">
     <strong>Atajos de teclado:</strong><br>
     <span class="keyboard-hint">Enter</span> Buscar producto / Guardar conteo &nbsp;|&nbsp;
@@ -1101,3 +1208,8 @@ st.markdown("""
     <span class="keyboard-hint">Esc</span> Cancelar/Limpiar
 </div>
 """, unsafe_allow_html=True)
+
+finally:
+    # También cuando st.rerun/st.stop cortan la ejecución antes del footer
+    registrar_duracion("rerun", time.perf_counter() - inicio_rerun)
+    al_terminar_ejecucion()
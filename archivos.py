@@ -0,0 +1,52 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo queda el bloqueo entre hilos del proceso
+    fcntl = None
+
+
+# ========== BLOQUEO ENTRE PROCESOS ==========
+
+@contextmanager
+def bloqueo_archivo(ruta, exclusivo=True):
+    """Bloqueo advisory sobre `ruta` compartido por todos los procesos del servidor.
+
+    Se bloquea un archivo hermano `<ruta>.lock` para que el bloqueo sobreviva
+    al reemplazo atómico del archivo de datos. Los lectores toman el bloqueo
+    compartido y los escritores el exclusivo. No es reentrante: no anidar dos
+    bloqueos sobre la misma ruta en el mismo proceso.
+    """
+    with open(f"{ruta}.lock", "a+") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusivo else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+# ========== ESCRITURA ATÓMICA ==========
+
+@contextmanager
+def escritura_atomica(ruta):
+    """Entrega una ruta temporal; al salir sin error la renombra sobre `ruta`.
+
+    Los lectores ven el archivo anterior completo o el nuevo completo, nunca
+    uno a medio escribir.
+    """
+    directorio = os.path.dirname(os.path.abspath(ruta))
+    fd, temporal = tempfile.mkstemp(dir=directorio, prefix=".tmp_", suffix=f"_{os.path.basename(ruta)}")
+    os.close(fd)
+    try:
+        yield temporal
+        with open(temporal, "rb+") as f:
+            os.fsync(f.fileno())
+        os.replace(temporal, ruta)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
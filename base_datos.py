@@ -0,0 +1,157 @@
+import os
+import sqlite3
+import threading
+
+
+# ========== CONFIGURACIÓN ==========
+
+ARCHIVO_DB = "inventario.db"
+
+ESQUEMA = """
+-- Diario de conteos: solo se agregan filas; se compacta hacia inventario.feather
+CREATE TABLE IF NOT EXISTS conteos (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    codigo TEXT NOT NULL,
+    cantidad REAL NOT NULL,
+    fecha_hora TEXT NOT NULL
+);
+
+-- Ajustes confirmados a la espera de enviarse a Alegra. `base_actualizado` es la
+-- hora de la foto de stock contra la que se calculó la diferencia y `dueno` el
+-- proceso que lo está enviando
+CREATE TABLE IF NOT EXISTS cola_ajustes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    bodega TEXT NOT NULL,
+    fecha TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    tipo TEXT NOT NULL,
+    cantidad REAL NOT NULL,
+    costo REAL NOT NULL,
+    codigo_barras TEXT,
+    nombre TEXT,
+    precio REAL,
+    cantidad_anterior REAL,
+    cantidad_contada REAL,
+    diferencia REAL,
+    estado TEXT NOT NULL DEFAULT 'pendiente',
+    documento TEXT,
+    error TEXT,
+    creado TEXT NOT NULL,
+    enviado TEXT,
+    intentos INTEGER NOT NULL DEFAULT 0,
+    proximo_intento REAL NOT NULL DEFAULT 0,
+    base_actualizado REAL,
+    dueno TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_cola_ajustes_estado ON cola_ajustes (estado, bodega, fecha);
+CREATE INDEX IF NOT EXISTS idx_cola_ajustes_item ON cola_ajustes (item_id, id);
+
+-- Última foto conocida del stock de cada item en Alegra
+CREATE TABLE IF NOT EXISTS stock_alegra (
+    codigo TEXT PRIMARY KEY,
+    nombre TEXT,
+    cantidad_disponible REAL NOT NULL,
+    costo_unitario REAL NOT NULL,
+    precio REAL NOT NULL,
+    actualizado REAL NOT NULL
+);
+
+-- Historial de ajustes aceptados por Alegra (copia indexada de los CSV del log)
+CREATE TABLE IF NOT EXISTS log_ajustes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    fecha_hora TEXT NOT NULL,
+    codigo_barras TEXT,
+    id_alegra TEXT,
+    nombre TEXT,
+    precio REAL,
+    cantidad_anterior REAL,
+    cantidad_nueva REAL,
+    diferencia REAL,
+    tipo_ajuste TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_log_ajustes_fecha ON log_ajustes (fecha_hora, id);
+CREATE INDEX IF NOT EXISTS idx_log_ajustes_item ON log_ajustes (id_alegra, fecha_hora);
+CREATE INDEX IF NOT EXISTS idx_log_ajustes_barras ON log_ajustes (codigo_barras, fecha_hora);
+
+-- Totales del historial por día, al día con cada ajuste registrado
+CREATE TABLE IF NOT EXISTS ajustes_por_dia (
+    dia TEXT PRIMARY KEY,
+    ajustes INTEGER NOT NULL DEFAULT 0,
+    entradas INTEGER NOT NULL DEFAULT 0,
+    salidas INTEGER NOT NULL DEFAULT 0,
+    diferencia_neta REAL NOT NULL DEFAULT 0
+);
+
+-- Último latido de cada proceso que envía ajustes (ver sincronizacion.Latido)
+CREATE TABLE IF NOT EXISTS trabajadores (
+    dueno TEXT PRIMARY KEY,
+    latido REAL NOT NULL
+);
+
+-- Valores sueltos de estado compartidos entre procesos
+CREATE TABLE IF NOT EXISTS estado (
+    clave TEXT PRIMARY KEY,
+    valor TEXT
+);
+"""
+
+# Columnas agregadas después de crear la tabla: {tabla: [(columna, definición)]}
+COLUMNAS_AGREGADAS = {
+    "cola_ajustes": [
+        ("intentos", "INTEGER NOT NULL DEFAULT 0"),
+        ("proximo_intento", "REAL NOT NULL DEFAULT 0"),
+        ("base_actualizado", "REAL"),
+        ("dueno", "TEXT"),
+    ],
+}
+
+_inicializadas = set()
+_lock_inicializacion = threading.Lock()
+
+
+# ========== CONEXIÓN ==========
+
+def conectar(ruta=ARCHIVO_DB):
+    """Abre una conexión a la base local.
+
+    Las conexiones de sqlite3 no se comparten entre hilos: abrir una por
+    operación y cerrarla al terminar.
+    """
+    con = sqlite3.connect(ruta, timeout=30)
+    con.row_factory = sqlite3.Row
+    con.execute("PRAGMA synchronous=NORMAL")
+    with _lock_inicializacion:
+        ruta_absoluta = os.path.abspath(ruta)
+        if ruta_absoluta not in _inicializadas:
+            # WAL permite leer mientras otro proceso escribe
+            con.execute("PRAGMA journal_mode=WAL")
+            _migrar(con)
+            con.executescript(ESQUEMA)
+            _inicializadas.add(ruta_absoluta)
+    return con
+
+
+def _migrar(con):
+    """Agrega a las tablas existentes las columnas que el esquema sumó después."""
+    for tabla, columnas in COLUMNAS_AGREGADAS.items():
+        existentes = {fila[1] for fila in con.execute(f"PRAGMA table_info({tabla})")}
+        if not existentes:
+            continue
+        for columna, definicion in columnas:
+            if columna not in existentes:
+                con.execute(f"ALTER TABLE {tabla} ADD COLUMN {columna} {definicion}")
+
+
+def leer_estado(con, clave, por_defecto=None):
+    """Lee un valor de la tabla de estado."""
+    fila = con.execute("SELECT valor FROM estado WHERE clave = ?", (clave,)).fetchone()
+    return fila["valor"] if fila else por_defecto
+
+
+def escribir_estado(con, clave, valor):
+    """Escribe un valor en la tabla de estado."""
+    con.execute(
+        "INSERT INTO estado (clave, valor) VALUES (?, ?) "
+        "ON CONFLICT(clave) DO UPDATE SET valor = excluded.valor",
+        (clave, str(valor))
+    )
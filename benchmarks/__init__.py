@@ -0,0 +1,4 @@
+"""Benchmarks de las rutas críticas del scanner contra un stub local de Alegra.
+
+Correr desde la raíz del repositorio: python -m benchmarks.correr --help
+"""
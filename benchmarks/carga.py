@@ -0,0 +1,246 @@
+"""Prueba de carga: varias sesiones de operador escaneando a la vez contra el stub de Alegra.
+
+Cada sesión maneja app.py con el AppTest de Streamlit (sin navegador): escanea
+un código de barras, ingresa la cantidad, guarda y confirma el ajuste, al
+ritmo pedido. Todas comparten el mismo directorio de trabajo (catálogo,
+base local y logs), como los procesos de un despliegue.
+
+Cada sesión corre en su propio proceso: compilar el script en varios hilos a
+la vez hace fallar a CPython 3.11 dentro del AppTest. La memoria reportada es
+por lo tanto el pico de cada proceso con una sesión.
+
+Al final se vacía la cola de ajustes y se verifica que ningún conteo
+confirmado falte en el inventario exportado ni en el stock del stub:
+
+    python -m benchmarks.carga --sesiones 15 --escaneos 20 --escaneos-por-minuto 10
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from benchmarks.catalogo_sintetico import escribir_csv
+from benchmarks.stub_alegra import StubAlegra, STOCK_INICIAL
+from benchmarks.correr import DIR_REPO, percentil
+
+
+# ========== CONFIGURACIÓN ==========
+
+ARCHIVO_APP = os.path.join(DIR_REPO, "app.py")
+
+# Segundos máximos de una ejecución del script antes de darla por colgada
+TIMEOUT_EJECUCION = 120
+
+# Segundos que se espera a que la cola de ajustes quede vacía al terminar
+ESPERA_COLA = 60
+
+SEMILLA = 4321
+
+
+# ========== SESIÓN SIMULADA ==========
+
+def _preparar_proceso(directorio, url_alegra):
+    os.environ["ALEGRA_API_URL"] = url_alegra
+    os.chdir(directorio)
+    if DIR_REPO not in sys.path:
+        sys.path.insert(0, DIR_REPO)
+    import streamlit.logger
+    streamlit.logger.set_log_level("error")
+
+
+def _esperar_cola(timeout=ESPERA_COLA):
+    """Espera a que no queden ajustes pendientes ni enviándose; retorna el resumen final."""
+    from sincronizacion import ESTADO_PENDIENTE, ESTADO_ENVIANDO, resumen_cola, procesar_cola
+
+    limite = time.time() + timeout
+    while True:
+        resumen = resumen_cola()
+        if not resumen[ESTADO_PENDIENTE] + resumen[ESTADO_ENVIANDO] or time.time() > limite:
+            return resumen
+        procesar_cola()
+        time.sleep(0.2)
+
+
+def correr_sesion(numero, escaneos, escaneos_por_minuto, directorio, url_alegra):
+    """Un operador: escanea cada código de `escaneos` y confirma su cantidad.
+
+    Retorna latencias (segundos), los conteos confirmados {barras: cantidad},
+    errores y el pico de memoria del proceso en MB.
+    """
+    _preparar_proceso(directorio, url_alegra)
+    from streamlit.testing.v1 import AppTest
+
+    azar = random.Random(SEMILLA + numero)
+    intervalo = 60 / escaneos_por_minuto if escaneos_por_minuto else 0
+    resultado = {"escaneo_a_listo": [], "guardar_y_confirmar": [], "confirmados": {}, "errores": []}
+
+    inicio = time.perf_counter()
+    app = AppTest.from_file(ARCHIVO_APP, default_timeout=TIMEOUT_EJECUCION)
+    app.run()
+    resultado["primera_carga"] = time.perf_counter() - inicio
+
+    proximo = time.perf_counter()
+    for barras in escaneos:
+        espera = proximo - time.perf_counter()
+        if espera > 0:
+            time.sleep(espera)
+        proximo = time.perf_counter() + intervalo
+        try:
+            inicio = time.perf_counter()
+            app.text_input(key="input_codigo").input(barras).run()
+            if not any(w.key == "cantidad_contada" for w in app.number_input):
+                raise RuntimeError(f"{barras}: el producto no quedó listo para contar")
+            resultado["escaneo_a_listo"].append(time.perf_counter() - inicio)
+
+            cantidad = azar.randint(0, 2 * STOCK_INICIAL)
+            app.number_input(key="cantidad_contada").set_value(cantidad).run()
+            inicio = time.perf_counter()
+            app.button(key="btn_guardar").click().run()
+            if any(b.key == "btn_confirmar" for b in app.button):
+                app.button(key="btn_confirmar").click().run()
+            resultado["guardar_y_confirmar"].append(time.perf_counter() - inicio)
+            if app.exception:
+                raise RuntimeError(app.exception[0].message)
+            resultado["confirmados"][barras] = cantidad
+
+            if any(b.key == "btn_nuevo" for b in app.button):
+                app.button(key="btn_nuevo").click().run()
+        except Exception as e:
+            resultado["errores"].append(f"{barras}: {e}")
+            # Otra sesión limpia para seguir con el siguiente código
+            app = AppTest.from_file(ARCHIVO_APP, default_timeout=TIMEOUT_EJECUCION)
+            app.run()
+
+    # El hilo de sincronización de este proceso termina con él: no dejar ajustes a medio enviar
+    _esperar_cola()
+    resultado["memoria_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return resultado
+
+
+# ========== VERIFICACIÓN ==========
+
+def verificar(confirmados, stub):
+    """Compara los conteos confirmados con el inventario exportado y con el stock del stub."""
+    import pandas as pd
+    from inventario import COL_CODIGO, COL_BARRAS, COL_CANTIDAD_ACTUAL, obtener_almacen, exportar_inventario_csv
+    from sincronizacion import ESTADO_FALLIDO
+
+    cola = _esperar_cola()
+    obtener_almacen().invalidar()
+    exportado = pd.read_csv(io.BytesIO(exportar_inventario_csv()), sep=";", dtype=str)
+    por_barras = exportado.set_index(COL_BARRAS)
+
+    conteos_perdidos = []
+    ajustes_perdidos = []
+    for barras, cantidad in confirmados.items():
+        fila = por_barras.loc[barras]
+        if pd.to_numeric(fila[COL_CANTIDAD_ACTUAL]) != cantidad:
+            conteos_perdidos.append(barras)
+        if stub.item(fila[COL_CODIGO])["inventory"]["availableQuantity"] != cantidad:
+            ajustes_perdidos.append(barras)
+    return {
+        "conteos_confirmados": len(confirmados),
+        "conteos_perdidos": conteos_perdidos,
+        "ajustes_perdidos": ajustes_perdidos,
+        "fallidos_en_cola": cola[ESTADO_FALLIDO],
+        "cola_final": cola,
+    }
+
+
+# ========== REPORTE ==========
+
+def resumen_latencias(segundos):
+    ordenados = sorted(s * 1000 for s in segundos)
+    if not ordenados:
+        return None
+    return {
+        "n": len(ordenados),
+        "p50_ms": round(percentil(ordenados, 0.50), 1),
+        "p95_ms": round(percentil(ordenados, 0.95), 1),
+        "p99_ms": round(percentil(ordenados, 0.99), 1),
+        "max_ms": round(ordenados[-1], 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga con sesiones de operador simultáneas")
+    parser.add_argument("--sesiones", type=int, default=10)
+    parser.add_argument("--escaneos", type=int, default=20, help="escaneos por sesión")
+    parser.add_argument("--escaneos-por-minuto", type=float, default=12, help="ritmo de cada operador (0 = sin pausa)")
+    parser.add_argument("--tamano", type=int, default=10000, help="filas del catálogo sintético")
+    parser.add_argument("--latencia", type=float, default=0.08, help="segundos por respuesta del stub")
+    parser.add_argument("--salida", help="archivo JSON donde guardar el reporte")
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp(prefix="carga_")
+    stub = StubAlegra(latencia=args.latencia, total_items=args.tamano).iniciar()
+    directorio_original = os.getcwd()
+    _preparar_proceso(directorio, stub.url)
+    try:
+        from inventario import COL_BARRAS, cargar_datos, procesar_archivo_subido
+
+        with open(escribir_csv("catalogo.csv", args.tamano, SEMILLA), "rb") as archivo:
+            procesar_archivo_subido(archivo, combinar=False)
+        # Códigos de barras únicos repartidos sin repetir entre sesiones
+        barras = cargar_datos()[COL_BARRAS]
+        barras = barras[(barras != "") & ~barras.duplicated(keep=False)].tolist()
+        random.Random(SEMILLA).shuffle(barras)
+        total = args.sesiones * args.escaneos
+        if total > len(barras):
+            parser.error(f"el catálogo solo tiene {len(barras)} códigos únicos para {total} escaneos")
+        reparto = [barras[i * args.escaneos:(i + 1) * args.escaneos] for i in range(args.sesiones)]
+
+        inicio = time.perf_counter()
+        contexto = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=args.sesiones, mp_context=contexto) as ejecutor:
+            futuros = [
+                ejecutor.submit(correr_sesion, i, reparto[i], args.escaneos_por_minuto, directorio, stub.url)
+                for i in range(args.sesiones)
+            ]
+            sesiones = [futuro.result() for futuro in futuros]
+        duracion = time.perf_counter() - inicio
+
+        confirmados = {}
+        for sesion in sesiones:
+            confirmados.update(sesion["confirmados"])
+        verificacion = verificar(confirmados, stub)
+    finally:
+        stub.detener()
+        os.chdir(directorio_original)
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    escaneos = sum(len(s["escaneo_a_listo"]) for s in sesiones)
+    memoria = [s["memoria_mb"] for s in sesiones]
+    reporte = {
+        "sesiones": args.sesiones,
+        "escaneos_por_sesion": args.escaneos,
+        "ritmo_por_operador": args.escaneos_por_minuto,
+        "tamano_catalogo": args.tamano,
+        "latencia_alegra_s": args.latencia,
+        "duracion_s": round(duracion, 1),
+        "escaneos_por_minuto": round(escaneos / duracion * 60, 1),
+        "primera_carga": resumen_latencias([s["primera_carga"] for s in sesiones]),
+        "escaneo_a_listo": resumen_latencias([t for s in sesiones for t in s["escaneo_a_listo"]]),
+        "guardar_y_confirmar": resumen_latencias([t for s in sesiones for t in s["guardar_y_confirmar"]]),
+        "memoria_mb": {"max_por_proceso": round(max(memoria), 1), "total": round(sum(memoria), 1)},
+        "errores": [e for s in sesiones for e in s["errores"]],
+        "verificacion": verificacion,
+    }
+
+    print(json.dumps(reporte, indent=2, ensure_ascii=False))
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(reporte, f, indent=2, ensure_ascii=False)
+    perdidos = verificacion["conteos_perdidos"] or verificacion["ajustes_perdidos"]
+    return 1 if perdidos or reporte["errores"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""Catálogos sintéticos con las columnas del export de Alegra, reproducibles por semilla."""
+import csv
+import random
+
+
+# ========== CONFIGURACIÓN ==========
+
+COLUMNAS_CATALOGO = [
+    "Codigo", "Nombre", "Cantidad inicial en bodega: Principal", "Codigo de barras", "Categoría", "Estado"
+]
+
+PRODUCTOS = [
+    "audífono", "cargador", "cable", "forro", "vidrio templado", "parlante", "mouse", "teclado",
+    "memoria", "batería", "soporte", "lámpara", "adaptador", "control", "reloj", "cámara"
+]
+MARCAS = ["Samsung", "Xiaomi", "Apple", "Genérico", "Lenovo", "JBL", "Sony", "Huawei"]
+VARIANTES = ["negro", "blanco", "azul", "rojo", "usb-c", "micro usb", "1m", "2m", "bluetooth", "pro", "mini"]
+CATEGORIAS = ["Accesorios", "Audio", "Carga", "Computo", "Protección", "Hogar"]
+
+# Uno de cada tantos productos comparte código de barras con otro o no tiene
+CADA_BARRAS_REPETIDO = 500
+CADA_SIN_BARRAS = 200
+
+
+# ========== GENERACIÓN ==========
+
+def filas_catalogo(filas, semilla=0):
+    """Genera `filas` productos (listas en el orden de COLUMNAS_CATALOGO)."""
+    azar = random.Random(semilla)
+    for i in range(1, filas + 1):
+        nombre = f"{azar.choice(PRODUCTOS)} {azar.choice(MARCAS)} {azar.choice(VARIANTES)} {i}"
+        if i % CADA_SIN_BARRAS == 0:
+            barras = ""
+        elif i % CADA_BARRAS_REPETIDO == 0:
+            barras = f"770{i - 1:010d}"
+        else:
+            barras = f"770{i:010d}"
+        yield [
+            str(i), nombre, str(azar.randint(0, 50)), barras,
+            azar.choice(CATEGORIAS), "Activo" if azar.random() > 0.05 else "Inactivo"
+        ]
+
+
+def escribir_csv(ruta, filas, semilla=0):
+    """Escribe el catálogo como CSV separado por `;` (como lo exporta Alegra)."""
+    with open(ruta, "w", newline="", encoding="utf-8") as f:
+        escritor = csv.writer(f, delimiter=";")
+        escritor.writerow(COLUMNAS_CATALOGO)
+        escritor.writerows(filas_catalogo(filas, semilla))
+    return ruta
+
+
+def escribir_xlsx(ruta, filas, semilla=0):
+    """Escribe el catálogo como XLSX en modo de solo escritura (memoria acotada)."""
+    from openpyxl import Workbook
+
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet()
+    hoja.append(COLUMNAS_CATALOGO)
+    for fila in filas_catalogo(filas, semilla):
+        hoja.append(fila)
+    libro.save(ruta)
+    return ruta
@@ -0,0 +1,283 @@
+"""Benchmark reproducible de las rutas críticas del scanner.
+
+Genera catálogos sintéticos (CSV y XLSX), levanta el stub local de Alegra y
+mide carga, búsquedas, escrituras e importación, más el flujo completo de
+escanear y guardar un conteo. Cada escenario corre en un directorio
+temporal propio. El resultado se guarda en JSON para compararlo entre
+versiones:
+
+    python -m benchmarks.correr --tamanos 1000 10000 100000 --latencia 0.05
+    python -m benchmarks.correr --comparar benchmarks/resultados/anterior.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+from benchmarks.catalogo_sintetico import escribir_csv, escribir_xlsx
+from benchmarks.stub_alegra import StubAlegra
+
+
+# ========== CONFIGURACIÓN ==========
+
+DIR_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DIR_RESULTADOS = os.path.join(DIR_REPO, "benchmarks", "resultados")
+
+TAMANOS = [1000, 10000, 100000]
+FORMATOS = ["csv", "xlsx"]
+
+# Repeticiones por operación (las importaciones y guardados completos se repiten menos)
+REPETICIONES = {
+    "procesar_archivo_subido": 2,
+    "procesar_archivo_subido_combinar": 1,
+    "cargar_datos": 5,
+    "cargar_datos_cache": 200,
+    "buscar_producto": 300,
+    "buscar_productos_por_nombre": 100,
+    "guardar_log_ajuste": 200,
+    "escanear_y_guardar": 50,
+    "guardar_datos": 3,
+}
+
+SEMILLA = 1234
+
+
+# ========== MEDICIÓN ==========
+
+def percentil(ordenados, fraccion):
+    """Percentil por rango más cercano de una lista ya ordenada."""
+    return ordenados[min(len(ordenados) - 1, round(fraccion * (len(ordenados) - 1)))]
+
+
+def resumir(tiempos):
+    """Estadísticas en milisegundos de una lista de duraciones en segundos."""
+    ordenados = sorted(t * 1000 for t in tiempos)
+    return {
+        "n": len(ordenados),
+        "total_s": round(sum(ordenados) / 1000, 4),
+        "media_ms": round(sum(ordenados) / len(ordenados), 3),
+        "p50_ms": round(percentil(ordenados, 0.50), 3),
+        "p95_ms": round(percentil(ordenados, 0.95), 3),
+        "max_ms": round(ordenados[-1], 3),
+    }
+
+
+def medir(funcion, repeticiones):
+    """Corre `funcion(i)` `repeticiones` veces y resume las duraciones."""
+    tiempos = []
+    for i in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(i)
+        tiempos.append(time.perf_counter() - inicio)
+    return resumir(tiempos)
+
+
+# ========== ESCENARIOS ==========
+
+def correr_escenario(tamano, formato):
+    """Mide todas las operaciones sobre un catálogo de `tamano` filas en `formato`."""
+    # Importados aquí: ALEGRA_API_URL ya apunta al stub y el directorio actual es el del escenario
+    from pyarrow import feather
+    from alegra import obtener_cliente_alegra, extraer_datos_item
+    from inventario import (
+        ARCHIVO_INVENTARIO, COL_CODIGO, COL_NOMBRE, COL_BARRAS, COL_CANTIDAD_ACTUAL, IndiceNombres, obtener_almacen, cargar_datos, guardar_datos,
+        registrar_conteo, buscar_producto, buscar_productos_por_nombre, procesar_archivo_subido
+    )
+    from log_ajustes import guardar_log_ajuste
+    from sincronizacion import encolar_ajuste, procesar_cola
+
+    obtener_almacen.clear()
+    azar = random.Random(SEMILLA)
+    resultados = {}
+
+    inicio = time.perf_counter()
+    escribir = escribir_csv if formato == "csv" else escribir_xlsx
+    ruta = escribir(os.path.abspath(f"catalogo.{formato}"), tamano, SEMILLA)
+    generacion_s = time.perf_counter() - inicio
+
+    def importar(combinar):
+        def paso(_):
+            with open(ruta, "rb") as archivo:
+                if procesar_archivo_subido(archivo, combinar=combinar) is None:
+                    raise RuntimeError(f"No se pudo importar {ruta}")
+        return paso
+
+    resultados["procesar_archivo_subido"] = medir(importar(False), REPETICIONES["procesar_archivo_subido"])
+    resultados["procesar_archivo_subido_combinar"] = medir(
+        importar(True), REPETICIONES["procesar_archivo_subido_combinar"]
+    )
+
+    almacen = obtener_almacen()
+
+    def cargar_en_frio(_):
+        almacen.invalidar()
+        cargar_datos()
+
+    resultados["cargar_datos"] = medir(cargar_en_frio, REPETICIONES["cargar_datos"])
+    resultados["cargar_datos_cache"] = medir(lambda _: cargar_datos(), REPETICIONES["cargar_datos_cache"])
+
+    df = cargar_datos()
+    barras = [b for b in df[COL_BARRAS].tolist() if b]
+    escaneos = [azar.choice(barras) for _ in range(REPETICIONES["buscar_producto"])]
+    resultados["buscar_producto"] = medir(
+        lambda i: buscar_producto(df, escaneos[i], "codigo_barras"), REPETICIONES["buscar_producto"]
+    )
+
+    inicio = time.perf_counter()
+    IndiceNombres(df[COL_NOMBRE])
+    resultados["construir_indice_nombres"] = resumir([time.perf_counter() - inicio])
+    nombres = df[COL_NOMBRE].tolist()
+    terminos = []
+    for i in range(REPETICIONES["buscar_productos_por_nombre"]):
+        palabras = azar.choice(nombres).split()
+        termino = " ".join(palabras[:2])
+        if i % 2:
+            # Un error de tipeo en la primera palabra: pasa por la similitud de trigramas
+            posicion = azar.randrange(len(palabras[0]))
+            termino = palabras[0][:posicion] + palabras[0][posicion + 1:] + " " + " ".join(palabras[1:2])
+        terminos.append(termino)
+    buscar_productos_por_nombre(df, terminos[0])
+    resultados["buscar_productos_por_nombre"] = medir(
+        lambda i: buscar_productos_por_nombre(df, terminos[i]), REPETICIONES["buscar_productos_por_nombre"]
+    )
+
+    resultados["guardar_log_ajuste"] = medir(
+        lambda i: guardar_log_ajuste(
+            codigo_barras=escaneos[i], item_id=str(i), nombre=f"Item {i}", precio=2500,
+            cantidad_anterior=10, cantidad_nueva=9, diferencia=-1, tipo_ajuste="out"
+        ),
+        REPETICIONES["guardar_log_ajuste"]
+    )
+
+    cliente = obtener_cliente_alegra()
+
+    def escanear_y_guardar(i):
+        # Lo mismo que la app entre el escaneo y el envío confirmado a Alegra
+        idx, producto = buscar_producto(cargar_datos(), escaneos[i], "codigo_barras")
+        respuesta = cliente.get(f"/items/{producto[COL_CODIGO]}")
+        respuesta.raise_for_status()
+        datos = extraer_datos_item(respuesta.json())
+        contada = datos["cantidad_disponible"] + (1 if i % 2 else -1)
+        diferencia = contada - datos["cantidad_disponible"]
+        registrar_conteo(idx, contada)
+        encolar_ajuste({
+            "item_id": producto[COL_CODIGO], "tipo_ajuste": "in" if diferencia > 0 else "out",
+            "diferencia": diferencia, "costo_unitario": datos["costo_unitario"],
+            "codigo_barras": escaneos[i], "nombre": datos["nombre"], "precio": datos["precio"],
+            "cantidad_anterior": datos["cantidad_disponible"], "cantidad_contada": contada
+        })
+        procesar_cola()
+
+    resultados["escanear_y_guardar"] = medir(escanear_y_guardar, REPETICIONES["escanear_y_guardar"])
+
+    # Como un guardado real: el DataFrame reducido de cargar_datos con un conteo cambiado
+    columnas_en_disco = feather.read_table(ARCHIVO_INVENTARIO).column_names
+
+    def guardar(i):
+        df = cargar_datos().copy()
+        df.iloc[i, df.columns.get_loc(COL_CANTIDAD_ACTUAL)] = i
+        guardar_datos(df)
+
+    resultados["guardar_datos"] = medir(guardar, REPETICIONES["guardar_datos"])
+    if feather.read_table(ARCHIVO_INVENTARIO).column_names != columnas_en_disco:
+        raise RuntimeError("guardar_datos cambió las columnas del catálogo en disco")
+
+    return {
+        "tamano": tamano,
+        "formato": formato,
+        "generacion_catalogo_s": round(generacion_s, 3),
+        "operaciones": resultados,
+    }
+
+
+# ========== REPORTE ==========
+
+def version_codigo():
+    """Commit actual del repositorio, o None si no se puede saber."""
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], cwd=DIR_REPO,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def imprimir_escenario(escenario, anterior=None):
+    print(f"\n== {escenario['tamano']:,} filas, {escenario['formato']} ==")
+    for operacion, datos in escenario["operaciones"].items():
+        linea = f"  {operacion:34} p50 {datos['p50_ms']:10.2f} ms   p95 {datos['p95_ms']:10.2f} ms   n={datos['n']}"
+        previo = (anterior or {}).get(operacion)
+        if previo and previo["p50_ms"]:
+            linea += f"   ({datos['p50_ms'] / previo['p50_ms']:.2f}x vs anterior)"
+        print(linea)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de las rutas críticas del scanner")
+    parser.add_argument("--tamanos", type=int, nargs="+", default=TAMANOS, help="filas de cada catálogo")
+    parser.add_argument("--formatos", nargs="+", choices=FORMATOS, default=FORMATOS)
+    parser.add_argument("--latencia", type=float, default=0.05, help="segundos por respuesta del stub")
+    parser.add_argument("--salida", help="archivo JSON de resultados (por defecto en benchmarks/resultados/)")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior para comparar el p50")
+    args = parser.parse_args()
+
+    fecha = datetime.now()
+    version = version_codigo()
+    salida = os.path.abspath(args.salida or os.path.join(
+        DIR_RESULTADOS, f"benchmark_{fecha.strftime('%Y%m%d_%H%M%S')}_{version or 'sin-version'}.json"
+    ))
+    anteriores = {}
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            for escenario in json.load(f)["escenarios"]:
+                anteriores[(escenario["tamano"], escenario["formato"])] = escenario["operaciones"]
+
+    # Sin servidor de Streamlit los cachés avisan en cada llamada
+    import streamlit.logger
+    streamlit.logger.set_log_level("error")
+
+    stub = StubAlegra(latencia=args.latencia, total_items=max(args.tamanos)).iniciar()
+    os.environ["ALEGRA_API_URL"] = stub.url
+    sys.path.insert(0, DIR_REPO)
+    directorio_original = os.getcwd()
+
+    escenarios = []
+    try:
+        for tamano in args.tamanos:
+            for formato in args.formatos:
+                directorio = tempfile.mkdtemp(prefix=f"benchmark_{tamano}_{formato}_")
+                os.chdir(directorio)
+                try:
+                    escenario = correr_escenario(tamano, formato)
+                finally:
+                    os.chdir(directorio_original)
+                    shutil.rmtree(directorio, ignore_errors=True)
+                escenarios.append(escenario)
+                imprimir_escenario(escenario, anteriores.get((tamano, formato)))
+    finally:
+        stub.detener()
+
+    resultado = {
+        "fecha": fecha.isoformat(timespec="seconds"),
+        "version": version,
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "latencia_alegra_s": args.latencia,
+        "repeticiones": REPETICIONES,
+        "escenarios": escenarios,
+    }
+    os.makedirs(os.path.dirname(salida), exist_ok=True)
+    with open(salida, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+    print(f"\nResultados en {salida}")
+
+
+if __name__ == "__main__":
+    main()
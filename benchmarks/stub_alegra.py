@@ -0,0 +1,155 @@
+"""Servidor HTTP local que imita los endpoints de Alegra que usa el scanner.
+
+Atiende GET /items/{id}, GET /items (con `metadata=true`) y POST
+/inventory-adjustments con una latencia configurable. Uso suelto:
+
+    python -m benchmarks.stub_alegra --puerto 8765 --latencia 0.08
+
+y arrancar la app con ALEGRA_API_URL=http://127.0.0.1:8765/api/v1.
+"""
+import re
+import json
+import time
+import argparse
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+
+# ========== CONFIGURACIÓN ==========
+
+PREFIJO_API = "/api/v1"
+
+# Stock con que arranca cada item que no se ha ajustado
+STOCK_INICIAL = 10
+
+RUTA_ITEM = re.compile(rf"^{PREFIJO_API}/items/(\w+)$")
+
+
+# ========== STUB ==========
+
+class StubAlegra:
+    """Stub de Alegra en un hilo propio; usar como context manager.
+
+    `latencia` son los segundos que tarda cada respuesta y `total_items` el
+    tamaño del catálogo que informa el listado. El stock de cada item se
+    mueve con los ajustes recibidos. Un ajuste que incluye algún item de
+    `invalidos` se rechaza entero con 400, como la validación de Alegra.
+    """
+
+    def __init__(self, puerto=0, latencia=0.0, total_items=1000):
+        self.latencia = latencia
+        self.total_items = total_items
+        self.stock = {}
+        self.invalidos = set()
+        self.llamadas = Counter()
+        self._lock = threading.Lock()
+        self._documentos = 0
+        self._servidor = ThreadingHTTPServer(("127.0.0.1", puerto), self._manejador())
+        self._servidor.daemon_threads = True
+        self._hilo = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._servidor.server_address[1]}{PREFIJO_API}"
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._servidor.serve_forever, name="stub-alegra", daemon=True)
+        self._hilo.start()
+        return self
+
+    def detener(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.detener()
+
+    def item(self, item_id):
+        with self._lock:
+            cantidad = self.stock.get(str(item_id), STOCK_INICIAL)
+        return {
+            "id": str(item_id),
+            "name": f"Item {item_id}",
+            "inventory": {"availableQuantity": cantidad, "unitCost": 1000},
+            "price": [{"price": 2500}]
+        }
+
+    def ajustar(self, items):
+        with self._lock:
+            for item in items:
+                actual = self.stock.get(item["id"], STOCK_INICIAL)
+                signo = 1 if item["type"] == "in" else -1
+                self.stock[item["id"]] = actual + signo * item["quantity"]
+            self._documentos += 1
+            return self._documentos
+
+    def _manejador(self):
+        stub = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _responder(self, estado, cuerpo):
+                datos = json.dumps(cuerpo).encode("utf-8")
+                self.send_response(estado)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(datos)))
+                self.end_headers()
+                self.wfile.write(datos)
+
+            def do_GET(self):
+                time.sleep(stub.latencia)
+                ruta = urlsplit(self.path)
+                encontrado = RUTA_ITEM.match(ruta.path)
+                if encontrado:
+                    stub.llamadas["GET /items/{id}"] += 1
+                    return self._responder(200, stub.item(encontrado.group(1)))
+                if ruta.path == f"{PREFIJO_API}/items":
+                    stub.llamadas["GET /items"] += 1
+                    params = parse_qs(ruta.query)
+                    inicio = int(params.get("start", [0])[0])
+                    limite = int(params.get("limit", [30])[0])
+                    items = [stub.item(i) for i in range(inicio + 1, min(inicio + limite, stub.total_items) + 1)]
+                    if params.get("metadata") == ["true"]:
+                        return self._responder(200, {"data": items, "metadata": {"total": stub.total_items}})
+                    return self._responder(200, items)
+                self._responder(404, {"message": "not found"})
+
+            def do_POST(self):
+                time.sleep(stub.latencia)
+                largo = int(self.headers.get("Content-Length", 0))
+                cuerpo = json.loads(self.rfile.read(largo) or b"{}")
+                if urlsplit(self.path).path == f"{PREFIJO_API}/inventory-adjustments":
+                    stub.llamadas["POST /inventory-adjustments"] += 1
+                    items = cuerpo.get("items", [])
+                    if any(item["id"] in stub.invalidos for item in items):
+                        return self._responder(400, {"message": "item inválido"})
+                    return self._responder(201, {"id": stub.ajustar(items)})
+                self._responder(404, {"message": "not found"})
+
+        return Manejador
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub local de la API de Alegra")
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--latencia", type=float, default=0.0, help="segundos por respuesta")
+    parser.add_argument("--items", type=int, default=1000, help="total de items del listado")
+    args = parser.parse_args()
+
+    stub = StubAlegra(args.puerto, args.latencia, args.items)
+    print(f"Stub de Alegra en {stub.url} (latencia {args.latencia} s)")
+    try:
+        stub._servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
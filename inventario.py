@@ -0,0 +1,1060 @@
+import os
+import re
+import bisect
+import heapq
+import tempfile
+import threading
+import unicodedata
+from collections import Counter, namedtuple
+from contextlib import closing
+from datetime import datetime
+import streamlit as st
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import feather
+from base_datos import ARCHIVO_DB, conectar, leer_estado, escribir_estado
+from archivos import bloqueo_archivo, escritura_atomica
+from metricas import cronometrado
+
+
+# ========== CONFIGURACIÓN ==========
+
+# Copia de trabajo en Feather sin comprimir: se lee con memory-map y los
+# procesos comparten las páginas. CSV/Excel solo al importar y exportar
+ARCHIVO_INVENTARIO = "inventario.feather"
+
+# Copia de trabajo anterior en CSV; se convierte sola la primera vez
+ARCHIVO_INVENTARIO_CSV = "inventario.csv"
+
+# Conteos acumulados en el diario antes de volcarlos a la copia de trabajo
+COMPACTAR_CADA = 500
+
+# Vive en un módulo importado (no en app.py, que se re-ejecuta en cada rerun)
+# para que el mismo bloqueo proteja a todas las sesiones del proceso
+LOCK = threading.RLock()
+
+# Columnas del inventario
+COL_CODIGO = "Codigo"
+COL_NOMBRE = "Nombre"
+COL_STOCK = "Cantidad inicial en bodega: Principal"
+COL_BARRAS = "Codigo de barras"
+COL_CANTIDAD_ACTUAL = "cantidad_actual"
+
+# Columnas opcionales del archivo por las que se desglosa el avance del conteo
+COLUMNAS_DESGLOSE = ("Categoría", "Categoria", "Estado")
+
+# Columnas que se cargan en memoria; las demás del archivo quedan solo en disco
+COLUMNAS_ESCANER = {COL_CODIGO, COL_NOMBRE, COL_BARRAS, COL_CANTIDAD_ACTUAL, *COLUMNAS_DESGLOSE}
+
+# Texto respaldado por Arrow: se lee de Feather sin convertir a objetos de Python
+TIPO_TEXTO = pd.StringDtype("pyarrow")
+TIPOS_ARROW = {pa.string(): TIPO_TEXTO, pa.large_string(): TIPO_TEXTO}
+
+# Separadores aceptados cuando un producto tiene varios códigos de barras en la celda
+SEPARADORES_BARRAS = re.compile(r"[,|/\s]+")
+
+
+# Búsqueda por nombre: similitud mínima de trigramas para aceptar un error de tipeo
+SIMILITUD_MINIMA = 0.5
+
+# Puntaje por palabra según cómo coincide con el término
+PUNTAJE_EXACTO = 3.0
+PUNTAJE_PREFIJO = 2.0
+PUNTAJE_SUBCADENA = 1.5
+
+SEPARADORES_NOMBRE = re.compile(r"[^a-z0-9]+")
+
+
+class ConflictoVersionInventario(Exception):
+    """Otro proceso guardó el inventario después de que se leyó el DataFrame."""
+
+
+def esta_en(serie, valores):
+    """Máscara (numpy) de las celdas de texto de `serie` que están en `valores`.
+
+    Usa is_in de Arrow: el isin de pandas sobre texto Arrow convierte cada
+    valor a escalar y es muy lento con conjuntos grandes.
+    """
+    arreglo = pa.array(serie)
+    conjunto = pa.array(list(valores), arreglo.type)
+    return pc.is_in(arreglo, value_set=conjunto).to_numpy(zero_copy_only=False)
+
+
+# ========== ÍNDICE DE CÓDIGOS DE BARRAS ==========
+
+def normalizar_codigo_barras(codigo):
+    """Normaliza un código de barras para compararlo.
+
+    Quita espacios, el ".0" que deja Excel al leerlo como número y los ceros a
+    la izquierda de los códigos numéricos, para que UPC-A y EAN-13 coincidan.
+    """
+    codigo = str(codigo).strip().upper()
+    if codigo.endswith(".0"):
+        codigo = codigo[:-2]
+    if codigo.isdigit():
+        codigo = codigo.lstrip("0") or "0"
+    if codigo in ("", "NAN", "NONE"):
+        return ""
+    return codigo
+
+
+class IndiceBarras:
+    """Índice hash de código de barras normalizado a filas del inventario."""
+
+    def __init__(self, serie_barras=None):
+        self.filas = {}
+        if serie_barras is not None:
+            self.agregar(serie_barras)
+
+    def agregar(self, serie_barras):
+        """Suma al índice las filas de la serie (sirve para armarlo por bloques)."""
+        for idx, celda in serie_barras.items():
+            for codigo in SEPARADORES_BARRAS.split(str(celda)):
+                codigo = normalizar_codigo_barras(codigo)
+                if not codigo:
+                    continue
+                filas = self.filas.setdefault(codigo, [])
+                if idx not in filas:
+                    filas.append(idx)
+
+    @property
+    def colisiones(self):
+        """Códigos de barras asignados a más de un producto."""
+        return {codigo: filas for codigo, filas in self.filas.items() if len(filas) > 1}
+
+    def buscar(self, codigo):
+        """Retorna las filas que tienen el código de barras (lista vacía si ninguna)."""
+        return self.filas.get(normalizar_codigo_barras(codigo), [])
+
+
+# ========== ÍNDICE DE NOMBRES ==========
+
+def normalizar_texto(texto):
+    """Minúsculas sin tildes ni signos: "Audífono 3.5mm" -> "audifono 3 5mm"."""
+    texto = unicodedata.normalize("NFKD", str(texto))
+    texto = "".join(c for c in texto if not unicodedata.combining(c)).lower()
+    return " ".join(SEPARADORES_NOMBRE.split(texto)).strip()
+
+
+def _trigramas(palabra):
+    """Trigramas de la palabra más uno de inicio, que pesa más el comienzo."""
+    palabra = f" {palabra}"
+    return {palabra[i:i + 3] for i in range(len(palabra) - 2)}
+
+
+class IndiceNombres:
+    """Índice de palabras de los nombres para búsqueda por prefijo y con errores de tipeo.
+
+    Guarda las palabras normalizadas ordenadas (búsqueda de prefijo con
+    bisect), las filas donde aparece cada una y los trigramas de cada
+    palabra (subcadenas y palabras parecidas). Un producto debe coincidir
+    con todas las palabras del término; se ordena por puntaje.
+    """
+
+    def __init__(self, serie_nombres):
+        self.nombres = {}
+        filas_por_palabra = {}
+        for idx, nombre in serie_nombres.items():
+            if pd.isna(nombre):
+                continue
+            normalizado = normalizar_texto(nombre)
+            self.nombres[idx] = normalizado
+            for palabra in set(normalizado.split()):
+                filas_por_palabra.setdefault(palabra, []).append(idx)
+
+        self.palabras = sorted(filas_por_palabra)
+        self.filas = [filas_por_palabra[p] for p in self.palabras]
+        self.trigramas = {}
+        self.n_trigramas = []
+        for posicion, palabra in enumerate(self.palabras):
+            trigramas = _trigramas(palabra)
+            self.n_trigramas.append(len(trigramas))
+            for trigrama in trigramas:
+                self.trigramas.setdefault(trigrama, []).append(posicion)
+
+    def _puntajes_palabra(self, termino):
+        """Puntaje por posición de palabra del índice para una palabra del término."""
+        puntajes = {}
+        # Prefijo (incluye la coincidencia exacta)
+        inicio = bisect.bisect_left(self.palabras, termino)
+        fin = bisect.bisect_left(self.palabras, termino + "\uffff")
+        for posicion in range(inicio, fin):
+            puntajes[posicion] = PUNTAJE_EXACTO if self.palabras[posicion] == termino else PUNTAJE_PREFIJO
+
+        if len(termino) < 3:
+            return puntajes
+
+        trigramas = _trigramas(termino)
+
+        compartidos = Counter()
+        for trigrama in trigramas:
+            compartidos.update(self.trigramas.get(trigrama, ()))
+        for posicion, n in compartidos.items():
+            if posicion in puntajes:
+                continue
+            # Sin el trigrama de inicio, una subcadena comparte todos los demás
+            if n >= len(trigramas) - 1 and termino in self.palabras[posicion]:
+                puntajes[posicion] = PUNTAJE_SUBCADENA
+            else:
+                similitud = 2 * n / (len(trigramas) + self.n_trigramas[posicion])
+                if similitud >= SIMILITUD_MINIMA:
+                    puntajes[posicion] = similitud
+        return puntajes
+
+    def buscar(self, termino, limite=None):
+        """Retorna las filas que coinciden con el término, la mejor primero."""
+        palabras = normalizar_texto(termino).split()
+        if not palabras:
+            return []
+
+        total = None
+        for palabra in palabras:
+            por_fila = {}
+            for posicion, puntaje in self._puntajes_palabra(palabra).items():
+                for idx in self.filas[posicion]:
+                    if puntaje > por_fila.get(idx, 0):
+                        por_fila[idx] = puntaje
+            if total is None:
+                total = por_fila
+            else:
+                total = {idx: total[idx] + puntaje for idx, puntaje in por_fila.items() if idx in total}
+            if not total:
+                return []
+
+        frase = " ".join(palabras)
+
+        def clave(idx):
+            nombre = self.nombres[idx]
+            return (-total[idx], not nombre.startswith(frase), len(nombre))
+
+        if limite is None:
+            return sorted(total, key=clave)
+        return heapq.nsmallest(limite, total, key=clave)
+
+
+# ========== AVANCE DEL CONTEO ==========
+
+class ProgresoConteo:
+    """Contadores de productos contados, en total y por cada columna de COLUMNAS_DESGLOSE.
+
+    Se arma recorriendo el DataFrame una vez por versión del catálogo y
+    después solo se suma al marcar una fila como contada.
+    """
+
+    def __init__(self, df):
+        self.total = len(df)
+        contadas = df[COL_CANTIDAD_ACTUAL].notna().to_numpy()
+        self.contados = int(contadas.sum())
+        self.grupos = {}
+        self.desglose = {}
+        for columna in COLUMNAS_DESGLOSE:
+            if columna not in df.columns:
+                continue
+            grupos = df[columna].astype(object).fillna("Sin dato").astype(str)
+            totales = grupos.value_counts()
+            con_conteo = grupos[contadas].value_counts()
+            self.grupos[columna] = grupos.to_numpy()
+            self.desglose[columna] = {
+                grupo: [int(con_conteo.get(grupo, 0)), int(total)] for grupo, total in totales.items()
+            }
+
+    def marcar_contadas(self, posiciones):
+        """Suma las filas que pasaron de sin contar a contadas."""
+        self.contados += len(posiciones)
+        for columna, grupos in self.grupos.items():
+            for grupo, cantidad in pd.Series(grupos[posiciones]).value_counts().items():
+                self.desglose[columna][grupo][0] += int(cantidad)
+
+
+# ========== ALMACÉN EN MEMORIA ==========
+
+class AlmacenInventario:
+    """Inventario parseado una sola vez y compartido por todas las sesiones.
+
+    El catálogo se lee de la copia de trabajo (`inventario.feather`) solo si
+    el archivo cambió en disco (otro proceso lo reescribió) o si se invalidó;
+    cada recarga incrementa `version`. Los conteos no reescriben el archivo:
+    se agregan al diario `conteos` de la base local y se aplican sobre el
+    DataFrame en memoria, incrementando `version_conteos`. Cada
+    COMPACTAR_CADA conteos el diario se vuelca al archivo.
+
+    Las escrituras del archivo son atómicas (archivo temporal + rename), se hacen
+    con bloqueo de archivo entre procesos y llevan un contador
+    `version_inventario` en la base para detectar DataFrames desactualizados.
+    """
+
+    def __init__(self, ruta, ruta_db=ARCHIVO_DB, ruta_csv=ARCHIVO_INVENTARIO_CSV):
+        self.ruta = ruta
+        self.ruta_csv = ruta_csv
+        self.ruta_db = ruta_db
+        self.df = None
+        self.version = 0
+        self.version_conteos = 0
+        self._firma = None
+        self.version_disco = 0
+        self._seq = 0
+        self._seq_compactado = 0
+        self._indice_barras = None
+        self._indice_nombres = None
+        self._filas_contadas = None
+        self._csv_exportado = None
+        self.progreso = None
+        self._lecturas = threading.local()
+
+    def _firma_archivo(self):
+        try:
+            stat = os.stat(self.ruta)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def obtener(self):
+        """Retorna el DataFrame en memoria con los conteos del diario aplicados."""
+        with LOCK:
+            firma = self._firma_archivo()
+            if firma is None and self.ruta_csv and os.path.exists(self.ruta_csv):
+                self._convertir_csv()
+                firma = self._firma_archivo()
+            if firma is None:
+                self.df = None
+                self._firma = None
+                return None
+            if self.df is None or firma != self._firma:
+                with bloqueo_archivo(self.ruta, exclusivo=False):
+                    self._recargar()
+            else:
+                self._aplicar_diario(self._conexion_lectura())
+            return self.df
+
+    def _conexion_lectura(self):
+        """Conexión del hilo para leer el diario en cada consulta.
+
+        Abrir una conexión por búsqueda costaba casi 1 ms; Streamlit corre cada
+        ejecución del script en un hilo propio, así que se reutiliza durante
+        la ejecución y se libera con el hilo. Solo lee (autocommit), así que
+        siempre ve lo último que otros procesos confirmaron.
+        """
+        con = getattr(self._lecturas, "con", None)
+        if con is None:
+            con = self._lecturas.con = conectar(self.ruta_db)
+        return con
+
+    def _convertir_csv(self):
+        """Pasa la copia de trabajo en CSV de versiones anteriores a Feather."""
+        with bloqueo_archivo(self.ruta):
+            if self._firma_archivo() is None:
+                df = pd.read_csv(self.ruta_csv, sep=";", dtype=str, keep_default_na=False)
+                with escritura_atomica(self.ruta) as temporal:
+                    preparar_para_disco(normalizar_inventario(df)).to_feather(temporal, compression="uncompressed")
+
+    @cronometrado("disco: leer inventario")
+    def _recargar(self):
+        """Lee el archivo y el estado del diario; llamar con el bloqueo del archivo tomado."""
+        with closing(conectar(self.ruta_db)) as con:
+            # El archivo ya incluye los conteos hasta seq_compactado
+            self._seq_compactado = int(leer_estado(con, "seq_compactado", 0))
+            self.version_disco = int(leer_estado(con, "version_inventario", 0))
+            self._firma = self._firma_archivo()
+            self.df = self._leer()
+            self.progreso = ProgresoConteo(self.df)
+            self._seq = self._seq_compactado
+            self.version += 1
+            self._aplicar_diario(con)
+
+    def _tabla(self):
+        return feather.read_table(self.ruta, memory_map=True)
+
+    def _leer(self):
+        # Solo las columnas que usa el escáner; el resto queda en el archivo
+        tabla = self._tabla()
+        tabla = tabla.select([c for c in tabla.column_names if c in COLUMNAS_ESCANER])
+        return reducir_inventario(tabla.to_pandas(types_mapper=TIPOS_ARROW.get))
+
+    def _completo(self):
+        """Lee todas las columnas del archivo y les pone los conteos en memoria.
+
+        Llamar con el bloqueo del archivo tomado y el DataFrame al día con él.
+        """
+        df = self._tabla().to_pandas(types_mapper=TIPOS_ARROW.get)
+        df[COL_CANTIDAD_ACTUAL] = self.df[COL_CANTIDAD_ACTUAL].array.copy()
+        return df
+
+    def _aplicar_diario(self, con):
+        """Aplica al DataFrame los conteos del diario posteriores al último aplicado."""
+        filas = con.execute(
+            "SELECT seq, codigo, cantidad FROM conteos WHERE seq > ? ORDER BY seq", (self._seq,)
+        ).fetchall()
+        if not filas:
+            return
+        # Último conteo de cada código del lote, aplicado en una sola asignación vectorizada
+        ultimos = {fila["codigo"]: fila["cantidad"] for fila in filas}
+        codigos = self.df[COL_CODIGO]
+        posiciones = np.flatnonzero(esta_en(codigos, ultimos))
+        if len(posiciones):
+            cantidades = np.array([ultimos[c] for c in codigos.iloc[posiciones].tolist()], dtype=float)
+            if self.df[COL_CANTIDAD_ACTUAL].dtype == "Int64" and not np.all(cantidades % 1 == 0):
+                self.df[COL_CANTIDAD_ACTUAL] = self.df[COL_CANTIDAD_ACTUAL].astype("Float64")
+            columna = self.df.columns.get_loc(COL_CANTIDAD_ACTUAL)
+            sin_contar = self.df[COL_CANTIDAD_ACTUAL].isna().to_numpy()[posiciones]
+            self.progreso.marcar_contadas(posiciones[sin_contar])
+            self.df.iloc[posiciones, columna] = cantidades
+        self._seq = filas[-1]["seq"]
+        self.version_conteos += 1
+
+    @cronometrado("disco: escribir inventario")
+    def _escribir(self, con, df, version_esperada, ruta_preparada=None):
+        """Escribe el archivo de forma atómica si nadie lo cambió desde `version_esperada`.
+
+        Con `ruta_preparada` se instala ese archivo ya escrito en lugar de
+        `df`. Llamar con el bloqueo exclusivo del archivo y una transacción de
+        escritura abierta en `con`. Retorna el seq del diario incluido.
+        """
+        version_actual = int(leer_estado(con, "version_inventario", 0))
+        if version_esperada is not None and version_actual != version_esperada:
+            raise ConflictoVersionInventario(
+                f"El inventario cambió en disco (versión {version_actual}, se esperaba {version_esperada})"
+            )
+        ultimo = con.execute("SELECT COALESCE(MAX(seq), 0) FROM conteos").fetchone()[0]
+        if ruta_preparada is not None:
+            os.replace(ruta_preparada, self.ruta)
+        else:
+            with escritura_atomica(self.ruta) as temporal:
+                preparar_para_disco(df).to_feather(temporal, compression="uncompressed")
+        con.execute("DELETE FROM conteos WHERE seq <= ?", (ultimo,))
+        escribir_estado(con, "seq_compactado", ultimo)
+        escribir_estado(con, "version_inventario", version_actual + 1)
+        self.version_disco = version_actual + 1
+        self._firma = self._firma_archivo()
+        self._seq_compactado = ultimo
+        return ultimo
+
+    def guardar(self, df):
+        """Escribe en el archivo los conteos de `df` (por `Codigo`) junto con el diario.
+
+        `df` suele ser el DataFrame reducido de `cargar_datos`: el resto de las
+        columnas sale del archivo, como al compactar, así que guardarlo no
+        borra ninguna. Solo se toman las filas con `cantidad_actual`; un
+        producto sin contar en `df` conserva el conteo que tenga. Sin catálogo
+        en disco `df` se guarda como catálogo.
+
+        No hay chequeo de versión: los conteos se combinan sobre lo último
+        que haya en disco, así que no pisan los de otro proceso. El chequeo
+        de `_escribir` solo lo usa `compactar`.
+        """
+        with LOCK, bloqueo_archivo(self.ruta), closing(conectar(self.ruta_db)) as con:
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                if self._firma_archivo() is None:
+                    completo = df
+                else:
+                    if self.df is None or int(leer_estado(con, "version_inventario", 0)) != self.version_disco:
+                        self._recargar()
+                    self._aplicar_diario(con)
+                    completo = self._completo()
+                    _poner_conteos(completo, df)
+                self._escribir(con, completo, None)
+                con.commit()
+            except BaseException:
+                con.rollback()
+                raise
+            self._recargar()
+
+    def version_catalogo(self):
+        """Cuántas veces se ha cargado un catálogo (las compactaciones no cuentan)."""
+        with closing(conectar(self.ruta_db)) as con:
+            return int(leer_estado(con, "version_catalogo", 0))
+
+    def _conteos_vigentes(self, con):
+        """Códigos contados y su último conteo, con el diario al día.
+
+        Llamar con el bloqueo exclusivo del archivo y la transacción de
+        escritura abierta en `con`, para que nadie agregue conteos entre tanto.
+        """
+        if self._firma_archivo() is None:
+            return None
+        if self.df is None or int(leer_estado(con, "version_inventario", 0)) != self.version_disco:
+            self._recargar()
+        self._aplicar_diario(con)
+        contados = self.df.loc[self.df[COL_CANTIDAD_ACTUAL].notna(), [COL_CODIGO, COL_CANTIDAD_ACTUAL]]
+        return contados.drop_duplicates(COL_CODIGO, keep="last")
+
+    def reemplazar(self, ruta_preparada, indice_barras=None, version_catalogo=None, conservar_conteos=False):
+        """Instala como catálogo un archivo Feather ya escrito.
+
+        El archivo debe estar en el mismo directorio para que el reemplazo sea
+        atómico; `indice_barras`, si se armó al escribirlo, se reutiliza. Con
+        `conservar_conteos` los conteos vigentes de los códigos que siguen en
+        el catálogo vuelven al diario y se aplican sobre el archivo nuevo; si
+        no, el diario se descarta. Con `version_catalogo` se rechaza con
+        ConflictoVersionInventario si otra carga terminó mientras tanto.
+        Retorna cuántos conteos se conservaron.
+        """
+        with LOCK, bloqueo_archivo(self.ruta), closing(conectar(self.ruta_db)) as con:
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                actual = int(leer_estado(con, "version_catalogo", 0))
+                if version_catalogo is not None and actual != version_catalogo:
+                    raise ConflictoVersionInventario("Otra carga de catálogo terminó mientras se procesaba el archivo")
+                contados = self._conteos_vigentes(con) if conservar_conteos else None
+                self._escribir(con, None, None, ruta_preparada)
+
+                conservados = 0
+                if contados is not None and not contados.empty:
+                    # Join vectorizado contra los códigos del catálogo nuevo
+                    codigos = feather.read_table(self.ruta, columns=[COL_CODIGO], memory_map=True)
+                    contados = contados[esta_en(contados[COL_CODIGO], codigos.column(0).to_pylist())]
+                    fecha_hora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    con.executemany(
+                        "INSERT INTO conteos (codigo, cantidad, fecha_hora) VALUES (?, ?, ?)",
+                        zip(
+                            contados[COL_CODIGO].tolist(),
+                            contados[COL_CANTIDAD_ACTUAL].astype(float).tolist(),
+                            [fecha_hora] * len(contados)
+                        )
+                    )
+                    conservados = len(contados)
+                escribir_estado(con, "version_catalogo", actual + 1)
+                con.commit()
+            except BaseException:
+                con.rollback()
+                raise
+            self._recargar()
+            if indice_barras is not None:
+                self._indice_barras = (self.version, indice_barras)
+            return conservados
+
+    def filas_fuera_de(self, codigos, columnas):
+        """Filas completas del catálogo actual cuyo `Codigo` no está en `codigos`.
+
+        Retorna un DataFrame con `columnas` (las que falten quedan vacías) o
+        None si no hay catálogo.
+        """
+        with LOCK, bloqueo_archivo(self.ruta, exclusivo=False):
+            if self._firma_archivo() is None:
+                return None
+            tabla = self._tabla()
+            valores = pa.array(list(codigos), tabla.schema.field(COL_CODIGO).type)
+            fuera = pc.invert(pc.is_in(tabla[COL_CODIGO], value_set=valores))
+            df = tabla.filter(fuera).to_pandas(types_mapper=TIPOS_ARROW.get)
+        for columna in columnas:
+            if columna not in df.columns:
+                df[columna] = ""
+        return df[columnas]
+
+    def registrar_conteo(self, idx, cantidad):
+        """Agrega el conteo de una fila al diario; no reescribe el archivo."""
+        with LOCK:
+            df = self.obtener()
+            if df is None:
+                return False
+            return self.registrar_conteo_por_codigo(df.at[idx, COL_CODIGO], cantidad)
+
+    def registrar_conteo_por_codigo(self, codigo, cantidad):
+        """Agrega al diario el conteo del producto con el `Codigo` (ID Alegra) dado."""
+        with LOCK:
+            if self.obtener() is None:
+                return False
+            with closing(conectar(self.ruta_db)) as con:
+                with con:
+                    con.execute(
+                        "INSERT INTO conteos (codigo, cantidad, fecha_hora) VALUES (?, ?, ?)",
+                        (str(codigo), float(cantidad), datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+                    )
+                self._aplicar_diario(con)
+            if self._seq - self._seq_compactado >= COMPACTAR_CADA:
+                self.compactar()
+            return True
+
+    @cronometrado("disco: compactar diario")
+    def compactar(self):
+        """Vuelca los conteos del diario al archivo y los elimina del diario."""
+        with LOCK, bloqueo_archivo(self.ruta), closing(conectar(self.ruta_db)) as con:
+            if self._firma_archivo() is None:
+                return
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                # Si otro proceso reescribió el archivo, partir de su versión y no de la nuestra
+                if self.df is None or int(leer_estado(con, "version_inventario", 0)) != self.version_disco:
+                    self._recargar()
+                self._aplicar_diario(con)
+                self._escribir(con, self._completo(), self.version_disco)
+                con.commit()
+            except BaseException:
+                con.rollback()
+                raise
+
+    def exportar_csv(self):
+        """Genera el CSV del inventario con los conteos al día (para descargar).
+
+        Incluye las columnas que no se cargan en memoria. Se genera una
+        sola vez por versión del catálogo y de los conteos.
+        """
+        with LOCK:
+            df = self.obtener()
+            if df is None:
+                return b""
+            version = (self.version, self.version_conteos)
+            if self._csv_exportado is None or self._csv_exportado[0] != version:
+                with bloqueo_archivo(self.ruta, exclusivo=False):
+                    if self._firma_archivo() != self._firma:
+                        self._recargar()
+                        version = (self.version, self.version_conteos)
+                    completo = self._completo()
+                self._csv_exportado = (version, completo.to_csv(sep=";", index=False).encode("utf-8"))
+            return self._csv_exportado[1]
+
+    def indice_barras(self):
+        """Retorna el índice de códigos de barras, construido una vez por versión."""
+        with LOCK:
+            df = self.obtener()
+            if df is None:
+                return None
+            if self._indice_barras is None or self._indice_barras[0] != self.version:
+                self._indice_barras = (self.version, IndiceBarras(df[COL_BARRAS]))
+            return self._indice_barras[1]
+
+    def indice_nombres(self):
+        """Retorna el índice de nombres, construido una vez por versión."""
+        with LOCK:
+            df = self.obtener()
+            if df is None or COL_NOMBRE not in df.columns:
+                return None
+            if self._indice_nombres is None or self._indice_nombres[0] != self.version:
+                self._indice_nombres = (self.version, IndiceNombres(df[COL_NOMBRE]))
+            return self._indice_nombres[1]
+
+    def filas_contadas(self):
+        """Máscara numpy de las filas con conteo, armada una vez por versión de conteos."""
+        with LOCK:
+            df = self.obtener()
+            if df is None:
+                return None
+            version = (self.version, self.version_conteos)
+            if self._filas_contadas is None or self._filas_contadas[0] != version:
+                self._filas_contadas = (version, df[COL_CANTIDAD_ACTUAL].notna().to_numpy())
+            return self._filas_contadas[1]
+
+    def invalidar(self):
+        """Fuerza a releer el archivo en la próxima consulta."""
+        with LOCK:
+            self.df = None
+            self._firma = None
+
+
+@st.cache_resource
+def obtener_almacen(ruta=ARCHIVO_INVENTARIO):
+    """Retorna el almacén de inventario único del proceso."""
+    return AlmacenInventario(ruta)
+
+
+# ========== FUNCIONES DE DATOS LOCALES ==========
+
+def _poner_conteos(completo, df):
+    """Copia a `completo` los conteos de `df` por `Codigo` (se ignoran los códigos que no estén)."""
+    contados = df.loc[df[COL_CANTIDAD_ACTUAL].notna(), [COL_CODIGO, COL_CANTIDAD_ACTUAL]]
+    if contados.empty:
+        return
+    ultimos = dict(zip(contados[COL_CODIGO].astype(str), contados[COL_CANTIDAD_ACTUAL].astype(float)))
+    codigos = completo[COL_CODIGO]
+    posiciones = np.flatnonzero(esta_en(codigos, ultimos))
+    cantidades = np.array([ultimos[c] for c in codigos.iloc[posiciones].tolist()], dtype=float)
+    completo[COL_CANTIDAD_ACTUAL] = completo[COL_CANTIDAD_ACTUAL].astype("Float64")
+    completo.iloc[posiciones, completo.columns.get_loc(COL_CANTIDAD_ACTUAL)] = cantidades
+
+
+def normalizar_inventario(df):
+    """Limpia códigos y deja `cantidad_actual` como float64 (vacío = sin contar).
+
+    Siempre float64, aunque el bloque traiga solo enteros: todos los bloques
+    de una importación comparten el esquema Arrow del primero.
+    """
+    df[COL_BARRAS] = df[COL_BARRAS].fillna("").astype(str).str.strip()
+    df[COL_CODIGO] = df[COL_CODIGO].fillna("").astype(str).str.strip()
+    if COL_CANTIDAD_ACTUAL in df.columns:
+        df[COL_CANTIDAD_ACTUAL] = pd.to_numeric(df[COL_CANTIDAD_ACTUAL], errors="coerce").astype("float64")
+    else:
+        df[COL_CANTIDAD_ACTUAL] = float("nan")
+    return df
+
+
+def reducir_inventario(df):
+    """Copia compacta del inventario para memoria: solo COLUMNAS_ESCANER y tipos livianos.
+
+    Códigos y nombres como texto Arrow, las columnas de desglose como category y
+    `cantidad_actual` como entero nullable (Float64 si hay decimales).
+    """
+    df = df[[c for c in df.columns if c in COLUMNAS_ESCANER]].copy()
+    for columna in (COL_CODIGO, COL_BARRAS, COL_NOMBRE):
+        if columna in df.columns:
+            df[columna] = df[columna].astype(TIPO_TEXTO)
+    for columna in COLUMNAS_DESGLOSE:
+        if columna in df.columns:
+            df[columna] = df[columna].astype("category")
+    cantidades = df[COL_CANTIDAD_ACTUAL]
+    enteras = (cantidades.dropna() % 1 == 0).all()
+    df[COL_CANTIDAD_ACTUAL] = cantidades.astype("Int64" if enteras else "Float64")
+    return df
+
+
+def preparar_para_disco(df):
+    """Deja todas las columnas como texto (salvo `cantidad_actual`, float64) para guardarlas en Feather.
+
+    Las celdas de Excel/CSV pueden mezclar números y texto en una columna;
+    como texto se guardan tal cual y se exportan igual que se importaron.
+    """
+    df = df.reset_index(drop=True)
+    df.columns = [str(c) for c in df.columns]
+    for columna in df.columns:
+        if columna != COL_CANTIDAD_ACTUAL:
+            df[columna] = df[columna].astype(TIPO_TEXTO)
+    if COL_CANTIDAD_ACTUAL in df.columns:
+        df[COL_CANTIDAD_ACTUAL] = df[COL_CANTIDAD_ACTUAL].to_numpy(dtype="float64", na_value=np.nan)
+    return df
+
+
+@cronometrado("cargar_datos")
+def cargar_datos():
+    """Retorna el inventario en memoria (compartido, no modificar directamente)"""
+    try:
+        return obtener_almacen().obtener()
+    except Exception as e:
+        st.error(f"Error al cargar el archivo: {e}")
+        return None
+
+
+@cronometrado("guardar_datos")
+def guardar_datos(df):
+    """Guarda en disco los conteos de `df` sin tocar las columnas que solo están en el archivo"""
+    obtener_almacen().guardar(df)
+
+
+@cronometrado("registrar_conteo")
+def registrar_conteo(idx, cantidad):
+    """Guarda la cantidad contada de un producto en el diario de conteos."""
+    return obtener_almacen().registrar_conteo(idx, cantidad)
+
+
+def registrar_conteo_por_codigo(codigo, cantidad):
+    """Guarda la cantidad contada del producto con el ID Alegra dado."""
+    return obtener_almacen().registrar_conteo_por_codigo(codigo, cantidad)
+
+
+def progreso_conteo():
+    """Avance del conteo (ProgresoConteo) o None si no hay inventario."""
+    almacen = obtener_almacen()
+    with LOCK:
+        return almacen.progreso if almacen.obtener() is not None else None
+
+
+@cronometrado("exportar_inventario_csv")
+def exportar_inventario_csv():
+    """Retorna el CSV del inventario con los conteos al día."""
+    return obtener_almacen().exportar_csv()
+
+
+def buscar_filas_por_barras(df, codigo_barras):
+    """Retorna los índices de todas las filas con el código de barras."""
+    almacen = obtener_almacen()
+    indice = almacen.indice_barras() if df is almacen.df else None
+    if indice is None or df is not almacen.df:
+        # DataFrame ajeno al almacén (o recargado entre tanto): índice ad hoc
+        indice = IndiceBarras(df[COL_BARRAS])
+    return indice.buscar(codigo_barras)
+
+
+def reporte_colisiones_barras():
+    """Retorna un DataFrame con los códigos de barras repetidos entre productos."""
+    almacen = obtener_almacen()
+    indice = almacen.indice_barras()
+    if indice is None:
+        return pd.DataFrame()
+    df = almacen.df
+    filas = [
+        {
+            "codigo_barras": codigo,
+            "productos": ", ".join(df.loc[idxs, COL_CODIGO].astype(str)),
+            "cantidad": len(idxs)
+        }
+        for codigo, idxs in indice.colisiones.items()
+    ]
+    return pd.DataFrame(filas, columns=["codigo_barras", "productos", "cantidad"])
+
+
+@cronometrado("buscar_producto")
+def buscar_producto(df, termino_busqueda, tipo_busqueda="codigo_barras"):
+    """Busca un producto por código de barras, por ID Alegra (`codigo`) o por nombre"""
+    termino = str(termino_busqueda).strip()
+
+    if tipo_busqueda == "codigo_barras":
+        filas = buscar_filas_por_barras(df, termino)
+        if filas:
+            return filas[0], df.loc[filas[0]]
+    elif tipo_busqueda == "codigo":
+        posiciones = np.flatnonzero(esta_en(df[COL_CODIGO], [termino]))
+        if len(posiciones):
+            idx = df.index[posiciones[0]]
+            return idx, df.loc[idx]
+    else:  # buscar por nombre - no retorna nada, usa buscar_productos_por_nombre
+        pass
+
+    return None, None
+
+
+@cronometrado("buscar_productos_por_nombre")
+def buscar_productos_por_nombre(df, termino_busqueda, limite=10):
+    """Busca productos por nombre (prefijo, subcadena o con errores de tipeo), los mejores primero.
+
+    Sin `limite` retorna todas las coincidencias.
+    """
+    termino = str(termino_busqueda).strip()
+    if not termino or len(termino) < 2 or COL_NOMBRE not in df.columns:
+        return df.iloc[:0]
+
+    almacen = obtener_almacen()
+    indice = almacen.indice_nombres() if df is almacen.df else None
+    if indice is None or df is not almacen.df:
+        indice = IndiceNombres(df[COL_NOMBRE])
+    return df.loc[indice.buscar(termino, limite)]
+
+
+# Filtros de estado de la tabla de productos
+ESTADO_TODOS = "Todos"
+ESTADO_CONTADOS = "Contados"
+ESTADO_SIN_CONTAR = "Sin contar"
+
+
+@cronometrado("pagina_productos")
+def pagina_productos(estado=ESTADO_TODOS, termino="", pagina=0, por_pagina=50, columnas=None):
+    """Una página de la tabla de productos filtrada por estado y nombre.
+
+    Los filtros trabajan sobre posiciones (índice de nombres y máscara de
+    contadas del almacén) y solo se copian las filas de la página pedida.
+    Retorna (DataFrame de la página, total de filas filtradas).
+    """
+    almacen = obtener_almacen()
+    with LOCK:
+        df = almacen.obtener()
+        if df is None:
+            return None, 0
+        termino = str(termino).strip()
+        if len(termino) >= 2 and COL_NOMBRE in df.columns:
+            # Las etiquetas del índice de nombres son posiciones (RangeIndex)
+            posiciones = np.asarray(almacen.indice_nombres().buscar(termino), dtype=np.int64)
+        else:
+            posiciones = None
+
+        if estado != ESTADO_TODOS:
+            contadas = almacen.filas_contadas()
+            if estado == ESTADO_SIN_CONTAR:
+                contadas = ~contadas
+            posiciones = np.flatnonzero(contadas) if posiciones is None else posiciones[contadas[posiciones]]
+
+        total = len(df) if posiciones is None else len(posiciones)
+        inicio = pagina * por_pagina
+        if posiciones is None:
+            filas = df.iloc[inicio:inicio + por_pagina]
+        else:
+            filas = df.iloc[posiciones[inicio:inicio + por_pagina]]
+        if columnas is not None:
+            filas = filas[[c for c in columnas if c in filas.columns]]
+        return filas.copy(), total
+
+
+# ========== IMPORTACIÓN ==========
+
+# Filas por bloque al importar: acota la memoria con archivos de proveedores grandes
+FILAS_POR_BLOQUE = 20000
+
+# Bytes del comienzo del CSV que se miran para elegir separador y codificación
+BYTES_MUESTRA = 64 * 1024
+
+# Resultado de una importación: filas del archivo, cambios frente al catálogo
+# anterior (al combinar) y problemas encontrados en el archivo
+ResumenImportacion = namedtuple(
+    "ResumenImportacion",
+    ["filas", "nuevos", "conservados", "conteos_conservados", "sin_codigo", "sin_barras", "codigos_repetidos"]
+)
+
+
+def _formato_csv(archivo):
+    """Separador y codificación del CSV según los primeros BYTES_MUESTRA bytes."""
+    muestra = archivo.read(BYTES_MUESTRA)
+    archivo.seek(0)
+    try:
+        texto = muestra.decode("utf-8-sig")
+        codificacion = "utf-8-sig"
+    except UnicodeDecodeError as e:
+        if e.start >= len(muestra) - 3:
+            # Solo quedó cortado un carácter al final de la muestra
+            texto = muestra[:e.start].decode("utf-8-sig")
+            codificacion = "utf-8-sig"
+        else:
+            texto = muestra.decode("latin-1")
+            codificacion = "latin-1"
+    primera_linea = texto.split("\n", 1)[0]
+    separador = ";" if ";" in primera_linea else ","
+    return separador, codificacion
+
+
+def _tamano_archivo(archivo):
+    tamano = getattr(archivo, "size", None)
+    if tamano is None:
+        tamano = archivo.seek(0, os.SEEK_END)
+        archivo.seek(0)
+    return tamano or 1
+
+
+def _bloques_csv(archivo):
+    """Recorre el CSV por bloques de texto; entrega (bloque, fracción leída)."""
+    separador, codificacion = _formato_csv(archivo)
+    tamano = _tamano_archivo(archivo)
+    with pd.read_csv(
+        archivo, sep=separador, dtype=str, keep_default_na=False,
+        encoding=codificacion, chunksize=FILAS_POR_BLOQUE
+    ) as lector:
+        for bloque in lector:
+            yield bloque, min(archivo.tell() / tamano, 1.0)
+
+
+def _texto_celda(valor):
+    if valor is None:
+        return ""
+    if isinstance(valor, float) and valor.is_integer():
+        # Excel guarda los códigos numéricos como float
+        return str(int(valor))
+    return str(valor)
+
+
+def _bloques_excel(archivo):
+    """Recorre la primera hoja en modo read-only de openpyxl; entrega (bloque, fracción leída)."""
+    from openpyxl import load_workbook
+
+    libro = load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        hoja = libro.worksheets[0]
+        total = hoja.max_row or 0
+        filas = hoja.iter_rows(values_only=True)
+        encabezado = next(filas, None)
+        if encabezado is None:
+            return
+        columnas = [_texto_celda(c) or f"Unnamed: {i}" for i, c in enumerate(encabezado)]
+        bloque = []
+        leidas = 1
+        for fila in filas:
+            leidas += 1
+            valores = [_texto_celda(c) for c in fila[:len(columnas)]]
+            bloque.append(valores + [""] * (len(columnas) - len(valores)))
+            if len(bloque) == FILAS_POR_BLOQUE:
+                yield pd.DataFrame(bloque, columns=columnas), min(leidas / total, 1.0) if total else 0.0
+                bloque = []
+        if bloque:
+            yield pd.DataFrame(bloque, columns=columnas), 1.0
+    finally:
+        libro.close()
+
+
+@cronometrado("importar_archivo")
+def importar_archivo(archivo, progreso=None, combinar=True):
+    """Importa un CSV o XLSX como catálogo sin cargarlo entero en memoria.
+
+    Lee por bloques de FILAS_POR_BLOQUE filas, valida las columnas
+    requeridas con el primer bloque y descarta las filas sin `Codigo`. Cada
+    bloque se escribe como lote de Arrow a un archivo temporal y se agrega al
+    índice de códigos de barras; al final el archivo reemplaza al catálogo.
+
+    Con `combinar` el archivo actualiza el catálogo por `Codigo`: agrega los
+    productos nuevos, toma nombres y códigos de barras del archivo, conserva
+    los productos que no vienen en él y mantiene los conteos ya hechos. Sin
+    `combinar` el catálogo y sus conteos se reemplazan.
+
+    `progreso(fraccion, filas)` se llama por bloque. Lanza ValueError si
+    faltan columnas o el archivo no tiene filas.
+    """
+    if archivo.name.lower().endswith(".csv"):
+        bloques = _bloques_csv(archivo)
+    else:
+        bloques = _bloques_excel(archivo)
+
+    directorio = os.path.dirname(os.path.abspath(ARCHIVO_INVENTARIO))
+    fd, temporal = tempfile.mkstemp(dir=directorio, prefix=".importando_", suffix=".feather")
+    os.close(fd)
+    almacen = obtener_almacen()
+    version_catalogo = almacen.version_catalogo()
+    anterior = cargar_datos() if combinar else None
+    # Index de códigos únicos: guarda su tabla hash entre bloques
+    codigos_anteriores = pd.Index(anterior[COL_CODIGO].unique() if anterior is not None else [], dtype=TIPO_TEXTO)
+
+    indice = IndiceBarras()
+    vistos = set()
+    filas = nuevos = conservados = sin_codigo = sin_barras = repetidos = 0
+    escritor = None
+    esquema = None
+    try:
+        for bloque, fraccion in bloques:
+            if escritor is None:
+                faltantes = [c for c in (COL_CODIGO, COL_BARRAS) if c not in bloque.columns]
+                if faltantes:
+                    raise ValueError(f"Faltan columnas requeridas: {faltantes}")
+
+            bloque = normalizar_inventario(bloque)
+            vacias = bloque[COL_CODIGO] == ""
+            sin_codigo += int(vacias.sum())
+            bloque = bloque[~vacias]
+            bloque.index = pd.RangeIndex(filas, filas + len(bloque))
+            sin_barras += int((bloque[COL_BARRAS] == "").sum())
+            nuevos += int((codigos_anteriores.get_indexer(bloque[COL_CODIGO]) < 0).sum())
+            for codigo in bloque[COL_CODIGO].tolist():
+                if codigo in vistos:
+                    repetidos += 1
+                vistos.add(codigo)
+            indice.agregar(bloque[COL_BARRAS])
+
+            tabla = pa.Table.from_pandas(preparar_para_disco(bloque), schema=esquema, preserve_index=False)
+            if escritor is None:
+                esquema = tabla.schema
+                escritor = pa.ipc.new_file(temporal, esquema)
+            escritor.write_table(tabla)
+            filas += len(bloque)
+            if progreso:
+                progreso(fraccion, filas)
+
+        if escritor is None or filas == 0:
+            raise ValueError("El archivo no tiene productos")
+
+        if anterior is not None:
+            # Productos del catálogo actual que el archivo no trae: se conservan al final
+            faltantes = almacen.filas_fuera_de(vistos, esquema.names)
+            if faltantes is not None and len(faltantes):
+                faltantes.index = pd.RangeIndex(filas, filas + len(faltantes))
+                indice.agregar(faltantes[COL_BARRAS].fillna(""))
+                escritor.write_table(
+                    pa.Table.from_pandas(preparar_para_disco(faltantes), schema=esquema, preserve_index=False)
+                )
+                conservados = len(faltantes)
+        escritor.close()
+        escritor = None
+        with open(temporal, "rb+") as f:
+            os.fsync(f.fileno())
+        conteos_conservados = almacen.reemplazar(
+            temporal, indice, version_catalogo=version_catalogo, conservar_conteos=combinar
+        )
+    finally:
+        if escritor is not None:
+            escritor.close()
+        if os.path.exists(temporal):
+            os.remove(temporal)
+
+    return ResumenImportacion(
+        filas, nuevos, conservados, conteos_conservados, sin_codigo, sin_barras, repetidos
+    )
+
+
+def procesar_archivo_subido(archivo, progreso=None, combinar=True):
+    """Importa el archivo subido; retorna el ResumenImportacion o None si falló."""
+    try:
+        return importar_archivo(archivo, progreso, combinar)
+    except Exception as e:
+        st.error(f"Error al procesar el archivo: {e}")
+        return None
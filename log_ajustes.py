@@ -0,0 +1,239 @@
+import os
+import csv
+import glob
+import threading
+from contextlib import closing
+from datetime import datetime, timedelta
+import pandas as pd
+from archivos import bloqueo_archivo
+from base_datos import conectar, leer_estado, escribir_estado
+from metricas import cronometrado
+
+
+# ========== CONFIGURACIÓN ==========
+
+# Log anterior en un solo archivo; se sigue leyendo como historial
+ARCHIVO_LOG = "log_ajustes.csv"
+
+# Un archivo por día: logs/log_ajustes_AAAA-MM-DD.csv
+DIR_LOG = "logs"
+PREFIJO_LOG = "log_ajustes_"
+
+# Filas por página del historial
+LIMITE_HISTORIAL = 50
+
+COLUMNAS_LOG = [
+    "fecha_hora", "codigo_barras", "id_alegra", "nombre", "precio",
+    "cantidad_anterior", "cantidad_nueva", "diferencia", "tipo_ajuste"
+]
+
+# Último CSV exportado y la firma (ruta, tamaño) de los archivos con que se armó
+_log_exportado = (None, b"")
+
+# Serializa los hilos del proceso que escriben o exportan el log; es propio del
+# log para que un fsync del CSV no frene los conteos que esperan inventario.LOCK
+LOCK_LOG = threading.Lock()
+
+
+# ========== ESCRITURA ==========
+
+def ruta_log_del_dia(dia=None):
+    """Retorna la ruta del archivo de log del día (hoy por defecto)."""
+    dia = dia or datetime.now().date()
+    return os.path.join(DIR_LOG, f"{PREFIJO_LOG}{dia.isoformat()}.csv")
+
+
+@cronometrado("guardar_log_ajuste")
+def guardar_log_ajuste(codigo_barras, item_id, nombre, precio, cantidad_anterior, cantidad_nueva, diferencia, tipo_ajuste):
+    """Agrega un registro al log de ajustes del día sin reescribir el archivo."""
+    log_entry = {
+        "fecha_hora": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "codigo_barras": codigo_barras,
+        "id_alegra": item_id,
+        "nombre": nombre,
+        "precio": precio,
+        "cantidad_anterior": cantidad_anterior,
+        "cantidad_nueva": cantidad_nueva,
+        "diferencia": diferencia,
+        "tipo_ajuste": tipo_ajuste
+    }
+
+    ruta = ruta_log_del_dia()
+    os.makedirs(DIR_LOG, exist_ok=True)
+    # El bloqueo de archivo evita que dos procesos escriban el encabezado o intercalen filas
+    with LOCK_LOG, bloqueo_archivo(ruta), closing(conectar()) as con:
+        # Antes de escribir, para que el volcado inicial no indexe esta fila dos veces
+        _asegurar_historial(con)
+        with open(ruta, "a", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNAS_LOG)
+            if f.tell() == 0:
+                writer.writeheader()
+            writer.writerow(log_entry)
+            f.flush()
+            os.fsync(f.fileno())
+        with con:
+            _indexar(con, [{clave: "" if valor is None else str(valor) for clave, valor in log_entry.items()}])
+
+
+# ========== HISTORIAL INDEXADO ==========
+
+def listar_archivos_log():
+    """Archivos de log del más antiguo al más reciente (el log anterior primero)."""
+    archivos = sorted(glob.glob(os.path.join(DIR_LOG, f"{PREFIJO_LOG}*.csv")))
+    if os.path.exists(ARCHIVO_LOG):
+        archivos.insert(0, ARCHIVO_LOG)
+    return archivos
+
+
+def _valor(texto, tipo=str):
+    """Celda del CSV convertida, o None si viene vacía o no se puede convertir."""
+    if texto is None or texto == "":
+        return None
+    try:
+        return tipo(texto)
+    except ValueError:
+        return None
+
+
+def _fila_log(entrada):
+    return (
+        entrada["fecha_hora"], _valor(entrada.get("codigo_barras")), _valor(entrada.get("id_alegra")),
+        _valor(entrada.get("nombre")), _valor(entrada.get("precio"), float),
+        _valor(entrada.get("cantidad_anterior"), float), _valor(entrada.get("cantidad_nueva"), float),
+        _valor(entrada.get("diferencia"), float), _valor(entrada.get("tipo_ajuste"))
+    )
+
+
+def _indexar(con, entradas):
+    """Agrega entradas al historial indexado y a los totales por día (transacción abierta)."""
+    filas = [_fila_log(entrada) for entrada in entradas if entrada.get("fecha_hora")]
+    con.executemany(
+        f"INSERT INTO log_ajustes ({', '.join(COLUMNAS_LOG)}) VALUES ({', '.join('?' * len(COLUMNAS_LOG))})",
+        filas
+    )
+    con.executemany(
+        """INSERT INTO ajustes_por_dia (dia, ajustes, entradas, salidas, diferencia_neta)
+        VALUES (?, 1, ?, ?, ?)
+        ON CONFLICT(dia) DO UPDATE SET
+            ajustes = ajustes + 1,
+            entradas = entradas + excluded.entradas,
+            salidas = salidas + excluded.salidas,
+            diferencia_neta = diferencia_neta + excluded.diferencia_neta""",
+        [
+            (fila[0][:10], int(fila[8] == "in"), int(fila[8] == "out"), fila[7] or 0)
+            for fila in filas
+        ]
+    )
+
+
+def _asegurar_historial(con):
+    """Vuelca una sola vez los CSV existentes al historial indexado.
+
+    Desde entonces cada ajuste se indexa al registrarse. La marca se revisa
+    dentro de la transacción para que dos procesos no lo hagan a la vez.
+    """
+    if leer_estado(con, "log_indexado"):
+        return
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        if not leer_estado(con, "log_indexado"):
+            for ruta in listar_archivos_log():
+                with open(ruta, newline="", encoding="utf-8") as f:
+                    _indexar(con, csv.DictReader(f))
+            escribir_estado(con, "log_indexado", 1)
+        con.commit()
+    except BaseException:
+        con.rollback()
+        raise
+
+
+def _filtro_log(desde=None, hasta=None, item=None):
+    """Cláusula WHERE y parámetros para un rango de días (inclusive) y un item."""
+    condiciones, parametros = [], []
+    if desde:
+        condiciones.append("fecha_hora >= ?")
+        parametros.append(desde.isoformat())
+    if hasta:
+        condiciones.append("fecha_hora < ?")
+        parametros.append((hasta + timedelta(days=1)).isoformat())
+    if item:
+        condiciones.append("(id_alegra = ? OR codigo_barras = ?)")
+        parametros += [str(item), str(item)]
+    return (" WHERE " + " AND ".join(condiciones)) if condiciones else "", parametros
+
+
+@cronometrado("pagina_log")
+def pagina_log(pagina=0, por_pagina=LIMITE_HISTORIAL, desde=None, hasta=None, item=None):
+    """Una página del historial, los más recientes primero.
+
+    `desde`/`hasta` son fechas (inclusive) e `item` un ID Alegra o código de
+    barras. Retorna (DataFrame de la página, total de ajustes filtrados).
+    """
+    donde, parametros = _filtro_log(desde, hasta, item)
+    with closing(conectar()) as con:
+        _asegurar_historial(con)
+        filas = con.execute(
+            f"SELECT {', '.join(COLUMNAS_LOG)} FROM log_ajustes{donde} "
+            "ORDER BY fecha_hora DESC, id DESC LIMIT ? OFFSET ?",
+            parametros + [por_pagina, pagina * por_pagina]
+        ).fetchall()
+        if item:
+            total = con.execute(f"SELECT COUNT(*) FROM log_ajustes{donde}", parametros).fetchone()[0]
+        else:
+            # Sin item el total sale de los totales por día, sin recorrer el historial
+            total = _sumar_dias(con, desde, hasta)
+    return pd.DataFrame([tuple(fila) for fila in filas], columns=COLUMNAS_LOG), total
+
+
+def _sumar_dias(con, desde=None, hasta=None):
+    consulta = "SELECT COALESCE(SUM(ajustes), 0) FROM ajustes_por_dia WHERE dia >= ? AND dia <= ?"
+    return con.execute(
+        consulta, (desde.isoformat() if desde else "", hasta.isoformat() if hasta else "9999-12-31")
+    ).fetchone()[0]
+
+
+def contar_ajustes(desde=None, hasta=None):
+    """Ajustes registrados entre dos fechas (inclusive); sin fechas, todos."""
+    with closing(conectar()) as con:
+        _asegurar_historial(con)
+        return _sumar_dias(con, desde, hasta)
+
+
+def ajustes_por_dia(desde=None, hasta=None):
+    """Totales por día (ajustes, entradas, salidas, diferencia neta), el más reciente primero."""
+    with closing(conectar()) as con:
+        _asegurar_historial(con)
+        filas = con.execute(
+            "SELECT dia, ajustes, entradas, salidas, diferencia_neta FROM ajustes_por_dia "
+            "WHERE dia >= ? AND dia <= ? ORDER BY dia DESC",
+            (desde.isoformat() if desde else "", hasta.isoformat() if hasta else "9999-12-31")
+        ).fetchall()
+    return pd.DataFrame(
+        [tuple(fila) for fila in filas], columns=["dia", "ajustes", "entradas", "salidas", "diferencia_neta"]
+    )
+
+
+# ========== EXPORTACIÓN ==========
+
+@cronometrado("exportar_log_csv")
+def exportar_log_csv():
+    """Une los archivos de log en un solo CSV copiando las líneas, sin pandas.
+
+    Se reutiliza el resultado anterior mientras ningún archivo cambie de tamaño.
+    """
+    global _log_exportado
+    with LOCK_LOG:
+        archivos = listar_archivos_log()
+        firma = tuple((ruta, os.path.getsize(ruta)) for ruta in archivos)
+        if _log_exportado[0] == firma:
+            return _log_exportado[1]
+
+        partes = []
+        for i, ruta in enumerate(archivos):
+            with open(ruta, "rb") as f:
+                encabezado = f.readline()
+                if i == 0:
+                    partes.append(encabezado)
+                partes.append(f.read())
+        _log_exportado = (firma, b"".join(partes))
+        return _log_exportado[1]
@@ -0,0 +1,99 @@
+"""Mide el tiempo de importación de los módulos que carga app.py y lo compara con un presupuesto.
+
+Uso: python medir_arranque.py [--repeticiones N]
+
+Cada medición corre en un proceso nuevo con `python -X importtime`, se
+toma la más rápida y se listan las importaciones más lentas. Termina con
+código 1 si se pasa del presupuesto o si al arrancar se importa un módulo
+que solo deben cargar rutas puntuales (p. ej. openpyxl al subir un Excel).
+"""
+import os
+import re
+import ast
+import sys
+import argparse
+import subprocess
+
+
+# ========== CONFIGURACIÓN ==========
+
+DIR_APP = os.path.dirname(os.path.abspath(__file__))
+ARCHIVO_APP = os.path.join(DIR_APP, "app.py")
+
+# Milisegundos de importación permitidos, con streamlit y pandas incluidos
+PRESUPUESTO_MS = 1500
+
+# Módulos que no deben importarse al arrancar
+IMPORTACIONES_DIFERIDAS = ("openpyxl",)
+
+# Línea de -X importtime: "import time: propio | acumulado | módulo"
+LINEA_IMPORTTIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$")
+
+
+# ========== MEDICIÓN ==========
+
+def modulos_de_app(ruta=ARCHIVO_APP):
+    """Módulos que app.py importa en el nivel superior, en orden."""
+    with open(ruta, encoding="utf-8") as f:
+        arbol = ast.parse(f.read())
+    modulos = []
+    for nodo in arbol.body:
+        if isinstance(nodo, ast.Import):
+            modulos += [alias.name for alias in nodo.names]
+        elif isinstance(nodo, ast.ImportFrom) and nodo.module:
+            modulos.append(nodo.module)
+    return list(dict.fromkeys(modulos))
+
+
+def medir_importacion(codigo):
+    """Corre `codigo` en un proceso nuevo; retorna {módulo de primer nivel: ms} y todos los importados."""
+    salida = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", codigo],
+        cwd=DIR_APP, capture_output=True, text=True, check=True
+    ).stderr
+    por_modulo = {}
+    importados = set()
+    for linea in salida.splitlines():
+        encontrado = LINEA_IMPORTTIME.match(linea)
+        if not encontrado:
+            continue
+        _, acumulado, sangria, nombre = encontrado.groups()
+        importados.add(nombre)
+        if not sangria:
+            por_modulo[nombre] = int(acumulado) / 1000
+    return por_modulo, importados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeticiones", type=int, default=3)
+    args = parser.parse_args()
+
+    # Lo que el intérprete importa antes de ejecutar cualquier código no cuenta
+    del_interprete, _ = medir_importacion("pass")
+    codigo = f"import {', '.join(modulos_de_app())}"
+    mediciones = []
+    for _ in range(args.repeticiones):
+        por_modulo, importados = medir_importacion(codigo)
+        por_modulo = {nombre: ms for nombre, ms in por_modulo.items() if nombre not in del_interprete}
+        mediciones.append((por_modulo, importados))
+    por_modulo, importados = min(mediciones, key=lambda m: sum(m[0].values()))
+    total = sum(por_modulo.values())
+
+    print(f"Importación de app.py: {total:.0f} ms (presupuesto {PRESUPUESTO_MS} ms)")
+    for nombre, ms in sorted(por_modulo.items(), key=lambda m: -m[1])[:10]:
+        print(f"  {ms:8.1f} ms  {nombre}")
+
+    errores = []
+    if total > PRESUPUESTO_MS:
+        errores.append(f"se pasa del presupuesto por {total - PRESUPUESTO_MS:.0f} ms")
+    for modulo in IMPORTACIONES_DIFERIDAS:
+        if any(nombre == modulo or nombre.startswith(modulo + ".") for nombre in importados):
+            errores.append(f"{modulo} se importa al arrancar")
+    for error in errores:
+        print(f"ERROR: {error}")
+    return 1 if errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
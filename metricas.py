@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from functools import wraps
+from contextlib import contextmanager
+
+
+# ========== CONFIGURACIÓN ==========
+
+# Límites superiores (ms) de los tramos del histograma de latencias; el último es abierto
+TRAMOS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Con LOG_METRICAS=1 cada tramo medido se escribe como una línea JSON en stderr
+LOG_METRICAS = os.getenv("LOG_METRICAS", "") not in ("", "0")
+
+logger = logging.getLogger("metricas")
+if LOG_METRICAS and not logger.handlers:
+    _salida = logging.StreamHandler()
+    _salida.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_salida)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+# ========== REGISTRO ==========
+
+class Histograma:
+    """Cantidad, errores y distribución por tramos de las duraciones de una operación."""
+
+    def __init__(self):
+        self.cantidad = 0
+        self.errores = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.tramos = [0] * (len(TRAMOS_MS) + 1)
+
+    def agregar(self, ms, ok=True):
+        self.cantidad += 1
+        self.errores += 0 if ok else 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.tramos[bisect.bisect_left(TRAMOS_MS, ms)] += 1
+
+    def percentil(self, fraccion):
+        """Límite superior del tramo donde cae el percentil (aproximado)."""
+        objetivo = fraccion * self.cantidad
+        acumulado = 0
+        for posicion, cantidad in enumerate(self.tramos):
+            acumulado += cantidad
+            if cantidad and acumulado >= objetivo:
+                return TRAMOS_MS[posicion] if posicion < len(TRAMOS_MS) else self.max_ms
+        return 0.0
+
+    def resumen(self):
+        return {
+            "n": self.cantidad,
+            "errores": self.errores,
+            "media_ms": round(self.total_ms / self.cantidad, 2) if self.cantidad else 0.0,
+            "p50_ms": self.percentil(0.50),
+            "p95_ms": self.percentil(0.95),
+            "max_ms": round(self.max_ms, 2),
+            "total_s": round(self.total_ms / 1000, 3),
+            "tramos": dict(zip([f"<={t}" for t in TRAMOS_MS] + [f">{TRAMOS_MS[-1]}"], self.tramos)),
+        }
+
+
+class Metricas:
+    """Métricas del proceso: latencias por operación y contadores (estados HTTP, reintentos).
+
+    Cada proceso lleva las suyas; se reinician al reiniciarlo.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self._lock:
+            self.latencias = {}
+            self.contadores = {}
+            self.desde = time.time()
+
+    def registrar(self, nombre, ms, ok=True):
+        with self._lock:
+            histograma = self.latencias.get(nombre)
+            if histograma is None:
+                histograma = self.latencias[nombre] = Histograma()
+            histograma.agregar(ms, ok)
+
+    def contar(self, nombre, cantidad=1):
+        with self._lock:
+            self.contadores[nombre] = self.contadores.get(nombre, 0) + cantidad
+
+    def resumen(self):
+        """Foto serializable a JSON de todas las métricas."""
+        with self._lock:
+            return {
+                "desde": self.desde,
+                "pid": os.getpid(),
+                "latencias": {nombre: h.resumen() for nombre, h in sorted(self.latencias.items())},
+                "contadores": dict(sorted(self.contadores.items())),
+            }
+
+
+# Únicas del proceso. Global de módulo y no st.cache_resource: se consultan en
+# cada tramo medido y la búsqueda en el caché costaría más que la medición
+_metricas = Metricas()
+
+
+def obtener_metricas():
+    """Retorna las métricas únicas del proceso."""
+    return _metricas
+
+
+# ========== MEDICIÓN ==========
+
+@contextmanager
+def medir(nombre, **campos):
+    """Mide el bloque como la operación `nombre`; un error lo cuenta como fallido y se propaga.
+
+    `campos` se agregan a la línea JSON del log (si LOG_METRICAS está activo).
+    """
+    inicio = time.perf_counter()
+    ok = True
+    try:
+        yield
+    except BaseException:
+        ok = False
+        raise
+    finally:
+        _registrar(nombre, (time.perf_counter() - inicio) * 1000, ok, campos)
+
+
+def _registrar(nombre, ms, ok, campos):
+    obtener_metricas().registrar(nombre, ms, ok)
+    if LOG_METRICAS:
+        logger.info(json.dumps(
+            {"ts": round(time.time(), 3), "tramo": nombre, "ms": round(ms, 3), "ok": ok, **campos},
+            ensure_ascii=False
+        ))
+
+
+def cronometrado(nombre):
+    """Decorador: mide cada llamada a la función como la operación `nombre`."""
+    def decorador(funcion):
+        @wraps(funcion)
+        def envuelta(*args, **kwargs):
+            with medir(nombre):
+                return funcion(*args, **kwargs)
+        return envuelta
+    return decorador
+
+
+def registrar_duracion(nombre, segundos):
+    """Registra una duración medida a mano (bloques que no caben en `medir`)."""
+    _registrar(nombre, segundos * 1000, True, {})
+
+
+def contar(nombre, cantidad=1):
+    """Suma `cantidad` al contador `nombre`."""
+    obtener_metricas().contar(nombre, cantidad)
+    if LOG_METRICAS:
+        logger.info(json.dumps({"ts": round(time.time(), 3), "contador": nombre, "suma": cantidad}))
+
+
+def resumen_metricas():
+    """Foto de las métricas del proceso (dict serializable a JSON)."""
+    return obtener_metricas().resumen()
+
+
+def reiniciar_metricas():
+    obtener_metricas().reiniciar()
@@ -0,0 +1,125 @@
+import sys
+import threading
+from collections import Counter
+import streamlit as st
+
+
+# ========== CONFIGURACIÓN ==========
+
+# Segundos entre muestras de la pila del hilo que ejecuta el script
+INTERVALO_MUESTREO = 0.005
+
+
+# ========== MUESTREO ==========
+
+def _etiqueta(marco):
+    return f"{marco.f_globals.get('__name__', '?')}:{marco.f_code.co_name}"
+
+
+class Muestreador(threading.Thread):
+    """Toma cada `intervalo` segundos la pila de llamadas del hilo `id_hilo`.
+
+    Las pilas se cuentan en formato "folded" (raíz;...;hoja), el que leen
+    speedscope y flamegraph.pl. Muestrea tiempo de reloj: también aparece
+    el tiempo esperando a Alegra o al disco. Termina solo si el hilo muestreado
+    deja de existir.
+    """
+
+    def __init__(self, id_hilo, intervalo=INTERVALO_MUESTREO):
+        super().__init__(name="perfilador", daemon=True)
+        self.id_hilo = id_hilo
+        self.intervalo = intervalo
+        self.muestras = Counter()
+        self._detener = threading.Event()
+
+    def run(self):
+        while not self._detener.wait(self.intervalo):
+            marco = sys._current_frames().get(self.id_hilo)
+            if marco is None:
+                # El hilo de la ejecución terminó (sesión cerrada o ejecución abortada)
+                break
+            pila = []
+            while marco is not None:
+                pila.append(_etiqueta(marco))
+                marco = marco.f_back
+            self.muestras[";".join(reversed(pila))] += 1
+
+    def detener(self):
+        self._detener.set()
+        self.join()
+        return self.muestras
+
+
+# ========== PERFIL DE LA SESIÓN ==========
+
+def iniciar_perfil(ejecuciones):
+    """Pide perfilar las próximas `ejecuciones` del script en esta sesión."""
+    descartar_perfil()
+    st.session_state.perfil = {
+        "restantes": ejecuciones, "ejecuciones": 0, "muestras": Counter(), "muestreador": None
+    }
+
+
+def _cerrar_muestreo(perfil):
+    if perfil["muestreador"] is not None:
+        perfil["muestras"].update(perfil["muestreador"].detener())
+        perfil["muestreador"] = None
+        perfil["ejecuciones"] += 1
+
+
+def al_iniciar_ejecucion():
+    """Llamar al comienzo del script: arranca el muestreo si quedan ejecuciones por perfilar."""
+    perfil = st.session_state.get("perfil")
+    if not perfil:
+        return
+    # Por si la ejecución anterior terminó sin pasar por al_terminar_ejecucion
+    _cerrar_muestreo(perfil)
+    if perfil["restantes"] > 0:
+        perfil["restantes"] -= 1
+        perfil["muestreador"] = Muestreador(threading.get_ident())
+        perfil["muestreador"].start()
+
+
+def al_terminar_ejecucion():
+    """Llamar al final del script: cierra el muestreo de esta ejecución."""
+    perfil = st.session_state.get("perfil")
+    if perfil:
+        _cerrar_muestreo(perfil)
+
+
+def estado_perfil():
+    """None sin perfil pedido; si no, (ejecuciones perfiladas, restantes, listo)."""
+    perfil = st.session_state.get("perfil")
+    if not perfil:
+        return None
+    listo = perfil["restantes"] == 0 and perfil["muestreador"] is None
+    return perfil["ejecuciones"], perfil["restantes"], listo
+
+
+def perfil_folded():
+    """Las pilas muestreadas en formato folded ("pila cantidad" por línea)."""
+    perfil = st.session_state.get("perfil") or {"muestras": Counter()}
+    lineas = [f"{pila} {cantidad}" for pila, cantidad in sorted(perfil["muestras"].items())]
+    return ("\n".join(lineas) + "\n").encode("utf-8")
+
+
+def funciones_mas_lentas(limite=15):
+    """Funciones con más muestras propias (hoja de la pila) y totales, las más costosas primero."""
+    perfil = st.session_state.get("perfil") or {"muestras": Counter()}
+    total = sum(perfil["muestras"].values()) or 1
+    propias, inclusivas = Counter(), Counter()
+    for pila, cantidad in perfil["muestras"].items():
+        marcos = pila.split(";")
+        propias[marcos[-1]] += cantidad
+        for marco in set(marcos):
+            inclusivas[marco] += cantidad
+    return [
+        {"funcion": funcion, "propio_pct": round(100 * n / total, 1), "total_pct": round(100 * inclusivas[funcion] / total, 1)}
+        for funcion, n in propias.most_common(limite)
+    ]
+
+
+def descartar_perfil():
+    perfil = st.session_state.pop("perfil", None)
+    if perfil and perfil["muestreador"] is not None:
+        perfil["muestreador"].detener()
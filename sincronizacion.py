@@ -0,0 +1,455 @@
+import os
+import time
+import uuid
+import socket
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import date, datetime
+from itertools import groupby
+import requests
+import streamlit as st
+from alegra import (
+    WAREHOUSE_ID, TAMANO_LOTE_AJUSTES, obtener_cliente_alegra, extraer_datos_item, item_ajuste,
+    enviar_ajustes_en_lotes, alegra_disponible, sondear_alegra
+)
+from base_datos import conectar
+from log_ajustes import guardar_log_ajuste
+from stock_alegra import guardar_stock, sumar_stock
+from metricas import cronometrado
+
+
+logger = logging.getLogger(__name__)
+
+
+# ========== CONFIGURACIÓN ==========
+
+# Cada cuántos segundos revisa la cola el hilo de sincronización
+INTERVALO_SINCRONIZACION = 5
+
+# Reintentos automáticos de un ajuste que no llegó a Alegra y espera máxima entre ellos
+MAX_INTENTOS = 8
+ESPERA_MAXIMA = 300
+
+# Cada proceso que envía ajustes deja un latido cada INTERVALO_LATIDO segundos; sin
+# latido por más de LATIDO_VENCIDO se da por muerto y sus ajustes 'enviando' quedan huérfanos
+INTERVALO_LATIDO = 10
+LATIDO_VENCIDO = 60
+
+# Consultas de stock a Alegra a la vez al reconciliar los conteos hechos sin conexión
+HILOS_RECONCILIACION = 4
+
+# Conteo hecho sin conexión: su diferencia se recalcula contra Alegra antes de enviarse
+ESTADO_RECONCILIAR = "reconciliar"
+ESTADO_PENDIENTE = "pendiente"
+ESTADO_ENVIANDO = "enviando"
+ESTADO_ENVIADO = "enviado"
+ESTADO_FALLIDO = "fallido"
+
+
+# Identifica a este proceso como dueño de los ajustes que toma para enviar
+DUENO = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _ahora():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+# ========== COLA DE AJUSTES (OUTBOX) ==========
+
+def encolar_ajuste(datos, bodega_id=WAREHOUSE_ID, fecha=None, reconciliar=False):
+    """Agrega a la cola un ajuste confirmado (mismas claves que `datos_ajuste`).
+
+    Si el item ya tenía un ajuste sin enviar se reemplaza: solo vale el
+    último conteo. Con `reconciliar` el conteo se hizo sin conexión contra
+    la última foto del stock (`base_actualizado`), o sin ninguna si
+    `cantidad_anterior` es None, y espera a que vuelva Alegra para
+    recalcular la diferencia.
+    """
+    fecha = (fecha or date.today()).isoformat()
+    with closing(conectar()) as con, con:
+        con.execute(
+            "DELETE FROM cola_ajustes WHERE item_id = ? AND bodega = ? AND estado IN (?, ?)",
+            (str(datos["item_id"]), str(bodega_id), ESTADO_PENDIENTE, ESTADO_RECONCILIAR)
+        )
+        con.execute(
+            """INSERT INTO cola_ajustes (
+                bodega, fecha, item_id, tipo, cantidad, costo, codigo_barras, nombre, precio,
+                cantidad_anterior, cantidad_contada, diferencia, estado, creado, base_actualizado
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (
+                # Sin diferencia (solo al reconciliar) el tipo lo define la reconciliación
+                str(bodega_id), fecha, str(datos["item_id"]), datos["tipo_ajuste"] or "in",
+                abs(float(datos["diferencia"])), float(datos["costo_unitario"] or 0),
+                datos["codigo_barras"], datos["nombre"], datos["precio"],
+                datos["cantidad_anterior"], datos["cantidad_contada"], datos["diferencia"],
+                ESTADO_RECONCILIAR if reconciliar else ESTADO_PENDIENTE, _ahora(),
+                datos.get("base_actualizado")
+            )
+        )
+
+
+def cancelar_pendiente(item_id, bodega_id=WAREHOUSE_ID):
+    """Descarta el ajuste sin enviar del item (un nuevo conteo coincidió con Alegra)."""
+    with closing(conectar()) as con, con:
+        return con.execute(
+            "DELETE FROM cola_ajustes WHERE item_id = ? AND bodega = ? AND estado IN (?, ?)",
+            (str(item_id), str(bodega_id), ESTADO_PENDIENTE, ESTADO_RECONCILIAR)
+        ).rowcount
+
+
+def ultimo_ajuste_item(item_id):
+    """Último ajuste en cola del item (dict) o None si nunca se encoló."""
+    with closing(conectar()) as con:
+        fila = con.execute(
+            "SELECT * FROM cola_ajustes WHERE item_id = ? ORDER BY id DESC LIMIT 1",
+            (str(item_id),)
+        ).fetchone()
+    return dict(fila) if fila else None
+
+
+def resumen_cola():
+    """Cantidad de ajustes por estado."""
+    with closing(conectar()) as con:
+        filas = con.execute("SELECT estado, COUNT(*) AS n FROM cola_ajustes GROUP BY estado").fetchall()
+    resumen = {ESTADO_RECONCILIAR: 0, ESTADO_PENDIENTE: 0, ESTADO_ENVIANDO: 0, ESTADO_ENVIADO: 0, ESTADO_FALLIDO: 0}
+    resumen.update({fila["estado"]: fila["n"] for fila in filas})
+    return resumen
+
+
+def listar_fallidos(limite=50):
+    """Ajustes que Alegra no aceptó, los más recientes primero."""
+    with closing(conectar()) as con:
+        return [dict(fila) for fila in con.execute(
+            "SELECT id, item_id, nombre, diferencia, error, creado FROM cola_ajustes "
+            "WHERE estado = ? ORDER BY id DESC LIMIT ?",
+            (ESTADO_FALLIDO, limite)
+        )]
+
+
+def reintentar_fallidos():
+    """Devuelve los ajustes fallidos a la cola. Retorna cuántos se reencolaron."""
+    with closing(conectar()) as con, con:
+        cantidad = con.execute(
+            "UPDATE cola_ajustes SET estado = ?, error = NULL, intentos = 0, proximo_intento = 0 "
+            "WHERE estado = ?",
+            (ESTADO_PENDIENTE, ESTADO_FALLIDO)
+        ).rowcount
+    despertar_trabajador()
+    return cantidad
+
+
+def liberar_interrumpidos():
+    """Marca como fallidos los ajustes 'enviando' cuyo proceso dueño ya no late.
+
+    Un envío lento de un proceso vivo no se toca, sin importar cuánto tarde.
+    No se reenvían solos: Alegra pudo haber creado el documento antes de
+    que el proceso muriera, así que se revisan y reintentan a mano.
+    """
+    with closing(conectar()) as con, con:
+        con.execute("DELETE FROM trabajadores WHERE latido < ?", (time.time() - LATIDO_VENCIDO,))
+        return con.execute(
+            "UPDATE cola_ajustes SET estado = ?, error = ? WHERE estado = ? "
+            "AND (dueno IS NULL OR dueno NOT IN (SELECT dueno FROM trabajadores))",
+            (ESTADO_FALLIDO, "Envío interrumpido: verificar en Alegra antes de reintentar", ESTADO_ENVIANDO)
+        ).rowcount
+
+
+def adelantar_pendientes():
+    """Quita la espera de los pendientes que aguardaban su reintento (volvió la conexión)."""
+    with closing(conectar()) as con, con:
+        return con.execute(
+            "UPDATE cola_ajustes SET proximo_intento = 0 WHERE estado = ?", (ESTADO_PENDIENTE,)
+        ).rowcount
+
+
+def _latir(con, dueno=DUENO):
+    con.execute(
+        "INSERT INTO trabajadores (dueno, latido) VALUES (?, ?) "
+        "ON CONFLICT (dueno) DO UPDATE SET latido = excluded.latido",
+        (dueno, time.time())
+    )
+
+
+def _tomar_pendientes(con, dueno=DUENO):
+    """Marca como 'enviando' (a nombre de `dueno`) los pendientes vencidos y los retorna.
+
+    Así otro proceso no los toma. El latido se escribe en la misma
+    transacción para que `liberar_interrumpidos` nunca vea los ajustes sin
+    su dueño vivo.
+    """
+    ahora = time.time()
+    con.execute("BEGIN IMMEDIATE")
+    _latir(con, dueno)
+    filas = [dict(fila) for fila in con.execute(
+        "SELECT * FROM cola_ajustes WHERE estado = ? AND proximo_intento <= ? ORDER BY bodega, fecha, id",
+        (ESTADO_PENDIENTE, ahora)
+    )]
+    con.executemany(
+        "UPDATE cola_ajustes SET estado = ?, dueno = ? WHERE id = ?",
+        [(ESTADO_ENVIANDO, dueno, fila["id"]) for fila in filas]
+    )
+    con.commit()
+    return filas
+
+
+def _soltar_tomados(filas, estado, error):
+    """Saca de 'enviando' los ajustes que este proceso tomó y no alcanzó a resolver."""
+    with closing(conectar()) as con, con:
+        con.executemany(
+            "UPDATE cola_ajustes SET estado = ?, error = ? WHERE id = ? AND estado = ? AND dueno = ?",
+            [(estado, error, f["id"], ESTADO_ENVIANDO, DUENO) for f in filas]
+        )
+
+
+def _registrar_en_log(fila):
+    """Escribe el ajuste en el log una vez Alegra lo aceptó."""
+    guardar_log_ajuste(
+        codigo_barras=fila["codigo_barras"],
+        item_id=fila["item_id"],
+        nombre=fila["nombre"],
+        precio=fila["precio"],
+        cantidad_anterior=fila["cantidad_anterior"],
+        cantidad_nueva=fila["cantidad_contada"],
+        diferencia=fila["diferencia"],
+        tipo_ajuste=fila["tipo"]
+    )
+
+
+@cronometrado("procesar_cola")
+def procesar_cola(tamano_lote=TAMANO_LOTE_AJUSTES):
+    """Envía los ajustes pendientes agrupados por bodega y fecha.
+
+    Cada grupo sale en documentos de hasta `tamano_lote` items. El log solo
+    se escribe (y la foto de stock se actualiza) para los items que Alegra
+    aceptó. Los que no llegaron a Alegra vuelven a la cola con espera
+    exponencial hasta MAX_INTENTOS (sin límite mientras Alegra esté caído);
+    el resto queda como fallido con el error. Con el circuito abierto no
+    toma nada. Retorna la lista de filas procesadas con su `estado` final.
+    """
+    if not alegra_disponible():
+        return []
+    iniciar_latido()
+    with closing(conectar()) as con:
+        filas = _tomar_pendientes(con)
+
+    grupos = [list(grupo) for _, grupo in groupby(filas, key=lambda f: (f["bodega"], f["fecha"]))]
+    procesadas = []
+    for n, grupo in enumerate(grupos):
+        try:
+            procesadas.extend(_enviar_grupo(grupo, tamano_lote))
+        except BaseException:
+            # Este grupo pudo llegar a Alegra en parte: se revisa a mano. Los siguientes
+            # no salieron y vuelven a la cola; los anteriores ya quedaron resueltos
+            _soltar_tomados(grupo, ESTADO_FALLIDO, "Envío interrumpido: verificar en Alegra antes de reintentar")
+            _soltar_tomados([f for siguiente in grupos[n + 1:] for f in siguiente], ESTADO_PENDIENTE, None)
+            raise
+    return procesadas
+
+
+def _enviar_grupo(grupo, tamano_lote):
+    """Envía un grupo de la misma bodega y fecha y guarda el estado final de cada fila.
+
+    El estado queda en la cola antes del log y la foto de stock: un error
+    en ellos ya no puede hacer reenviar un ajuste que Alegra aceptó.
+    """
+    bodega, fecha = grupo[0]["bodega"], grupo[0]["fecha"]
+    items = [item_ajuste(f["item_id"], f["tipo"], f["cantidad"], f["costo"]) for f in grupo]
+    resultados = enviar_ajustes_en_lotes(items, date.fromisoformat(fecha), bodega, tamano_lote)
+
+    for fila, resultado in zip(grupo, resultados):
+        fila["intentos"] += 1
+        if resultado.ok:
+            fila.update(estado=ESTADO_ENVIADO, documento=str(resultado.detalle), error=None)
+        elif resultado.reintentable and (fila["intentos"] < MAX_INTENTOS or not alegra_disponible()):
+            espera = min(2 ** fila["intentos"], ESPERA_MAXIMA)
+            fila.update(estado=ESTADO_PENDIENTE, error=resultado.detalle, proximo_intento=time.time() + espera)
+        else:
+            fila.update(estado=ESTADO_FALLIDO, documento=None, error=resultado.detalle)
+
+    with closing(conectar()) as con, con:
+        con.executemany(
+            "UPDATE cola_ajustes SET estado = ?, documento = ?, error = ?, enviado = ?, "
+            "intentos = ?, proximo_intento = ? WHERE id = ?",
+            [
+                (f["estado"], f["documento"], f["error"], _ahora(), f["intentos"], f["proximo_intento"], f["id"])
+                for f in grupo
+            ]
+        )
+
+    for fila in grupo:
+        if fila["estado"] != ESTADO_ENVIADO:
+            continue
+        try:
+            _registrar_en_log(fila)
+            sumar_stock(fila["item_id"], fila["diferencia"])
+        except Exception:
+            logger.exception("El ajuste %s quedó en Alegra pero no se pudo registrar en el log", fila["id"])
+    return grupo
+
+
+# ========== RECONCILIACIÓN DE CONTEOS SIN CONEXIÓN ==========
+
+def _consultar_item(item_id):
+    response = obtener_cliente_alegra().get(f"/items/{item_id}")
+    response.raise_for_status()
+    return response.json()
+
+
+@cronometrado("reconciliar_cola")
+def reconciliar_cola(hilos=HILOS_RECONCILIACION):
+    """Recalcula contra el stock actual de Alegra los conteos hechos sin conexión.
+
+    La diferencia pasa a ser la cantidad contada menos lo que Alegra informa
+    ahora (la consulta también refresca la foto local). Si da cero el conteo
+    ya coincide y se descarta; si no, queda pendiente de envío. Un item que
+    Alegra rechaza queda como fallido y, si la conexión se vuelve a perder,
+    el resto espera a la siguiente pasada. Cada fila se actualiza solo si
+    sigue por reconciliar: otro proceso o un conteo nuevo pudo tomarla.
+    Retorna cuántos quedaron pendientes, cuántos de ellos cambiaron de
+    diferencia, cuántos coincidieron y cuántos fallaron.
+    """
+    with closing(conectar()) as con:
+        filas = [dict(fila) for fila in con.execute(
+            "SELECT * FROM cola_ajustes WHERE estado = ? ORDER BY id", (ESTADO_RECONCILIAR,)
+        )]
+    resultado = {"pendientes": 0, "recalculados": 0, "sin_diferencia": 0, "fallidos": 0}
+    if not filas:
+        return resultado
+
+    with ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="reconciliacion") as ejecutor:
+        consultas = [(fila, ejecutor.submit(_consultar_item, fila["item_id"])) for fila in filas]
+
+    # Primero las consultas (y la foto local, que escribe en su propia conexión); después la cola
+    cambios = []
+    for fila, consulta in consultas:
+        try:
+            datos_item = consulta.result()
+        except requests.exceptions.HTTPError as e:
+            estado = e.response.status_code if e.response is not None else None
+            if estado is not None and estado < 500 and estado != 429:
+                cambios.append((
+                    "UPDATE cola_ajustes SET estado = ?, error = ? WHERE id = ? AND estado = ?",
+                    (ESTADO_FALLIDO, f"Al reconciliar: HTTP {estado}", fila["id"], ESTADO_RECONCILIAR)
+                ))
+                resultado["fallidos"] += 1
+            continue
+        except requests.exceptions.RequestException:
+            continue
+
+        guardar_stock(fila["item_id"], datos_item)
+        datos = extraer_datos_item(datos_item)
+        diferencia = fila["cantidad_contada"] - datos["cantidad_disponible"]
+        if diferencia == 0:
+            cambios.append((
+                "DELETE FROM cola_ajustes WHERE id = ? AND estado = ?", (fila["id"], ESTADO_RECONCILIAR)
+            ))
+            resultado["sin_diferencia"] += 1
+            continue
+
+        if fila["cantidad_anterior"] is not None and datos["cantidad_disponible"] != fila["cantidad_anterior"]:
+            logger.info(
+                "Item %s: el stock en Alegra pasó de %s a %s mientras no había conexión",
+                fila["item_id"], fila["cantidad_anterior"], datos["cantidad_disponible"]
+            )
+            resultado["recalculados"] += 1
+        cambios.append((
+            "UPDATE cola_ajustes SET estado = ?, tipo = ?, cantidad = ?, costo = ?, nombre = ?, precio = ?, "
+            "cantidad_anterior = ?, diferencia = ?, base_actualizado = ?, intentos = 0, proximo_intento = 0, "
+            "error = NULL WHERE id = ? AND estado = ?",
+            (
+                ESTADO_PENDIENTE, "in" if diferencia > 0 else "out", abs(diferencia), datos["costo_unitario"],
+                datos["nombre"], datos["precio"], datos["cantidad_disponible"], diferencia, time.time(),
+                fila["id"], ESTADO_RECONCILIAR
+            )
+        ))
+        resultado["pendientes"] += 1
+
+    with closing(conectar()) as con, con:
+        for sql, parametros in cambios:
+            con.execute(sql, parametros)
+    return resultado
+
+
+# ========== HILOS DEL PROCESO ==========
+
+class Latido(threading.Thread):
+    """Hilo que cada `intervalo` segundos anota que este proceso sigue vivo.
+
+    Va aparte del hilo de sincronización para que un envío largo a Alegra
+    no haga parecer muerto al proceso.
+    """
+
+    def __init__(self, dueno=DUENO, intervalo=INTERVALO_LATIDO):
+        super().__init__(name="latido-sincronizacion", daemon=True)
+        self.dueno = dueno
+        self.intervalo = intervalo
+
+    def run(self):
+        while True:
+            try:
+                with closing(conectar()) as con, con:
+                    _latir(con, self.dueno)
+            except Exception:
+                logger.exception("No se pudo registrar el latido del proceso")
+            time.sleep(self.intervalo)
+
+
+@st.cache_resource
+def iniciar_latido():
+    """Arranca el hilo de latido una sola vez por proceso."""
+    latido = Latido()
+    latido.start()
+    return latido
+
+
+class TrabajadorSincronizacion(threading.Thread):
+    """Hilo del proceso que vacía la cola de ajustes hacia Alegra.
+
+    Revisa la cola cada `intervalo` segundos o apenas se le despierta tras
+    encolar un ajuste. Varios procesos pueden correr su propio hilo: cada
+    ajuste lo toma uno solo al pasarlo a 'enviando'. Mientras Alegra está
+    caído solo sondea; al volver reconcilia los conteos hechos sin conexión
+    y envía de inmediato lo que esperaba reintento.
+    """
+
+    def __init__(self, intervalo=INTERVALO_SINCRONIZACION):
+        super().__init__(name="sincronizacion-alegra", daemon=True)
+        self.intervalo = intervalo
+        self.evento = threading.Event()
+        self.ultima_ejecucion = None
+        self.ultimo_error = None
+        self.sin_conexion = False
+
+    def run(self):
+        while True:
+            self.evento.wait(self.intervalo)
+            self.evento.clear()
+            try:
+                liberar_interrumpidos()
+                disponible = alegra_disponible() or sondear_alegra()
+                if disponible:
+                    if self.sin_conexion:
+                        adelantar_pendientes()
+                    reconciliar_cola()
+                    procesar_cola()
+                self.sin_conexion = not disponible
+                self.ultimo_error = None
+            except Exception as e:
+                logger.exception("Error al sincronizar la cola de ajustes")
+                self.ultimo_error = str(e)
+            self.ultima_ejecucion = time.time()
+
+
+@st.cache_resource
+def iniciar_trabajador():
+    """Arranca el hilo de sincronización una sola vez por proceso."""
+    trabajador = TrabajadorSincronizacion()
+    trabajador.start()
+    return trabajador
+
+
+def despertar_trabajador():
+    """Pide al hilo que revise la cola ya, sin esperar el intervalo."""
+    iniciar_trabajador().evento.set()
@@ -0,0 +1,128 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
+from alegra import LIMITE_PAGINA_ITEMS, obtener_cliente_alegra, extraer_datos_item, listar_items
+from base_datos import conectar
+
+
+# ========== CONFIGURACIÓN ==========
+
+# Páginas del listado de items que se piden a la vez al precargar
+HILOS_PRECARGA = 8
+
+# Segundos que una fila precargada se considera vigente (una jornada de conteo)
+VALIDEZ_PRECARGA = 8 * 3600
+
+
+# ========== FOTO LOCAL DEL STOCK ==========
+
+def _fila_stock(item_id, datos, actualizado):
+    return (
+        str(item_id), datos["nombre"], datos["cantidad_disponible"],
+        datos["costo_unitario"], datos["precio"], actualizado
+    )
+
+
+def _guardar_filas(con, filas):
+    con.executemany(
+        """INSERT INTO stock_alegra (codigo, nombre, cantidad_disponible, costo_unitario, precio, actualizado)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(codigo) DO UPDATE SET
+            nombre = excluded.nombre,
+            cantidad_disponible = excluded.cantidad_disponible,
+            costo_unitario = excluded.costo_unitario,
+            precio = excluded.precio,
+            actualizado = excluded.actualizado""",
+        filas
+    )
+
+
+def guardar_stock(item_id, item_data):
+    """Actualiza la foto del item con una respuesta de /items/{id}."""
+    datos = extraer_datos_item(item_data)
+    if datos:
+        with closing(conectar()) as con, con:
+            _guardar_filas(con, [_fila_stock(item_id, datos, time.time())])
+
+
+def sumar_stock(item_id, diferencia):
+    """Aplica a la foto un ajuste que Alegra ya aceptó, sin volver a consultarlo."""
+    with closing(conectar()) as con, con:
+        con.execute(
+            "UPDATE stock_alegra SET cantidad_disponible = cantidad_disponible + ?, actualizado = ? "
+            "WHERE codigo = ?",
+            (float(diferencia), time.time(), str(item_id))
+        )
+
+
+def leer_stock_precargado(item_id, max_antiguedad=VALIDEZ_PRECARGA):
+    """Datos del item como los da `extraer_datos_item` más `actualizado`, o None si no hay o venció.
+
+    Con `max_antiguedad=None` retorna la última foto por vieja que sea (modo sin conexión).
+    """
+    desde = 0 if max_antiguedad is None else time.time() - max_antiguedad
+    with closing(conectar()) as con:
+        fila = con.execute(
+            "SELECT nombre, cantidad_disponible, costo_unitario, precio, actualizado "
+            "FROM stock_alegra WHERE codigo = ? AND actualizado >= ?",
+            (str(item_id), desde)
+        ).fetchone()
+    return dict(fila) if fila else None
+
+
+def resumen_precarga():
+    """Cantidad de items en la foto y hora de la actualización más antigua."""
+    with closing(conectar()) as con:
+        fila = con.execute("SELECT COUNT(*) AS items, MIN(actualizado) AS desde FROM stock_alegra").fetchone()
+    return dict(fila)
+
+
+# ========== PRECARGA DESDE EL LISTADO ==========
+
+def precargar_stock(progreso=None, hilos=HILOS_PRECARGA, limite=LIMITE_PAGINA_ITEMS):
+    """Descarga el stock de todo el catálogo de Alegra a la foto local.
+
+    La primera página trae el total y el resto se pide en paralelo con a lo
+    sumo `hilos` peticiones a la vez. Si la API no informa el total se pagina
+    en orden hasta una página incompleta. `progreso(hechas, total)` se llama
+    por cada página. Retorna (items guardados, segundos). Lanza
+    RequestException si una página falla; lo ya guardado se conserva.
+    """
+    inicio_reloj = time.time()
+    cliente = obtener_cliente_alegra()
+
+    def guardar_pagina(items):
+        actualizado = time.time()
+        filas = []
+        for item in items:
+            datos = extraer_datos_item(item)
+            if datos and item.get("id") is not None:
+                filas.append(_fila_stock(item["id"], datos, actualizado))
+        with closing(conectar()) as con, con:
+            _guardar_filas(con, filas)
+        return len(filas)
+
+    items, total = listar_items(0, limite, con_total=True, cliente=cliente)
+    guardados = guardar_pagina(items)
+
+    if total is None:
+        inicio = limite
+        while len(items) == limite:
+            items = listar_items(inicio, limite, cliente=cliente)
+            guardados += guardar_pagina(items)
+            inicio += limite
+            if progreso:
+                progreso(inicio // limite, None)
+        return guardados, time.time() - inicio_reloj
+
+    inicios = range(limite, total, limite)
+    total_paginas = len(inicios) + 1
+    if progreso:
+        progreso(1, total_paginas)
+    with ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="precarga-alegra") as ejecutor:
+        futuros = [ejecutor.submit(listar_items, inicio, limite, cliente=cliente) for inicio in inicios]
+        for hechas, futuro in enumerate(as_completed(futuros), start=2):
+            guardados += guardar_pagina(futuro.result())
+            if progreso:
+                progreso(hechas, total_paginas)
+    return guardados, time.time() - inicio_reloj
@@ -0,0 +1,21 @@
+"""Catálogos de prueba armados en memoria, como los sube el operador."""
+import io
+from inventario import COL_CODIGO, COL_NOMBRE, COL_BARRAS, COL_CANTIDAD_ACTUAL
+
+
+def archivo_csv(filas, columnas=(COL_CODIGO, COL_NOMBRE, COL_BARRAS), nombre="catalogo.csv"):
+    """Archivo subido con `columnas` y `filas`, separado por ';'."""
+    texto = "\n".join(";".join(map(str, fila)) for fila in [columnas, *filas]) + "\n"
+    archivo = io.BytesIO(texto.encode("utf-8"))
+    archivo.name = nombre
+    return archivo
+
+
+def productos(*codigos):
+    """Filas (Codigo, Nombre, Codigo de barras) de los productos con esos códigos."""
+    return [(codigo, f"Producto {codigo}", f"770{codigo:0>5}") for codigo in codigos]
+
+
+def cantidad(df, codigo):
+    """`cantidad_actual` del producto con el `Codigo` dado."""
+    return df.loc[df[COL_CODIGO] == codigo, COL_CANTIDAD_ACTUAL].iloc[0]
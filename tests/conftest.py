@@ -0,0 +1,49 @@
+"""Pruebas sin conexión: cada prueba corre en un directorio vacío y Alegra es el stub local."""
+import os
+import sys
+import pytest
+
+DIR_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if DIR_REPO not in sys.path:
+    sys.path.insert(0, DIR_REPO)
+
+from benchmarks.stub_alegra import StubAlegra  # noqa: E402
+
+# El cliente de Alegra lee la URL al importarse: el stub tiene que estar antes
+STUB = StubAlegra().iniciar()
+os.environ["ALEGRA_API_URL"] = STUB.url
+
+import streamlit.logger  # noqa: E402
+streamlit.logger.set_log_level("error")
+
+from alegra import obtener_cliente_alegra  # noqa: E402
+from inventario import obtener_almacen  # noqa: E402
+import sincronizacion  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def directorio_vacio(tmp_path, monkeypatch):
+    """Catálogo, base local y logs en un directorio propio de la prueba."""
+    monkeypatch.chdir(tmp_path)
+    obtener_almacen.clear()
+    obtener_cliente_alegra.clear()
+    yield tmp_path
+    obtener_almacen.clear()
+    obtener_cliente_alegra.clear()
+
+
+@pytest.fixture(autouse=True)
+def sin_trabajador(monkeypatch):
+    """Las pruebas vacían la cola con procesar_cola: el hilo de fondo les ganaría los ajustes."""
+    trabajador = sincronizacion.TrabajadorSincronizacion()
+    monkeypatch.setattr(sincronizacion, "iniciar_trabajador", lambda: trabajador)
+
+
+@pytest.fixture
+def stub():
+    """El stub de Alegra con stock y contadores en cero."""
+    STUB.stock.clear()
+    STUB.invalidos.clear()
+    STUB.llamadas.clear()
+    STUB.latencia = 0.0
+    yield STUB
@@ -0,0 +1,111 @@
+import socket
+import pytest
+import requests
+import alegra
+from alegra import Circuito, ClienteAlegra, AlegraNoDisponible
+
+
+def test_circuito_se_abre_tras_fallos_seguidos():
+    circuito = Circuito(umbral=3, espera=30)
+    circuito.fallo()
+    circuito.fallo()
+    assert not circuito.abierto
+    circuito.fallo()
+    assert circuito.abierto
+    assert not circuito.permitir()
+
+
+def test_un_exito_reinicia_la_cuenta_de_fallos():
+    circuito = Circuito(umbral=3, espera=30)
+    for _ in range(2):
+        circuito.fallo()
+    circuito.exito()
+    for _ in range(2):
+        circuito.fallo()
+    assert not circuito.abierto
+
+
+def test_abierto_solo_deja_pasar_un_sondeo_por_espera():
+    circuito = Circuito(umbral=1, espera=30)
+    circuito.fallo()
+    assert not circuito.permitir(sondeo=True)
+
+    circuito.proximo_sondeo = 0
+    assert circuito.permitir(sondeo=True)
+    assert not circuito.permitir(sondeo=True)
+    assert not circuito.permitir()
+
+    circuito.exito()
+    assert not circuito.abierto
+    assert circuito.abierto_desde is None
+    assert circuito.permitir()
+
+
+@pytest.fixture
+def url_cerrada():
+    """URL de un puerto local donde nadie escucha: la conexión se rechaza al instante."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        puerto = s.getsockname()[1]
+    return f"http://127.0.0.1:{puerto}/api/v1"
+
+
+def test_cliente_deja_de_salir_a_la_red_con_el_circuito_abierto(url_cerrada, monkeypatch):
+    monkeypatch.setattr(alegra, "REINTENTOS", 0)
+    cliente = ClienteAlegra(url_cerrada, "clave")
+
+    for _ in range(alegra.UMBRAL_FALLOS):
+        with pytest.raises(requests.exceptions.ConnectionError) as error:
+            cliente.get("/items/1")
+        assert not isinstance(error.value, AlegraNoDisponible)
+
+    assert cliente.circuito.abierto
+    with pytest.raises(AlegraNoDisponible):
+        cliente.get("/items/1")
+
+
+def test_sondeo_cierra_el_circuito_cuando_alegra_responde(stub):
+    circuito = alegra.obtener_cliente_alegra().circuito
+    for _ in range(alegra.UMBRAL_FALLOS):
+        circuito.fallo()
+    assert not alegra.alegra_disponible()
+    assert alegra.alegra_caida_desde() is not None
+
+    # Todavía no toca sondear
+    assert not alegra.sondear_alegra()
+    circuito.proximo_sondeo = 0
+    assert alegra.sondear_alegra()
+    assert alegra.alegra_caida_desde() is None
+
+
+def test_ajuste_sin_conexion_es_reintentable():
+    circuito = alegra.obtener_cliente_alegra().circuito
+    for _ in range(alegra.UMBRAL_FALLOS):
+        circuito.fallo()
+    items = [alegra.item_ajuste(1, "in", 2, 1000), alegra.item_ajuste(2, "out", 1, 1000)]
+
+    resultados = alegra.enviar_ajustes_en_lotes(items)
+
+    assert [(r.ok, r.reintentable) for r in resultados] == [(False, True), (False, True)]
+
+
+
+def test_lote_rechazado_se_parte_para_aislar_los_items_invalidos(stub):
+    stub.invalidos = {"3", "6"}
+    items = [alegra.item_ajuste(i, "in", 1, 1000) for i in range(1, 9)]
+
+    resultados = alegra.enviar_ajustes_en_lotes(items, tamano_lote=8)
+
+    assert [r.ok for r in resultados] == [True, True, False, True, True, False, True, True]
+    assert all(not r.reintentable and "HTTP 400" in r.detalle for r in resultados if not r.ok)
+    assert stub.stock == {"1": 11, "2": 11, "4": 11, "5": 11, "7": 11, "8": 11}
+
+
+def test_lotes_de_tamano_maximo(stub):
+    items = [alegra.item_ajuste(i, "out", 2, 1000) for i in range(1, 6)]
+
+    resultados = alegra.enviar_ajustes_en_lotes(items, tamano_lote=2)
+
+    assert all(r.ok for r in resultados)
+    assert stub.llamadas["POST /inventory-adjustments"] == 3
+    assert len({r.detalle for r in resultados}) == 3
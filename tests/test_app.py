@@ -0,0 +1,83 @@
+import os
+import pytest
+from streamlit.testing.v1 import AppTest
+from conftest import DIR_REPO
+from catalogos import archivo_csv, productos, cantidad
+from inventario import importar_archivo, cargar_datos
+from alegra import UMBRAL_FALLOS, obtener_cliente_alegra
+from metricas import resumen_metricas, reiniciar_metricas
+from sincronizacion import ESTADO_RECONCILIAR, ultimo_ajuste_item, reconciliar_cola
+
+ARCHIVO_APP = os.path.join(DIR_REPO, "app.py")
+
+
+@pytest.fixture
+def app(stub):
+    importar_archivo(archivo_csv(productos(1, 2, 3, 4)))
+    at = AppTest.from_file(ARCHIVO_APP, default_timeout=30)
+    at.run()
+    assert not at.exception, at.exception
+    return at
+
+
+def test_ejecucion_cortada_por_st_stop_registra_su_duracion(stub):
+    reiniciar_metricas()
+    # Sin catálogo cargado el script termina en st.stop antes del footer
+    at = AppTest.from_file(ARCHIVO_APP, default_timeout=30)
+    at.run()
+
+    assert not at.exception, at.exception
+    assert resumen_metricas()["latencias"]["rerun"]["n"] == 1
+
+
+def contar(at, barras, cantidad_contada):
+    at.text_input(key="input_codigo").input(barras).run()
+    at.number_input(key="cantidad_contada").set_value(cantidad_contada).run()
+    at.button(key="btn_guardar").click().run()
+
+
+def test_confirmar_despues_de_una_carga_combinada(app):
+    contar(app, "77000003", 7)
+
+    # Otro operador sube un catálogo que reordena las filas antes de confirmar
+    importar_archivo(archivo_csv(productos(3, 4, 1, 2)))
+    app.button(key="btn_confirmar").click().run()
+
+    assert not app.exception, app.exception
+    df = cargar_datos()
+    assert cantidad(df, "3") == 7
+    assert df.loc[df["Codigo"] != "3", "cantidad_actual"].isna().all()
+
+
+def test_producto_elegido_por_nombre_sigue_despues_de_una_carga_combinada(app):
+    app.radio[0].set_value("🔤 Nombre").run()
+    app.text_input(key="input_nombre").input("producto 2").run()
+    next(b for b in app.button if b.key.startswith("btn_select_")).click().run()
+
+    importar_archivo(archivo_csv(productos(2, 1, 4, 3)))
+    # Igual al stock del stub: se guarda sin ajuste
+    app.number_input(key="cantidad_contada").set_value(10).run()
+    app.button(key="btn_guardar").click().run()
+
+    assert not app.exception, app.exception
+    df = cargar_datos()
+    assert df.loc[df["cantidad_actual"].notna(), "Codigo"].tolist() == ["2"]
+    assert cantidad(df, "2") == 10
+
+
+def test_sin_conexion_ni_foto_del_stock_se_cuenta_igual(app):
+    circuito = obtener_cliente_alegra().circuito
+    for _ in range(UMBRAL_FALLOS):
+        circuito.fallo()
+
+    contar(app, "77000004", 4)
+
+    assert not app.exception, app.exception
+    assert cantidad(cargar_datos(), "4") == 4
+    fila = ultimo_ajuste_item("4")
+    assert fila["estado"] == ESTADO_RECONCILIAR
+    assert fila["cantidad_anterior"] is None
+
+    circuito.exito()
+    assert reconciliar_cola()["pendientes"] == 1
+    assert ultimo_ajuste_item("4")["diferencia"] == -6
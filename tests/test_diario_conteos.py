@@ -0,0 +1,69 @@
+from contextlib import closing
+import inventario
+from base_datos import conectar, leer_estado
+from inventario import (
+    ARCHIVO_INVENTARIO, COL_CODIGO, COL_CANTIDAD_ACTUAL, AlmacenInventario,
+    obtener_almacen, importar_archivo, cargar_datos, registrar_conteo_por_codigo
+)
+from catalogos import archivo_csv, productos, cantidad
+
+
+def conteos_en_diario():
+    with closing(conectar()) as con:
+        return con.execute("SELECT COUNT(*) FROM conteos").fetchone()[0]
+
+
+def test_otro_proceso_ve_los_conteos_del_diario():
+    importar_archivo(archivo_csv(productos(1, 2, 3)))
+    otro = AlmacenInventario(ARCHIVO_INVENTARIO)
+    otro.obtener()
+
+    registrar_conteo_por_codigo("2", 5)
+    registrar_conteo_por_codigo("2", 6)
+
+    # Sin releer el archivo: solo aplica los conteos nuevos del diario
+    version = otro.version
+    df = otro.obtener()
+    assert otro.version == version
+    assert cantidad(df, "2") == 6
+    assert df[COL_CANTIDAD_ACTUAL].notna().sum() == 1
+
+
+def test_compactar_vuelca_el_diario_al_archivo():
+    importar_archivo(archivo_csv(productos(1, 2, 3)))
+    registrar_conteo_por_codigo("1", 4)
+    registrar_conteo_por_codigo("3", 2.5)
+
+    obtener_almacen().compactar()
+
+    assert conteos_en_diario() == 0
+    df = AlmacenInventario(ARCHIVO_INVENTARIO).obtener()
+    assert (cantidad(df, "1"), cantidad(df, "3")) == (4, 2.5)
+
+    registrar_conteo_por_codigo("3", 1)
+    assert cantidad(AlmacenInventario(ARCHIVO_INVENTARIO).obtener(), "3") == 1
+
+
+def test_compacta_solo_cada_compactar_cada_conteos(monkeypatch):
+    monkeypatch.setattr(inventario, "COMPACTAR_CADA", 3)
+    importar_archivo(archivo_csv(productos(1, 2, 3, 4)))
+
+    registrar_conteo_por_codigo("1", 1)
+    registrar_conteo_por_codigo("2", 2)
+    assert conteos_en_diario() == 2
+    registrar_conteo_por_codigo("3", 3)
+
+    assert conteos_en_diario() == 0
+    with closing(conectar()) as con:
+        assert int(leer_estado(con, "seq_compactado", 0)) == 3
+    assert cargar_datos()[COL_CANTIDAD_ACTUAL].notna().sum() == 3
+
+
+def test_conteo_de_un_codigo_que_no_esta_no_toca_el_inventario():
+    importar_archivo(archivo_csv(productos(1, 2)))
+
+    registrar_conteo_por_codigo("99", 3)
+
+    df = cargar_datos()
+    assert df[COL_CANTIDAD_ACTUAL].isna().all()
+    assert df[COL_CODIGO].tolist() == ["1", "2"]
@@ -0,0 +1,44 @@
+import io
+import pandas as pd
+from inventario import (
+    COL_CODIGO, COL_NOMBRE, COL_BARRAS, COL_STOCK, COL_CANTIDAD_ACTUAL,
+    importar_archivo, cargar_datos, guardar_datos, registrar_conteo_por_codigo, exportar_inventario_csv
+)
+from catalogos import archivo_csv, productos, cantidad
+
+
+def importar_con_stock():
+    filas = [(*p, stock) for p, stock in zip(productos(1, 2, 3), [5, 0, 12])]
+    importar_archivo(archivo_csv(filas, (COL_CODIGO, COL_NOMBRE, COL_BARRAS, COL_STOCK)))
+
+
+def catalogo_completo():
+    return pd.read_csv(io.BytesIO(exportar_inventario_csv()), sep=";", dtype=str, keep_default_na=False)
+
+
+def test_guardar_el_dataframe_reducido_no_borra_columnas_del_archivo():
+    importar_con_stock()
+    df = cargar_datos().copy()
+    assert COL_STOCK not in df.columns
+    df.loc[df[COL_CODIGO] == "2", COL_CANTIDAD_ACTUAL] = 4
+
+    guardar_datos(df)
+
+    completo = catalogo_completo()
+    assert completo[COL_STOCK].tolist() == ["5", "0", "12"]
+    assert completo[COL_CANTIDAD_ACTUAL].tolist() == ["", "4", ""]
+    assert cantidad(cargar_datos(), "2") == 4
+
+
+def test_guardar_no_borra_conteos_que_el_dataframe_no_trae():
+    importar_con_stock()
+    df = cargar_datos().copy()
+    # Contado por otra sesión después de leer `df`
+    registrar_conteo_por_codigo("3", 2.5)
+    df.loc[df[COL_CODIGO] == "1", COL_CANTIDAD_ACTUAL] = 1
+
+    guardar_datos(df)
+
+    df = cargar_datos()
+    assert (cantidad(df, "1"), cantidad(df, "3")) == (1, 2.5)
+    assert catalogo_completo()[COL_STOCK].tolist() == ["5", "0", "12"]
@@ -0,0 +1,81 @@
+import pytest
+import inventario
+from inventario import (
+    COL_CODIGO, COL_NOMBRE, COL_BARRAS, COL_CANTIDAD_ACTUAL,
+    obtener_almacen, importar_archivo, cargar_datos, registrar_conteo_por_codigo, buscar_producto
+)
+from catalogos import archivo_csv, productos, cantidad
+
+
+@pytest.fixture
+def bloques_de_3(monkeypatch):
+    monkeypatch.setattr(inventario, "FILAS_POR_BLOQUE", 3)
+
+
+def test_importa_por_bloques(bloques_de_3):
+    resumen = importar_archivo(archivo_csv(productos(*range(1, 9)) + [("", "Sin código", "")]))
+
+    assert resumen.filas == 8
+    assert resumen.sin_codigo == 1
+    df = cargar_datos()
+    assert df[COL_CODIGO].tolist() == [str(i) for i in range(1, 9)]
+    assert df[COL_CANTIDAD_ACTUAL].isna().all()
+
+
+def test_decimal_en_un_bloque_posterior(bloques_de_3):
+    columnas = (COL_CODIGO, COL_NOMBRE, COL_BARRAS, COL_CANTIDAD_ACTUAL)
+    filas = [(*p, n) for p, n in zip(productos(*range(1, 8)), [1, 2, 3, "", 4, "2.5", 6])]
+
+    resumen = importar_archivo(archivo_csv(filas, columnas))
+
+    assert resumen.filas == 7
+    df = cargar_datos()
+    assert cantidad(df, "6") == 2.5
+    assert cantidad(df, "1") == 1
+    assert df[COL_CANTIDAD_ACTUAL].isna().sum() == 1
+
+
+def test_conserva_productos_con_decimales_de_un_bloque_entero(bloques_de_3):
+    importar_archivo(archivo_csv(productos(*range(1, 6))))
+    registrar_conteo_por_codigo("5", 1.5)
+    # Compactado: el 1.5 queda escrito en el archivo del que salen los productos conservados
+    obtener_almacen().compactar()
+
+    # El archivo nuevo trae solo enteros y no trae el producto 5, que se conserva al final
+    columnas = (COL_CODIGO, COL_NOMBRE, COL_BARRAS, COL_CANTIDAD_ACTUAL)
+    filas = [(*p, n) for p, n in zip(productos(1, 2, 3, 4, 6), [7, 1, 3, 5, 2])]
+    resumen = importar_archivo(archivo_csv(filas, columnas))
+
+    assert resumen.conservados == 1
+    assert cantidad(cargar_datos(), "5") == 1.5
+
+
+def test_faltan_columnas_requeridas():
+    with pytest.raises(ValueError, match="Faltan columnas"):
+        importar_archivo(archivo_csv([(1, "x")], columnas=(COL_CODIGO, COL_NOMBRE)))
+
+
+def test_combinar_mantiene_conteos_aunque_cambie_el_orden(bloques_de_3):
+    importar_archivo(archivo_csv(productos(1, 2, 3, 4)))
+    registrar_conteo_por_codigo("3", 9)
+
+    resumen = importar_archivo(archivo_csv(productos(4, 3, 9, 1)))
+
+    assert (resumen.nuevos, resumen.conservados) == (1, 1)
+    df = cargar_datos()
+    assert df[COL_CODIGO].tolist() == ["4", "3", "9", "1", "2"]
+    idx, producto = buscar_producto(df, "77000003")
+    assert producto[COL_CODIGO] == "3"
+    assert producto[COL_CANTIDAD_ACTUAL] == 9
+    assert buscar_producto(df, "9", "codigo")[0] == 2
+
+
+def test_sin_combinar_reemplaza_catalogo_y_conteos():
+    importar_archivo(archivo_csv(productos(1, 2)))
+    registrar_conteo_por_codigo("1", 5)
+
+    importar_archivo(archivo_csv(productos(2, 3)), combinar=False)
+
+    df = cargar_datos()
+    assert df[COL_CODIGO].tolist() == ["2", "3"]
+    assert df[COL_CANTIDAD_ACTUAL].isna().all()
@@ -0,0 +1,28 @@
+import pandas as pd
+from inventario import IndiceBarras, normalizar_codigo_barras
+
+
+def test_normaliza_codigos_de_barras():
+    assert normalizar_codigo_barras(" 07701234.0 ") == "7701234"
+    assert normalizar_codigo_barras("abc-12") == "ABC-12"
+    assert normalizar_codigo_barras("nan") == ""
+    assert normalizar_codigo_barras("000") == "0"
+
+
+def test_indice_barras_con_varios_codigos_por_celda_y_colisiones():
+    indice = IndiceBarras(pd.Series(["7701, 7702", "07703", "", "7701|7704"]))
+
+    assert indice.buscar("7702") == [0]
+    assert indice.buscar("7703.0") == [1]
+    assert indice.buscar("7701") == [0, 3]
+    assert indice.buscar("9999") == []
+    assert indice.colisiones == {"7701": [0, 3]}
+
+
+def test_indice_barras_por_bloques():
+    indice = IndiceBarras()
+    indice.agregar(pd.Series(["1", "2"], index=[0, 1]))
+    indice.agregar(pd.Series(["2", "3"], index=[2, 3]))
+
+    assert indice.buscar("2") == [1, 2]
+    assert indice.buscar("3") == [3]
@@ -0,0 +1,46 @@
+import pandas as pd
+from inventario import IndiceNombres, normalizar_texto
+
+NOMBRES = pd.Series([
+    "Audífono Samsung negro",
+    "Cargador Xiaomi USB-C",
+    "Cable USB-C 1m",
+    "Audífonos JBL bluetooth",
+    None,
+    "Forro iPhone 13 azul",
+])
+
+
+def test_normaliza_texto():
+    assert normalizar_texto("Audífono 3.5mm") == "audifono 3 5mm"
+
+
+def test_nombres_por_prefijo_sin_tildes():
+    indice = IndiceNombres(NOMBRES)
+
+    assert set(indice.buscar("audif")) == {0, 3}
+    assert indice.buscar("audífono") == [0, 3]
+
+
+def test_nombres_exige_todas_las_palabras():
+    indice = IndiceNombres(NOMBRES)
+
+    assert indice.buscar("usb c cable") == [2]
+    assert indice.buscar("cargador jbl") == []
+
+
+def test_nombres_con_errores_de_tipeo_y_subcadenas():
+    indice = IndiceNombres(NOMBRES)
+
+    assert indice.buscar("cargdor") == [1]
+    assert indice.buscar("phone") == [5]
+
+
+def test_nombres_limite_y_vacios():
+    indice = IndiceNombres(NOMBRES)
+
+    # Empatados en puntaje: primero el nombre más corto
+    assert indice.buscar("usb") == [2, 1]
+    assert indice.buscar("usb", limite=1) == [2]
+    assert indice.buscar("") == []
+    assert 4 not in indice.nombres
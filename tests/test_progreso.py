@@ -0,0 +1,43 @@
+from inventario import (
+    COL_CODIGO, COL_NOMBRE, COL_BARRAS, ARCHIVO_INVENTARIO, AlmacenInventario,
+    importar_archivo, registrar_conteo_por_codigo, progreso_conteo
+)
+from catalogos import archivo_csv, productos
+
+
+def catalogo_con_categorias():
+    categorias = ["Audio", "Audio", "Carga", None]
+    filas = [(*p, c or "") for p, c in zip(productos(1, 2, 3, 4), categorias)]
+    return archivo_csv(filas, (COL_CODIGO, COL_NOMBRE, COL_BARRAS, "Categoría"))
+
+
+def test_progreso_cuenta_cada_producto_una_vez():
+    importar_archivo(archivo_csv(productos(1, 2, 3, 4)))
+
+    registrar_conteo_por_codigo("1", 1)
+    registrar_conteo_por_codigo("1", 2)
+    registrar_conteo_por_codigo("4", 0)
+
+    progreso = progreso_conteo()
+    assert (progreso.contados, progreso.total) == (2, 4)
+
+
+def test_progreso_por_categoria():
+    importar_archivo(catalogo_con_categorias())
+
+    registrar_conteo_por_codigo("2", 5)
+    registrar_conteo_por_codigo("3", 1)
+
+    assert progreso_conteo().desglose["Categoría"] == {"Audio": [1, 2], "Carga": [1, 1], "": [0, 1]}
+
+
+def test_otro_proceso_suma_los_conteos_del_diario():
+    importar_archivo(catalogo_con_categorias())
+    otro = AlmacenInventario(ARCHIVO_INVENTARIO)
+    otro.obtener()
+
+    registrar_conteo_por_codigo("1", 3)
+    otro.obtener()
+
+    assert otro.progreso.contados == 1
+    assert otro.progreso.desglose["Categoría"]["Audio"] == [1, 2]
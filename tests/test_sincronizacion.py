@@ -0,0 +1,201 @@
+import time
+import threading
+from datetime import date
+from contextlib import closing
+import pytest
+import inventario
+import sincronizacion
+from base_datos import conectar
+from alegra import UMBRAL_FALLOS, obtener_cliente_alegra
+from log_ajustes import pagina_log
+from sincronizacion import (
+    ESTADO_RECONCILIAR, ESTADO_PENDIENTE, ESTADO_ENVIANDO, ESTADO_ENVIADO, ESTADO_FALLIDO, LATIDO_VENCIDO,
+    encolar_ajuste, ultimo_ajuste_item, resumen_cola, listar_fallidos, reintentar_fallidos,
+    liberar_interrumpidos, procesar_cola, reconciliar_cola, _tomar_pendientes
+)
+
+
+def ajuste(item_id, cantidad_anterior, cantidad_contada, base_actualizado=None):
+    diferencia = 0 if cantidad_anterior is None else cantidad_contada - cantidad_anterior
+    return {
+        "codigo_barras": f"770{item_id:0>5}",
+        "item_id": str(item_id),
+        "nombre": f"Producto {item_id}",
+        "precio": 2500,
+        "cantidad_anterior": cantidad_anterior,
+        "cantidad_contada": cantidad_contada,
+        "diferencia": diferencia,
+        "tipo_ajuste": None if diferencia == 0 else ("in" if diferencia > 0 else "out"),
+        "costo_unitario": 1000,
+        "base_actualizado": base_actualizado
+    }
+
+
+@pytest.fixture
+def sin_conexion():
+    circuito = obtener_cliente_alegra().circuito
+    for _ in range(UMBRAL_FALLOS):
+        circuito.fallo()
+    return circuito
+
+
+def test_sin_conexion_no_envia_nada(stub, sin_conexion):
+    encolar_ajuste(ajuste(1, 10, 12))
+
+    assert procesar_cola() == []
+    assert resumen_cola()[ESTADO_PENDIENTE] == 1
+    assert not stub.llamadas
+
+
+def test_reconciliar_recalcula_contra_el_stock_actual(stub):
+    # Contado sin conexión contra una foto de 10; mientras tanto Alegra pasó a 6
+    encolar_ajuste(ajuste(1, 10, 8), reconciliar=True)
+    stub.stock["1"] = 6
+
+    resultado = reconciliar_cola()
+
+    assert resultado == {"pendientes": 1, "recalculados": 1, "sin_diferencia": 0, "fallidos": 0}
+    fila = ultimo_ajuste_item("1")
+    assert (fila["estado"], fila["tipo"], fila["cantidad"], fila["cantidad_anterior"]) == (ESTADO_PENDIENTE, "in", 2, 6)
+
+    procesar_cola()
+    assert ultimo_ajuste_item("1")["estado"] == ESTADO_ENVIADO
+    assert stub.stock["1"] == 8
+
+
+def test_reconciliar_conteo_sin_foto_del_stock(stub):
+    encolar_ajuste(ajuste(2, None, 4), reconciliar=True)
+
+    resultado = reconciliar_cola()
+
+    assert resultado == {"pendientes": 1, "recalculados": 0, "sin_diferencia": 0, "fallidos": 0}
+    fila = ultimo_ajuste_item("2")
+    assert (fila["tipo"], fila["cantidad"], fila["cantidad_anterior"], fila["diferencia"]) == ("out", 6, 10, -6)
+
+
+def test_reconciliar_descarta_conteos_que_ya_coinciden(stub):
+    encolar_ajuste(ajuste(3, 7, 10), reconciliar=True)
+
+    assert reconciliar_cola()["sin_diferencia"] == 1
+    assert ultimo_ajuste_item("3") is None
+
+
+def test_conteo_nuevo_reemplaza_al_que_esperaba_reconciliar(stub):
+    encolar_ajuste(ajuste(4, 10, 3), reconciliar=True)
+    encolar_ajuste(ajuste(4, 10, 12))
+
+    resumen = resumen_cola()
+    assert (resumen[ESTADO_RECONCILIAR], resumen[ESTADO_PENDIENTE]) == (0, 1)
+
+
+def test_procesar_cola_envia_en_un_documento_y_registra_el_log(stub):
+    encolar_ajuste(ajuste(1, 10, 12))
+    encolar_ajuste(ajuste(2, 10, 7))
+
+    procesadas = procesar_cola()
+
+    assert [f["estado"] for f in procesadas] == [ESTADO_ENVIADO, ESTADO_ENVIADO]
+    assert len({f["documento"] for f in procesadas}) == 1
+    assert stub.stock == {"1": 12, "2": 7}
+    log, total = pagina_log()
+    assert total == 2
+    assert sorted(log["id_alegra"]) == ["1", "2"]
+
+
+def test_item_rechazado_queda_fallido_sin_frenar_el_resto(stub):
+    stub.invalidos = {"2"}
+    for item_id in (1, 2, 3):
+        encolar_ajuste(ajuste(item_id, 10, 11))
+
+    procesar_cola()
+
+    assert [f["item_id"] for f in listar_fallidos()] == ["2"]
+    assert resumen_cola()[ESTADO_ENVIADO] == 2
+    assert "2" not in stub.stock
+
+    stub.invalidos = set()
+    assert reintentar_fallidos() == 1
+    procesar_cola()
+    assert stub.stock["2"] == 11
+    assert resumen_cola()[ESTADO_FALLIDO] == 0
+
+
+def tomar_a_nombre_de(dueno):
+    with closing(conectar()) as con:
+        return _tomar_pendientes(con, dueno)
+
+
+def test_liberar_respeta_envios_de_un_proceso_vivo(stub):
+    encolar_ajuste(ajuste(1, 10, 12))
+    encolar_ajuste(ajuste(2, 10, 12))
+    tomar_a_nombre_de("vivo")
+    with closing(conectar()) as con, con:
+        # Un envío que lleva mucho rato, pero su proceso sigue latiendo
+        con.execute("UPDATE cola_ajustes SET proximo_intento = 0, creado = '2000-01-01 00:00:00'")
+
+    assert liberar_interrumpidos() == 0
+    assert resumen_cola()[ESTADO_ENVIANDO] == 2
+
+
+def test_liberar_marca_fallidos_los_envios_de_un_proceso_muerto(stub):
+    encolar_ajuste(ajuste(1, 10, 12))
+    tomar_a_nombre_de("muerto")
+    encolar_ajuste(ajuste(2, 10, 12))
+    tomar_a_nombre_de("vivo")
+    with closing(conectar()) as con, con:
+        con.execute("UPDATE trabajadores SET latido = ? WHERE dueno = 'muerto'", (time.time() - LATIDO_VENCIDO - 1,))
+
+    assert liberar_interrumpidos() == 1
+    assert ultimo_ajuste_item("1")["estado"] == ESTADO_FALLIDO
+    assert ultimo_ajuste_item("2")["estado"] == ESTADO_ENVIANDO
+
+
+def test_procesar_cola_no_espera_el_bloqueo_del_inventario(stub):
+    encolar_ajuste(ajuste(1, 10, 12))
+    tomado, soltar = threading.Event(), threading.Event()
+
+    def retener():
+        with inventario.LOCK:
+            tomado.set()
+            soltar.wait(10)
+
+    hilo = threading.Thread(target=retener)
+    hilo.start()
+    tomado.wait()
+    try:
+        assert [f["estado"] for f in procesar_cola()] == [ESTADO_ENVIADO]
+    finally:
+        soltar.set()
+        hilo.join()
+
+
+def test_corte_a_mitad_solo_suelta_los_grupos_que_no_salieron(stub, monkeypatch):
+    for dia, item_id in ((1, 1), (2, 2), (3, 3)):
+        encolar_ajuste(ajuste(item_id, 10, 12), fecha=date(2026, 1, dia))
+    enviar = sincronizacion.enviar_ajustes_en_lotes
+
+    def cortar_el_segundo_dia(items, fecha, *args):
+        if fecha.day == 2:
+            raise KeyboardInterrupt
+        return enviar(items, fecha, *args)
+
+    monkeypatch.setattr(sincronizacion, "enviar_ajustes_en_lotes", cortar_el_segundo_dia)
+    with pytest.raises(KeyboardInterrupt):
+        procesar_cola()
+
+    assert ultimo_ajuste_item("1")["estado"] == ESTADO_ENVIADO
+    assert ultimo_ajuste_item("2")["estado"] == ESTADO_FALLIDO
+    assert ultimo_ajuste_item("3")["estado"] == ESTADO_PENDIENTE
+    assert stub.stock == {"1": 12}
+
+
+def test_error_en_el_log_no_deshace_un_ajuste_aceptado(stub, monkeypatch):
+    encolar_ajuste(ajuste(1, 10, 12))
+
+    def sin_disco(**_):
+        raise OSError("disco lleno")
+
+    monkeypatch.setattr(sincronizacion, "guardar_log_ajuste", sin_disco)
+    assert [f["estado"] for f in procesar_cola()] == [ESTADO_ENVIADO]
+    assert ultimo_ajuste_item("1")["estado"] == ESTADO_ENVIADO
+    assert stub.stock == {"1": 12}